@@ -0,0 +1,1201 @@
+#!/usr/bin/env python3
+"""
+Pokemon Card Search - Benchmarks
+Load benchmarks for python_server.py against a local fake Bulbapedia
+"""
+
+import argparse
+import base64
+import gzip
+import html
+import http.client
+import http.server
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import python_server
+
+try:
+    import resource  # Unix only: peak RSS
+except ImportError:
+    resource = None
+
+
+class FakeBulbapediaHandler(http.server.BaseHTTPRequestHandler):
+    """Serves canned api.php search JSON after a configurable delay, failing a share of calls"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.05
+    error_rate = 0.0
+    total_hits = 100  # matches per search, paged through with sroffset
+
+    def do_GET(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        term = params.get('srsearch', [''])[0]
+        offset = int(params.get('sroffset', ['0'])[0])
+        limit = max(0, min(int(params.get('srlimit', ['20'])[0]), self.total_hits - offset))
+        time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        # "Unknown..." queries find nothing as TCG searches, forcing the fallback
+        if term.startswith('Unknown') and term.endswith(' TCG'):
+            limit = 0
+        results = [{
+            'title': f"{term} ({index})",
+            'snippet': f"A Pokemon TCG card matching {term}",
+            'size': 1000 + index,
+        } for index in range(offset, offset + limit)]
+        data = {'query': {'search': results}}
+        if limit and offset + limit < self.total_hits:
+            data['continue'] = {'sroffset': offset + limit, 'continue': '-||'}
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QuietHandler(python_server.PokemonCardHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_bulbapedia(latency, error_rate=0.0):
+    """Start the fake upstream and point the server module at it"""
+    handler = type('FakeBulbapedia', (FakeBulbapediaHandler,), {'latency': latency, 'error_rate': error_rate})
+    server_class = type('FakeBulbapediaServer', (http.server.ThreadingHTTPServer,), {'request_queue_size': 256})
+    upstream = server_class(('127.0.0.1', 0), handler)
+    upstream.daemon_threads = True
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    python_server.BULBAPEDIA_API_URL = f"http://127.0.0.1:{upstream.server_address[1]}/w/api.php"
+    # Measure the server itself rather than how politely it paces Bulbapedia calls
+    python_server.UPSTREAM_LIMITER.rate = 0
+    return upstream
+
+
+def start_server(threads, queue_size=python_server.REQUEST_QUEUE_SIZE, handler=QuietHandler, engine='threaded'):
+    """Start the card search server on an ephemeral port"""
+    if engine == 'asyncio':
+        server = python_server.AsyncioServer(('127.0.0.1', 0), handler, workers=threads)
+    elif threads <= 0:
+        server = python_server.socketserver.TCPServer(('127.0.0.1', 0), handler)
+    else:
+        server = python_server.BoundedThreadPoolServer(('127.0.0.1', 0), handler,
+                                                       workers=threads, queue_size=queue_size)
+    # Clients that time out leave broken pipes behind; don't dump their tracebacks
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_load(url, concurrency, requests, timeout=30):
+    """Fire requests at url from concurrent clients, returning throughput and latencies.
+
+    url may be a callable taking the request index, to vary requests; it may
+    return a urllib.request.Request to send a POST.
+    """
+    return summarize_load(*run_clients(url, concurrency, requests, timeout))
+
+
+def run_clients(url, concurrency, requests, timeout=30):
+    """run_load() without the summary: (sorted latencies, status counts, seconds)"""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    remaining = [requests]
+    url_for = url if callable(url) else (lambda index: url)
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                index = remaining[0]
+            url = url_for(index)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except OSError:
+                status = 0
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    duration = time.perf_counter() - started
+    latencies.sort()
+    return latencies, statuses, duration
+
+
+def summarize_load(latencies, statuses, duration):
+    return {
+        'requests': len(latencies),
+        'seconds': round(duration, 3),
+        'rps': round(len(latencies) / duration, 1) if duration else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'statuses': statuses,
+    }
+
+
+def rss_mb():
+    """Current and peak resident set size of this process in MB (the server runs in-process)"""
+    current = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    current = round(int(line.split()[1]) / 1024, 1)
+                    break
+    except OSError:
+        pass
+    peak = None
+    if resource is not None:
+        # ru_maxrss is KB on Linux, bytes on macOS
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        peak = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    return {'rss_mb': current, 'peak_rss_mb': peak}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def bench_workers(args):
+    """Throughput of /api/search as the worker pool grows"""
+    upstream = start_fake_bulbapedia(args.latency)
+    results = []
+    try:
+        for threads in args.threads:
+            server = start_server(threads)
+            base = f"http://127.0.0.1:{server.server_address[1]}/api/search?q=Pikachu+"
+            try:
+                # Distinct queries so every request reaches the (slow) upstream
+                result = run_load(lambda index: f"{base}{threads}-{index}", args.concurrency, args.requests)
+            finally:
+                server.shutdown()
+                server.server_close()
+            result['threads'] = threads
+            results.append(result)
+            print(f"threads={threads:>3}  {result['rps']:>8} req/s  "
+                  f"p50={result['p50_ms']}ms  p95={result['p95_ms']}ms  {result['statuses']}")
+    finally:
+        upstream.shutdown()
+    return results
+
+
+def bench_strategy(args):
+    """Latency of the sequential and parallel search strategies"""
+    upstream = start_fake_bulbapedia(args.latency)
+    fallback_every = max(1, int(round(1 / args.fallback_ratio))) if args.fallback_ratio > 0 else 0
+    queries = [f"Unknown {index}" if fallback_every and index % fallback_every == 0 else f"Pikachu {index}"
+               for index in range(args.requests)]
+    results = {}
+    try:
+        for strategy in python_server.SEARCH_STRATEGIES:
+            histogram = python_server.SEARCH_LATENCY[strategy] = python_server.LatencyHistogram()
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                python_server.search_bulbapedia(query, strategy)
+                latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            results[strategy] = {
+                'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+                'histogram': histogram.snapshot(),
+            }
+            print(f"{strategy:>10}  p50={results[strategy]['p50_ms']}ms  p95={results[strategy]['p95_ms']}ms")
+    finally:
+        upstream.shutdown()
+    return results
+
+
+def legacy_main_page():
+    return python_server.MAIN_PAGE_HTML.encode()
+
+
+def legacy_sets():
+    sets = [{
+        'title': set_info['title'],
+        'description': set_info['description'],
+        'url': f"{python_server.BULBAPEDIA_WIKI_URL}{urllib.parse.quote(set_info['title'] + ' (TCG)')}"
+    } for set_info in python_server.POPULAR_SETS]
+    return json.dumps({'sets': sets}).encode()
+
+
+class LegacyStaticHandler(QuietHandler):
+    """Serves / and /api/sets by rebuilding them per request, as before precomputation"""
+
+    def serve_main_page(self):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
+        self.end_headers()
+        self.wfile.write(legacy_main_page())
+
+    def handle_sets_api(self):
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(legacy_sets())
+
+
+def bench_static(args):
+    """Per-request payload cost and HTTP throughput of the precomputed static routes"""
+    python_server.build_static_responses()
+    payloads = {
+        'main_page': legacy_main_page,
+        'sets': legacy_sets,
+    }
+    results = {}
+    for name, legacy in payloads.items():
+        precomputed = python_server.get_static_response(name)
+        timings = {}
+        for label, build in (('rebuilt', legacy),
+                             ('precomputed', lambda: precomputed.select('gzip, deflate, br'))):
+            started = time.perf_counter()
+            for _ in range(args.iterations):
+                build()
+            timings[label] = round((time.perf_counter() - started) / args.iterations * 1e6, 2)
+        results[name] = {'payload_us': timings}
+        print(f"{name:>10}  rebuilt={timings['rebuilt']}us  precomputed={timings['precomputed']}us per request")
+
+    for label, handler in (('rebuilt', LegacyStaticHandler), ('precomputed', QuietHandler)):
+        server = start_server(args.threads, handler=handler)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            for name, path in (('main_page', '/'), ('sets', '/api/sets')):
+                result = run_load(base + path, args.concurrency, args.requests)
+                results[name][f"http_{label}"] = result
+                print(f"{path:>10}  {label:>11}  {result['rps']:>8} req/s  "
+                      f"p50={result['p50_ms']}ms  p95={result['p95_ms']}ms")
+        finally:
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def legacy_is_tcg_result(title, snippet):
+    """The keyword scans search results were classified with before TCGClassifier"""
+    return any(keyword in title for keyword in ['TCG', '(Base Set)', '(Jungle)', '(Fossil)', '(Team Rocket)']) or \
+           any(keyword in snippet for keyword in ['card', 'TCG'])
+
+
+def make_search_results(count, seed=0):
+    """Bulbapedia-like (title, snippet) pairs: card pages across the set catalog, plus other pages"""
+    rng = random.Random(seed)
+    sets = [set_info['title'] for set_info in python_server.POPULAR_SETS]
+    variants = ['', ' Holo rare.', ' A shadowless holo print exists.', ' Reverse Holo and 1st Edition prints exist.']
+    results = []
+    for index in range(count):
+        name = rng.choice(python_server.COMMON_CARDS[:10])
+        marked = f'<span class="searchmatch">{name}</span>'
+        if index % 3:
+            set_name = rng.choice(sets)
+            number = rng.randint(1, 110)
+            results.append((f"{name} ({set_name} {number})",
+                            f"{marked} ({html.escape(set_name)} {number}/{rng.randint(number, 130)}) is a "
+                            f"Pokemon card first released in the {html.escape(set_name)} expansion."
+                            f"{rng.choice(variants)}"))
+        else:
+            results.append((f"{name} (Pokemon)",
+                            f"{marked} is a Pokemon introduced in Generation I. It evolves at level {index % 60}."))
+    return results
+
+
+def bench_classify(args):
+    """Per-result cost of classifying search results: legacy keyword scans vs the compiled TCGClassifier"""
+    results_in = make_search_results(args.results)
+    classifier = python_server.get_tcg_classifier()
+    timings = {}
+    for label, classify in (('legacy', legacy_is_tcg_result), ('compiled', classifier.classify)):
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            for title, snippet in results_in:
+                classify(title, snippet)
+        timings[label] = (time.perf_counter() - started) / (args.rounds * len(results_in))
+    classified = [classifier.classify(title, snippet) for title, snippet in results_in]
+    results = {
+        'results': len(results_in),
+        'us_per_result': {label: round(seconds * 1e6, 3) for label, seconds in timings.items()},
+        'tcg': {
+            'legacy': sum(legacy_is_tcg_result(title, snippet) for title, snippet in results_in),
+            'compiled': sum(fields['isTCG'] for fields in classified),
+        },
+        'with_set': sum(fields['set'] is not None for fields in classified),
+        'with_number': sum(fields['cardNumber'] is not None for fields in classified),
+        'with_variants': sum(bool(fields['variants']) for fields in classified),
+    }
+    for label in timings:
+        print(f"{label:>9}  {results['us_per_result'][label]:>7}us/result  "
+              f"{results['tcg'][label]} of {len(results_in)} classified TCG")
+    print(f"  compiled extracted a set for {results['with_set']}, a card number for {results['with_number']} "
+          f"and variants for {results['with_variants']}")
+    return results
+
+
+class LegacyUploadHandler(QuietHandler):
+    """Reads, decodes and parses the whole upload at once, as before streaming"""
+
+    def handle_image_analysis(self):
+        post_data = self.rfile.read(int(self.headers['Content-Length']))
+        data = json.loads(post_data.decode('utf-8'))
+        image = base64.b64decode(data['image_data'].split(',', 1)[1])
+        self.send_json_response({'bytes': len(image)})
+
+
+class StreamingUploadHandler(QuietHandler):
+    """Decodes the upload while it streams in, like handle_image_analysis"""
+
+    def handle_image_analysis(self):
+        body = self.open_request_body()
+        if body is None:
+            return
+        image = python_server.parse_json_body(body, stream_fields=('image_data',))['image_data']
+        self.send_json_response({'bytes': len(image)})
+
+
+def bench_uploads(args):
+    """Peak Python memory while receiving concurrent large image uploads"""
+    image = os.urandom(int(args.size_mb * 1024 * 1024))
+    payload = json.dumps({'image_data': 'data:image/png;base64,' + base64.b64encode(image).decode()}).encode()
+    del image
+    python_server.MAX_REQUEST_BODY = max(python_server.MAX_REQUEST_BODY, len(payload))
+    results = {}
+    for label, handler in (('buffered', LegacyUploadHandler), ('streaming', StreamingUploadHandler)):
+        server = start_server(args.clients, handler=handler)
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/analyze-image"
+        statuses = []
+
+        def upload():
+            request = urllib.request.Request(url, data=payload, headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request, timeout=120) as response:
+                statuses.append(response.status)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        clients = [threading.Thread(target=upload) for _ in range(args.clients)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        duration = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        server.shutdown()
+        server.server_close()
+        results[label] = {
+            'clients': args.clients,
+            'payload_mb': round(len(payload) / 1024 / 1024, 2),
+            'peak_mb': round(peak / 1024 / 1024, 2),
+            'peak_per_upload_mb': round(peak / args.clients / 1024 / 1024, 2),
+            'seconds': round(duration, 3),
+            'ok': statuses.count(200),
+        }
+        print(f"{label:>10}  peak={results[label]['peak_mb']}MB  "
+              f"per upload={results[label]['peak_per_upload_mb']}MB  "
+              f"(payload {results[label]['payload_mb']}MB)  {duration:.2f}s")
+    return results
+
+
+def make_card_images(directory, count, seed=1):
+    """Write count synthetic card scans (random shapes on a coloured background)"""
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        image = Image.new('RGB', (240, 336), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randrange(240), rng.randrange(336)
+            draw.ellipse([x, y, x + rng.randrange(20, 120), y + rng.randrange(20, 120)],
+                         fill=tuple(rng.randrange(256) for _ in range(3)))
+        path = os.path.join(directory, f"Card {index:04d}.jpg")
+        image.save(path, quality=85)
+        paths.append(path)
+    return paths
+
+
+def post_json(url, data, timeout=120):
+    request = urllib.request.Request(url, data=json.dumps(data).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def bench_images(args):
+    """Per-image cost of /api/analyze-images batches vs one /api/analyze-image request per image"""
+    if python_server.Image is None:
+        print("Pillow is required for this benchmark (pip install pillow)")
+        return {}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_card_images(directory, args.cards)
+        index = python_server.CardImageIndex.build(directory)
+        uploads = []
+        for path in paths[:args.images]:
+            with open(path, 'rb') as f:
+                uploads.append('data:image/jpeg;base64,' + base64.b64encode(f.read()).decode())
+    python_server.CARD_IMAGES = index
+    if args.image_workers > 0:
+        python_server.IMAGE_POOL = python_server.ImageWorkerPool(args.image_workers)
+    server = start_server(args.threads)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    results = {}
+    try:
+        started = time.perf_counter()
+        correct = 0
+        for position, upload in enumerate(uploads):
+            response = post_json(f"{base}/api/analyze-image", {'image_data': upload})
+            correct += response['suggestions'][:1] == [f"Card {position:04d}"]
+        single = time.perf_counter() - started
+        results['single'] = {'images': len(uploads), 'ms_per_image': round(single / len(uploads) * 1000, 3),
+                             'correct': correct}
+
+        started = time.perf_counter()
+        correct = 0
+        for offset in range(0, len(uploads), args.batch_size):
+            response = post_json(f"{base}/api/analyze-images", {'images': uploads[offset:offset + args.batch_size]})
+            for result in response['results']:
+                correct += result.get('suggestions', [])[:1] == [f"Card {offset + result['index']:04d}"]
+        batch = time.perf_counter() - started
+        results['batch'] = {'images': len(uploads), 'batch_size': args.batch_size,
+                            'ms_per_image': round(batch / len(uploads) * 1000, 3), 'correct': correct}
+    finally:
+        server.shutdown()
+        server.server_close()
+        python_server.CARD_IMAGES = None
+        if python_server.IMAGE_POOL is not None:
+            python_server.IMAGE_POOL.close()
+            python_server.IMAGE_POOL = None
+    for label, result in results.items():
+        print(f"{label:>7}  {result['ms_per_image']:>7}ms/image  "
+              f"{result['correct']}/{result['images']} matched correctly")
+    print(f"  (reference cards: {args.cards}, vectorized: {python_server.numpy is not None}, "
+          f"image worker processes: {args.image_workers})")
+    return results
+
+
+# What the embedded page fetches for one lookup: the page, typeahead as the name is typed,
+# the search itself, then the sets and web-search panels
+FRONTEND_REQUESTS = [
+    '/',
+    '/api/suggest?prefix=pi',
+    '/api/suggest?prefix=pika',
+    '/api/suggest?prefix=pikachu',
+    '/api/search?q=pikachu',
+    '/api/sets',
+    '/api/web-search?q=pikachu',
+]
+
+
+def run_frontend_session(port, keep_alive):
+    """Fetch FRONTEND_REQUESTS in order, returning the total seconds taken"""
+    headers = {'Accept-Encoding': 'gzip'}
+    if not keep_alive:
+        headers['Connection'] = 'close'
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    started = time.perf_counter()
+    try:
+        for path in FRONTEND_REQUESTS:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if not keep_alive:
+                connection.close()
+    finally:
+        connection.close()
+    return time.perf_counter() - started
+
+
+def bench_keepalive(args):
+    """Latency of the frontend's request pattern with and without persistent connections"""
+    upstream = start_fake_bulbapedia(args.latency)
+    results = {}
+    try:
+        server = start_server(args.threads)
+        port = server.server_address[1]
+        # Warm the search cache so the comparison is about connection handling
+        run_frontend_session(port, keep_alive=True)
+        try:
+            for label, keep_alive in (('new connections', False), ('keep-alive', True)):
+                timings = []
+                lock = threading.Lock()
+
+                def client():
+                    for _ in range(args.sessions):
+                        elapsed = run_frontend_session(port, keep_alive)
+                        with lock:
+                            timings.append(elapsed)
+
+                clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+                for thread in clients:
+                    thread.start()
+                for thread in clients:
+                    thread.join()
+                timings.sort()
+                results[label] = {
+                    'sessions': len(timings),
+                    'requests_per_session': len(FRONTEND_REQUESTS),
+                    'mean_ms': round(sum(timings) / len(timings) * 1000, 2),
+                    'p50_ms': round(percentile(timings, 50) * 1000, 2),
+                    'p95_ms': round(percentile(timings, 95) * 1000, 2),
+                }
+                print(f"{label:>16}  session mean={results[label]['mean_ms']}ms  "
+                      f"p50={results[label]['p50_ms']}ms  p95={results[label]['p95_ms']}ms")
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        upstream.shutdown()
+    return results
+
+
+def bench_engines(args):
+    """/api/search under slow upstream with many idle client connections, per engine"""
+    upstream = start_fake_bulbapedia(args.latency)
+    results = {}
+    try:
+        for engine in python_server.SERVER_ENGINES:
+            server = start_server(args.threads, engine=engine)
+            port = server.server_address[1]
+            idle = []
+            try:
+                # Connections that are open but send nothing, like browser preconnects
+                for _ in range(args.idle):
+                    idle.append(socket.create_connection(('127.0.0.1', port)))
+                base = f"http://127.0.0.1:{port}/api/search?q={engine}+"
+                result = run_load(lambda index: f"{base}{index}", args.concurrency, args.requests,
+                                  timeout=args.timeout)
+            finally:
+                for sock in idle:
+                    sock.close()
+                server.shutdown()
+                server.server_close()
+            results[engine] = result
+            print(f"{engine:>9}  {result['rps']:>8} req/s  p50={result['p50_ms']}ms  "
+                  f"p95={result['p95_ms']}ms  {result['statuses']}")
+    finally:
+        upstream.shutdown()
+    return results
+
+
+def bench_pagination(args):
+    """Latency of later /api/search pages for clients paging through results, with and without prefetch"""
+    upstream = start_fake_bulbapedia(args.latency)
+    results = {}
+    try:
+        for concurrency in (0, args.prefetch_concurrency):
+            label = 'prefetch' if concurrency else 'no prefetch'
+            python_server.SEARCH_PREFETCH_CONCURRENCY = concurrency
+            python_server.SEARCH_PREFETCHER = python_server.SearchPrefetcher()
+            python_server.SEARCH_CACHE.clear()
+            server = start_server(args.threads)
+            base = f"http://127.0.0.1:{server.server_address[1]}/api/search?q="
+            lock = threading.Lock()
+            first, later, cache = [], [], {}
+            remaining = [args.sessions]
+
+            def session():
+                while True:
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                        index = remaining[0]
+                    query = f"{base}{label.replace(' ', '+')}+{index}"
+                    url = query
+                    for number in range(args.pages):
+                        started = time.perf_counter()
+                        with urllib.request.urlopen(url, timeout=30) as response:
+                            page = json.loads(response.read())
+                            status = response.headers.get('X-Cache', '')
+                        elapsed = time.perf_counter() - started
+                        with lock:
+                            if number:
+                                later.append(elapsed)
+                                cache[status] = cache.get(status, 0) + 1
+                            else:
+                                first.append(elapsed)
+                        if not page['next']:
+                            break
+                        url = f"{query}&cursor={page['next']}"
+                        time.sleep(args.think)
+
+            upstream_before = python_server.UPSTREAM.stats()['requests']
+            clients = [threading.Thread(target=session) for _ in range(args.concurrency)]
+            try:
+                for thread in clients:
+                    thread.start()
+                for thread in clients:
+                    thread.join()
+                # Let any prefetch still in flight land before counting upstream calls
+                time.sleep(args.latency * 2)
+            finally:
+                server.shutdown()
+                server.server_close()
+            first.sort()
+            later.sort()
+            results[label] = {
+                'first_page_p50_ms': round(percentile(first, 50) * 1000, 2),
+                'later_pages_p50_ms': round(percentile(later, 50) * 1000, 2),
+                'later_pages_p95_ms': round(percentile(later, 95) * 1000, 2),
+                'later_pages_hit_ratio': round(cache.get('HIT', 0) / len(later), 3) if later else 0.0,
+                'upstream_calls': python_server.UPSTREAM.stats()['requests'] - upstream_before,
+                'prefetch': python_server.SEARCH_PREFETCHER.stats(),
+            }
+            result = results[label]
+            print(f"{label:>12}  first page p50={result['first_page_p50_ms']}ms  "
+                  f"later pages p50={result['later_pages_p50_ms']}ms  p95={result['later_pages_p95_ms']}ms  "
+                  f"hits={result['later_pages_hit_ratio']}  upstream calls={result['upstream_calls']}")
+    finally:
+        upstream.shutdown()
+    return results
+
+
+CATALOG_TYPES = ('Fire', 'Water', 'Grass', 'Lightning', 'Psychic', 'Fighting', 'Darkness', 'Metal', 'Colorless')
+
+
+def make_catalog(path, cards, seed=2):
+    """Create a card catalog at path holding cards synthetic cards spread over the set catalog"""
+    rng = random.Random(seed)
+    sets = [set_info['title'] for set_info in python_server.POPULAR_SETS]
+    per_set = -(-cards // len(sets))
+    dump = path + '.jsonl'
+    with open(dump, 'w', encoding='utf-8') as f:
+        for index in range(cards):
+            f.write(json.dumps({
+                'name': f"{rng.choice(python_server.COMMON_CARDS[:10])} {rng.choice('ABCDEFGHIJ')}{index}",
+                'set': sets[index // per_set],
+                'number': str(index % per_set + 1),
+                'type': rng.choice(CATALOG_TYPES),
+                'rarity': rng.choice(('Common', 'Uncommon', 'Rare', 'Rare Holo')),
+                'hp': rng.randrange(30, 130, 10),
+            }) + '\n')
+    catalog = python_server.CardCatalog(path)
+    started = time.perf_counter()
+    catalog.import_dump(dump)
+    os.remove(dump)
+    return catalog, time.perf_counter() - started
+
+
+def bench_catalog(args):
+    """Import speed and /api/cards page latency for a local card catalog, keyset pages vs OFFSET"""
+    directory = tempfile.TemporaryDirectory()
+    catalog, seconds = make_catalog(os.path.join(directory.name, 'catalog.db'), args.cards)
+    results = {'cards': args.cards, 'import': {'seconds': round(seconds, 2),
+                                               'cards_per_second': round(args.cards / seconds)}}
+    print(f"   import  {args.cards} cards in {seconds:.2f}s ({results['import']['cards_per_second']} cards/s)")
+
+    def timed(run, repeat=args.repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        return round((time.perf_counter() - started) / repeat * 1000, 3)
+
+    queries = {
+        'first_page': {},
+        'type_filter': {'card_type': 'fire'},
+        'name_prefix': {'name': 'pika'},
+        'set_by_number': {'set_title': 'Jungle', 'sort': 'number'},
+    }
+    results['query_ms'] = {}
+    for label, query in queries.items():
+        results['query_ms'][label] = timed(lambda: catalog.query(limit=args.page_size, **query))
+    # A deep page: walk the cursors there once, then time fetching it again
+    cursor = None
+    for _ in range(args.depth):
+        cursor = catalog.query(limit=args.page_size, cursor=cursor)[1]
+    results['query_ms']['deep_keyset'] = timed(lambda: catalog.query(limit=args.page_size, cursor=cursor))
+    connection = catalog._connection()
+    offset_sql = (f"SELECT {catalog.COLUMNS} FROM cards c JOIN sets s ON s.id = c.set_id "
+                  f"ORDER BY c.name, c.id LIMIT ? OFFSET ?")
+    results['query_ms']['deep_offset'] = timed(
+        lambda: connection.execute(offset_sql, (args.page_size, args.depth * args.page_size)).fetchall())
+    for label, value in results['query_ms'].items():
+        print(f"{label:>14}  {value:>8}ms per {args.page_size}-card page")
+
+    python_server.CATALOG = catalog
+    server = start_server(args.threads)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        result = run_load(lambda index: f"{base}/api/cards?limit={args.page_size}&type={CATALOG_TYPES[index % 9]}",
+                          args.concurrency, args.requests)
+    finally:
+        server.shutdown()
+        server.server_close()
+        python_server.CATALOG = None
+        catalog.close()
+        directory.cleanup()
+    results['http'] = result
+    print(f"     http  {result['rps']:>8} req/s  p50={result['p50_ms']}ms  p95={result['p95_ms']}ms  "
+          f"{result['statuses']}")
+    return results
+
+
+def json_request(url, data):
+    return urllib.request.Request(url, data=json.dumps(data).encode(), headers={'Content-Type': 'application/json'})
+
+
+def route_workloads(base, queries, uploads):
+    """One request generator per route in python_server.ROUTES, keyed by route"""
+    def query(index):
+        return urllib.parse.quote_plus(f"Pikachu {index % queries}")
+
+    bulk = [f"Charizard {index}" for index in range(20)]
+    image = {'image_data': uploads[0]}
+    batch = {'images': uploads[:8]}
+    return {
+        'GET /': lambda index: f"{base}/",
+        'GET /api/search': lambda index: f"{base}/api/search?q={query(index)}",
+        'POST /api/search/bulk': lambda index: json_request(f"{base}/api/search/bulk", {'queries': bulk}),
+        'GET /api/sets': lambda index: f"{base}/api/sets",
+        'GET /api/cards': lambda index: f"{base}/api/cards?limit=50&type={CATALOG_TYPES[index % 9]}",
+        'GET /api/web-search': lambda index: f"{base}/api/web-search?q={query(index)}",
+        'GET /api/suggest': lambda index: f"{base}/api/suggest?prefix=pi",
+        'GET /api/stats': lambda index: f"{base}/api/stats",
+        'GET /metrics': lambda index: f"{base}/metrics",
+        'GET /healthz': lambda index: f"{base}/healthz",
+        'GET /readyz': lambda index: f"{base}/readyz",
+        'GET /static/': lambda index: f"{base}/static/app.js",
+        'POST /api/analyze-image': lambda index: json_request(f"{base}/api/analyze-image", image),
+        'POST /api/analyze-images': lambda index: json_request(f"{base}/api/analyze-images", batch),
+        'POST /api/google-image-search': lambda index: json_request(
+            f"{base}/api/google-image-search", {'search_query': 'pikachu'}),
+    }
+
+
+def bench_routes(args):
+    """Throughput, latency percentiles and RSS for every route against a fake Bulbapedia"""
+    upstream = start_fake_bulbapedia(args.latency, args.error_rate)
+    directory = tempfile.TemporaryDirectory()
+    if python_server.Image is not None:
+        paths = make_card_images(directory.name, args.cards)
+        python_server.CARD_IMAGES = python_server.CardImageIndex.build(directory.name)
+        uploads = []
+        for path in paths[:8]:
+            with open(path, 'rb') as f:
+                uploads.append('data:image/jpeg;base64,' + base64.b64encode(f.read()).decode())
+    else:
+        # Without Pillow the image routes can't match; routes that refuse outright are left out below
+        uploads = ['data:image/jpeg;base64,' + base64.b64encode(os.urandom(32 * 1024)).decode()] * 8
+    python_server.CATALOG = make_catalog(os.path.join(directory.name, 'catalog.db'), args.catalog_cards)[0]
+    # A real file for the /static/ workload, about the size of the frontend script
+    static_dir = os.path.join(directory.name, 'static')
+    os.mkdir(static_dir)
+    with open(os.path.join(static_dir, 'app.js'), 'w', encoding='utf-8') as f:
+        f.write('// benchmark asset\n' + 'function noop(index) { return index * 2; }\n' * 700)
+    static_dir_before, python_server.STATIC_DIR = python_server.STATIC_DIR, static_dir
+
+    wanted = set(args.routes or ())
+    # As serve() does, so /readyz measures the ready answer rather than 503 'starting'
+    python_server.warm_up()
+    server = start_server(args.threads, engine=args.engine)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    results = {'routes': {}, 'invalid_routes': {}, 'memory': {'start': rss_mb()}}
+    try:
+        for name, url_for in route_workloads(base, args.queries, uploads).items():
+            if wanted and name.split(' ', 1)[1] not in wanted:
+                continue
+            result = run_load(url_for, args.concurrency, args.requests, timeout=args.timeout)
+            result.update(rss_mb())
+            if 'analyze-image' in name and any(not 200 <= status < 300 for status in result['statuses']):
+                # Timings of an error path (e.g. 503 without Pillow) mustn't become a 'compare' baseline
+                results['invalid_routes'][name] = {'statuses': result['statuses']}
+                print(f"{name:<30} skipped: not answering 2xx  {result['statuses']}")
+                continue
+            results['routes'][name] = result
+            print(f"{name:<30} {result['rps']:>8} req/s  p50={result['p50_ms']}ms  p95={result['p95_ms']}ms  "
+                  f"p99={result['p99_ms']}ms  rss={result['rss_mb']}MB  {result['statuses']}")
+    finally:
+        server.shutdown()
+        server.server_close()
+        upstream.shutdown()
+        python_server.STATIC_DIR = static_dir_before
+        python_server.CARD_IMAGES = None
+        python_server.CATALOG.close()
+        python_server.CATALOG = None
+        directory.cleanup()
+    results['memory']['end'] = rss_mb()
+    print(f"RSS {results['memory']['start']['rss_mb']}MB -> {results['memory']['end']['rss_mb']}MB "
+          f"(peak {results['memory']['end']['peak_rss_mb']}MB)  engine={args.engine} threads={args.threads} "
+          f"upstream latency={args.latency}s error rate={args.error_rate}")
+    return results
+
+
+# Metric name suffixes compared by 'compare': True when a larger value is better
+COMPARED_METRICS = (('rps', True), ('_ms', False), ('ms_per_image', False), ('_us', False), ('_mb', False))
+
+
+def compared_values(results, prefix=''):
+    """Flatten a saved results tree into {path: (value, higher_is_better)} for the compared metrics"""
+    values = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            path = f"{prefix}/{key}" if prefix else str(key)
+            if isinstance(value, (dict, list)):
+                values.update(compared_values(value, path))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                for suffix, higher_is_better in COMPARED_METRICS:
+                    if str(key).endswith(suffix):
+                        values[path] = (value, higher_is_better)
+                        break
+    elif isinstance(results, list):
+        for index, value in enumerate(results):
+            values.update(compared_values(value, f"{prefix}/{index}"))
+    return values
+
+
+def bench_compare(args):
+    """Compare two saved --output files and flag regressions beyond --tolerance"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get('bench') != current.get('bench'):
+        print(f"warning: comparing '{baseline.get('bench')}' results with '{current.get('bench')}' results")
+    before = compared_values(baseline.get('results'))
+    after = compared_values(current.get('results'))
+    regressions = {}
+    for path in sorted(before.keys() & after.keys()):
+        (old, higher_is_better), (new, _) = before[path], after[path]
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > args.tolerance:
+            flag = '  REGRESSION'
+            regressions[path] = {'baseline': old, 'current': new, 'change': round(change, 4)}
+        print(f"{path:<60} {old:>10} -> {new:<10} {change:+.1%}{flag}")
+    print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+    if regressions:
+        raise SystemExit(1)
+    return regressions
+
+
+def save_results(path, args, results):
+    """Write a run's arguments and results as JSON for later 'compare' runs"""
+    options = {key: value for key, value in vars(args).items() if key not in ('func', 'output')}
+    with open(path, 'w') as f:
+        json.dump({
+            'bench': args.bench,
+            'args': options,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'cpus': os.cpu_count(),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print(f"results saved to {path}")
+
+
+def _client_process(job):
+    url, concurrency, requests, timeout = job
+    return run_clients(url, concurrency, requests, timeout)
+
+
+def run_load_processes(url, processes, concurrency, requests, timeout=30):
+    """run_load() from several client processes, so the load generator isn't held to one core"""
+    jobs = [(url, concurrency, requests // processes + (index < requests % processes), timeout)
+            for index in range(processes)]
+    started = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        outcomes = pool.map(_client_process, jobs)
+    duration = time.perf_counter() - started
+    latencies = sorted(latency for outcome in outcomes for latency in outcome[0])
+    statuses = {}
+    for _, counts, _ in outcomes:
+        for status, count in counts.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return summarize_load(latencies, statuses, duration)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server_process(port, options, timeout=15):
+    """Run python_server.py as a separate process and wait until it accepts connections"""
+    process = subprocess.Popen([sys.executable, python_server.__file__, '--port', str(port)] + options,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def stop_server_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def bench_prefork(args):
+    """Requests/sec on the cheap routes (/, /api/sets) as prefork worker processes are added"""
+    results = {'cpus': os.cpu_count(), 'runs': []}
+    for workers in args.workers:
+        port = free_port()
+        options = ['--workers', str(workers), '--threads', str(args.threads),
+                   '--engine', args.engine, '--access-log', os.devnull]
+        if args.reuse_port:
+            options.append('--reuse-port')
+        process = start_server_process(port, options)
+        try:
+            for path in ('/', '/api/sets'):
+                url = f"http://127.0.0.1:{port}{path}"
+                run_load(url, 4, 50)
+                result = run_load_processes(url, args.client_processes, args.concurrency, args.requests)
+                result.update(workers=workers, path=path)
+                results['runs'].append(result)
+                print(f"workers={workers:>2}  {path:<10} {result['rps']:>8} req/s  p50={result['p50_ms']}ms  "
+                      f"p95={result['p95_ms']}ms  p99={result['p99_ms']}ms  {result['statuses']}")
+        finally:
+            stop_server_process(process)
+    print(f"  ({results['cpus']} CPUs; load from {args.client_processes} client processes, "
+          f"which share the CPUs with the server)")
+    return results
+
+
+def wait_for_status(port, path, status, deadline):
+    """Poll path until it answers with status; returns the time it did, or None at the deadline"""
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                if response.status == status:
+                    return time.perf_counter()
+            finally:
+                connection.close()
+        except OSError:
+            pass
+        time.sleep(0.002)
+    return None
+
+
+def bench_startup(args):
+    """Cold start: time from launching python_server.py to its first served request and to /readyz"""
+    options = args.server_args.split()
+    timings = {'first_request': [], 'ready': []}
+    for _ in range(args.runs):
+        port = free_port()
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, python_server.__file__, '--port', str(port)] + options,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + args.timeout
+            first = wait_for_status(port, '/api/sets', 200, deadline)
+            ready = wait_for_status(port, '/readyz', 200, deadline) if args.readyz else None
+        finally:
+            stop_server_process(process)
+        if first is None:
+            print(f"server did not answer within {args.timeout}s")
+            continue
+        timings['first_request'].append(first - started)
+        if ready is not None:
+            timings['ready'].append(ready - started)
+    results = {'runs': args.runs, 'server_args': args.server_args}
+    for label, values in timings.items():
+        if not values:
+            continue
+        values.sort()
+        results[label] = {
+            'p50_ms': round(percentile(values, 50) * 1000, 1),
+            'p95_ms': round(percentile(values, 95) * 1000, 1),
+            'min_ms': round(values[0] * 1000, 1),
+        }
+        print(f"{label:>14}  p50={results[label]['p50_ms']}ms  p95={results[label]['p95_ms']}ms  "
+              f"min={results[label]['min_ms']}ms  ({len(values)} runs)")
+    return results
+
+
+def parse_thread_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pokemon Card Search benchmarks")
+    sub = parser.add_subparsers(dest='bench', required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--output', metavar='FILE', help="save the results as JSON, for 'compare'")
+
+    workers = sub.add_parser('workers', help=bench_workers.__doc__, parents=[common])
+    workers.add_argument('--threads', type=parse_thread_list, default=[0, 1, 2, 4, 8, 16])
+    workers.add_argument('--concurrency', type=int, default=32)
+    workers.add_argument('--requests', type=int, default=200)
+    workers.add_argument('--latency', type=float, default=0.05, help="fake upstream latency in seconds")
+    workers.set_defaults(func=bench_workers)
+
+    strategy = sub.add_parser('strategy', help=bench_strategy.__doc__, parents=[common])
+    strategy.add_argument('--requests', type=int, default=100)
+    strategy.add_argument('--latency', type=float, default=0.05, help="fake upstream latency in seconds")
+    strategy.add_argument('--fallback-ratio', type=float, default=0.1,
+                          help="share of queries whose TCG search finds nothing")
+    strategy.set_defaults(func=bench_strategy)
+
+    pagination = sub.add_parser('pagination', help=bench_pagination.__doc__, parents=[common])
+    pagination.add_argument('--sessions', type=int, default=100, help="clients paging through one search each")
+    pagination.add_argument('--pages', type=int, default=3, help="pages each client reads")
+    pagination.add_argument('--concurrency', type=int, default=8)
+    pagination.add_argument('--threads', type=int, default=16)
+    pagination.add_argument('--think', type=float, default=0.5, help="seconds spent reading each page")
+    pagination.add_argument('--latency', type=float, default=0.05, help="fake upstream latency in seconds")
+    pagination.add_argument('--prefetch-concurrency', type=int, default=2)
+    pagination.set_defaults(func=bench_pagination)
+
+    classify = sub.add_parser('classify', help=bench_classify.__doc__, parents=[common])
+    classify.add_argument('--results', type=int, default=5000, help="distinct search results")
+    classify.add_argument('--rounds', type=int, default=5)
+    classify.set_defaults(func=bench_classify)
+
+    catalog = sub.add_parser('catalog', help=bench_catalog.__doc__, parents=[common])
+    catalog.add_argument('--cards', type=int, default=100000)
+    catalog.add_argument('--page-size', type=int, default=100)
+    catalog.add_argument('--depth', type=int, default=200, help="page number timed as the deep page")
+    catalog.add_argument('--repeat', type=int, default=50)
+    catalog.add_argument('--threads', type=int, default=8)
+    catalog.add_argument('--concurrency', type=int, default=8)
+    catalog.add_argument('--requests', type=int, default=2000)
+    catalog.set_defaults(func=bench_catalog)
+
+    static = sub.add_parser('static', help=bench_static.__doc__, parents=[common])
+    static.add_argument('--iterations', type=int, default=2000)
+    static.add_argument('--threads', type=int, default=8)
+    static.add_argument('--concurrency', type=int, default=8)
+    static.add_argument('--requests', type=int, default=1000)
+    static.set_defaults(func=bench_static)
+
+    engines = sub.add_parser('engines', help=bench_engines.__doc__, parents=[common])
+    engines.add_argument('--threads', type=int, default=8)
+    engines.add_argument('--idle', type=int, default=16, help="idle client connections held open")
+    engines.add_argument('--concurrency', type=int, default=32)
+    engines.add_argument('--requests', type=int, default=200)
+    engines.add_argument('--latency', type=float, default=0.2, help="fake upstream latency in seconds")
+    engines.add_argument('--timeout', type=float, default=5.0, help="client timeout in seconds")
+    engines.set_defaults(func=bench_engines)
+
+    uploads = sub.add_parser('uploads', help=bench_uploads.__doc__, parents=[common])
+    uploads.add_argument('--clients', type=int, default=8)
+    uploads.add_argument('--size-mb', type=float, default=4.0, help="decoded image size per upload")
+    uploads.set_defaults(func=bench_uploads)
+
+    images = sub.add_parser('images', help=bench_images.__doc__, parents=[common])
+    images.add_argument('--cards', type=int, default=1000, help="reference cards in the hash index")
+    images.add_argument('--images', type=int, default=128, help="images to analyze")
+    images.add_argument('--batch-size', type=int, default=32)
+    images.add_argument('--threads', type=int, default=8)
+    images.add_argument('--image-workers', type=int, default=0,
+                        help="image worker processes, 0 to decode in request threads")
+    images.set_defaults(func=bench_images)
+
+    keepalive = sub.add_parser('keepalive', help=bench_keepalive.__doc__, parents=[common])
+    keepalive.add_argument('--threads', type=int, default=8)
+    keepalive.add_argument('--concurrency', type=int, default=1, help="simulated browser tabs")
+    keepalive.add_argument('--sessions', type=int, default=50, help="page loads per tab")
+    keepalive.add_argument('--latency', type=float, default=0.05, help="fake upstream latency in seconds")
+    keepalive.set_defaults(func=bench_keepalive)
+
+    prefork = sub.add_parser('prefork', help=bench_prefork.__doc__, parents=[common])
+    prefork.add_argument('--workers', type=parse_thread_list, default=[1, 2, 4],
+                         help="worker process counts to compare, e.g. 1,2,4")
+    prefork.add_argument('--threads', type=int, default=4, help="threads per worker process")
+    prefork.add_argument('--engine', choices=python_server.SERVER_ENGINES, default='threaded')
+    prefork.add_argument('--reuse-port', action='store_true', help="one SO_REUSEPORT socket per worker")
+    prefork.add_argument('--client-processes', type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    prefork.add_argument('--concurrency', type=int, default=8, help="client threads per client process")
+    prefork.add_argument('--requests', type=int, default=4000, help="requests per route")
+    prefork.set_defaults(func=bench_prefork)
+
+    startup = sub.add_parser('startup', help=bench_startup.__doc__, parents=[common])
+    startup.add_argument('--runs', type=int, default=10)
+    startup.add_argument('--server-args', default='--headless',
+                         help="options passed to python_server.py (default: '--headless')")
+    startup.add_argument('--no-readyz', dest='readyz', action='store_false',
+                         help="don't wait for /readyz (servers without it)")
+    startup.add_argument('--timeout', type=float, default=30.0)
+    startup.set_defaults(func=bench_startup)
+
+    routes = sub.add_parser('routes', help=bench_routes.__doc__, parents=[common])
+    routes.add_argument('--engine', choices=python_server.SERVER_ENGINES, default='threaded')
+    routes.add_argument('--threads', type=int, default=8)
+    routes.add_argument('--concurrency', type=int, default=16)
+    routes.add_argument('--requests', type=int, default=500, help="requests per route")
+    routes.add_argument('--latency', type=float, default=0.05, help="fake upstream latency in seconds")
+    routes.add_argument('--error-rate', type=float, default=0.0, help="share of fake upstream calls answered 503")
+    routes.add_argument('--queries', type=int, default=50,
+                        help="distinct search queries cycled through (fewer means more cache hits)")
+    routes.add_argument('--cards', type=int, default=100, help="reference cards for the image routes")
+    routes.add_argument('--catalog-cards', type=int, default=10000, help="cards in the /api/cards catalog")
+    routes.add_argument('--timeout', type=float, default=30.0, help="client timeout in seconds")
+    routes.add_argument('--route', dest='routes', action='append', metavar='PATH',
+                        help="only benchmark this route path (repeatable), e.g. /api/search")
+    routes.set_defaults(func=bench_routes)
+
+    compare = sub.add_parser('compare', help=bench_compare.__doc__)
+    compare.add_argument('baseline', help="results file from an earlier run")
+    compare.add_argument('current', help="results file from this run")
+    compare.add_argument('--tolerance', type=float, default=0.1,
+                         help="relative change treated as noise (0.1 = 10%%)")
+    compare.set_defaults(func=bench_compare)
+
+    args = parser.parse_args(argv)
+    results = args.func(args)
+    if getattr(args, 'output', None):
+        save_results(args.output, args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,45 +4,2701 @@ Pokemon Card Search - Python Server
 A standalone Python implementation that doesn't require Node.js
 """
 
+import http.client
 import http.server
 import socketserver
+import gzip
 import json
-import urllib.request
+import queue
+import random
+import ssl
 import urllib.parse
-import webbrowser
 import threading
 import time
 import os
 import sys
+import argparse
+import base64
+import importlib.util
+import io
+import socket
+import traceback
+import binascii
+import bisect
+import codecs
+import glob
+import html
+import hashlib
+import heapq
+import itertools
+import math
+import mmap
+import re
+import select
+import signal
+import struct
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError
+
+try:
+    import brotli  # optional: enables br-compressed static responses
+except ImportError:
+    brotli = None
+
+try:
+    import orjson  # optional: faster JSON encoding for API responses
+except ImportError:
+    orjson = None
+
+
+class LazyModule:
+    """Stands in for a module and imports it the first time an attribute is used
+
+    importlib.util.LazyLoader isn't thread-safe before Python 3.12, so this goes
+    through import_module, which serializes concurrent first imports itself.
+    """
+
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+
+    def _lazy_load(self):
+        module = self._lazy_module
+        if module is None:
+            module = self._lazy_module = importlib.import_module(self._lazy_name)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._lazy_module is not None else 'not loaded'
+        return f"<lazy module '{self._lazy_name}' ({state})>"
+
+
+def lazy_import(name, optional=False):
+    """Defer importing a module that startup doesn't need
+
+    With optional=True, returns None when the module isn't installed, so the
+    usual `if module is None` checks keep working without paying for the import.
+    """
+    if optional:
+        try:
+            if importlib.util.find_spec(name) is None:
+                return None
+        except ImportError:  # a missing parent package
+            return None
+    return LazyModule(name)
+
+
+def loaded(module):
+    """Force a lazy module to import now (no-op for None or a real module)"""
+    if isinstance(module, LazyModule):
+        module._lazy_load()
+    return module
+
+
+# Only a few request paths need these, so they're imported on first use
+# rather than on every cold start
+asyncio = lazy_import('asyncio')
+mimetypes = lazy_import('mimetypes')
+multiprocessing = lazy_import('multiprocessing')
+resource_tracker = lazy_import('multiprocessing.resource_tracker')
+shared_memory = lazy_import('multiprocessing.shared_memory')
+sqlite3 = lazy_import('sqlite3')
+statistics = lazy_import('statistics')
+webbrowser = lazy_import('webbrowser')
+
+Image = lazy_import('PIL.Image', optional=True)  # optional: enables image-to-card matching
+numpy = lazy_import('numpy', optional=True)  # optional: vectorizes batch image fingerprinting
 
 PORT = 3000
 
-class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/':
-            self.serve_main_page()
-        elif self.path.startswith('/api/search'):
-            self.handle_search_api()
-        elif self.path.startswith('/api/sets'):
-            self.handle_sets_api()
-        elif self.path.startswith('/api/web-search'):
-            self.handle_web_search_api()
-        elif self.path.startswith('/static/'):
-            self.serve_static_file()
-        else:
-            self.send_error(404, "File not found")
-    
-    def do_POST(self):
-        if self.path == '/api/analyze-image':
-            self.handle_image_analysis()
-        elif self.path == '/api/google-image-search':
-            self.handle_google_image_search()
-        else:
-            self.send_error(404, "Endpoint not found")
-    
-    def serve_main_page(self):
-        """Serve the main HTML page"""
-        html_content = """
+# Bulbapedia endpoints (overridable so benchmarks can point at a local stand-in)
+BULBAPEDIA_API_URL = "https://bulbapedia.bulbagarden.net/w/api.php"
+BULBAPEDIA_WIKI_URL = "https://bulbapedia.bulbagarden.net/wiki/"
+
+# Concurrent serving settings
+WORKER_THREADS = 8       # request handler threads (0 = single-threaded server)
+REQUEST_QUEUE_SIZE = 64  # accepted connections waiting for a free worker
+ACCEPT_BACKLOG = 128     # listen() backlog for not-yet-accepted connections
+KEEPALIVE_IDLE_TIMEOUT = 5.0  # seconds a threaded-engine connection may sit idle between requests
+KEEPALIVE_MAX_REQUESTS = 100  # requests served on one connection before it is closed
+KEEPALIVE_POLL_INTERVAL = 0.05  # how often an idle connection checks for queued connections
+
+# Server engine: 'threaded' (http.server handlers on a worker pool) or 'asyncio'
+SERVER_ENGINE = 'threaded'
+SERVER_ENGINES = ('threaded', 'asyncio')
+ASYNC_IDLE_TIMEOUT = 60.0  # seconds an idle keep-alive connection is kept open by the asyncio engine
+
+# Upstream HTTP client settings
+UPSTREAM_CONNECT_TIMEOUT = 5.0  # seconds to establish a connection (including TLS)
+UPSTREAM_READ_TIMEOUT = 10.0    # seconds to wait on a response read
+UPSTREAM_POOL_SIZE = 8          # idle keep-alive connections kept per host
+UPSTREAM_USER_AGENT = "PokemonCardSearch/1.0 (python_server.py)"
+
+# Upstream protection settings
+UPSTREAM_RATE = 20.0            # outbound requests per second (token refill rate); 0 disables the limiter
+UPSTREAM_BURST = 40             # requests that may be sent back to back after a quiet spell
+UPSTREAM_RATE_MAX_WAIT = 1.0    # seconds a call may wait for a token before it is shed
+BREAKER_FAILURES = 5            # consecutive failed or slow calls that open the circuit breaker
+BREAKER_SLOW_CALL = 3.0         # seconds; a call slower than this counts as a failure
+BREAKER_COOLDOWN = 30.0         # seconds the breaker stays open before letting a trial call through
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream server answers with an error status"""
+
+    def __init__(self, status, url):
+        super().__init__(f"HTTP {status} from {url}")
+        self.status = status
+        self.url = url
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling upstream when the rate limiter or circuit breaker sheds the call"""
+
+    def __init__(self, reason, retry_after=1.0):
+        super().__init__(f"upstream call shed: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by the sync and async upstream clients.
+
+    reserve() takes a token and says how long the caller must wait for it,
+    so threads can sleep and coroutines can await the same budget. Callers
+    that would wait longer than max_wait are shed instead.
+    """
+
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, max_wait=UPSTREAM_RATE_MAX_WAIT):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_wait = max_wait
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.delayed = 0
+        self.shed = 0
+
+    def reserve(self):
+        """Seconds to wait before calling upstream; raises UpstreamUnavailable when shed"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens go negative to queue callers behind each other
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > self.max_wait:
+                self.shed += 1
+                raise UpstreamUnavailable("rate limit", wait)
+            self._tokens -= 1
+            self.granted += 1
+            if wait:
+                self.delayed += 1
+            return wait
+
+    def available(self):
+        """Tokens that could be taken right now without waiting"""
+        if self.rate <= 0:
+            return float('inf')
+        with self._lock:
+            return min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tokens': round(max(0.0, self._tokens), 2),
+                'granted': self.granted,
+                'delayed': self.delayed,
+                'shed': self.shed,
+            }
+
+
+class CircuitBreaker:
+    """Stops calling upstream after repeated failures or slow responses.
+
+    closed: calls pass; failure_threshold consecutive failures (errors,
+    5xx/429 answers, or calls slower than slow_call) open the breaker.
+    open: calls are shed for cooldown seconds. half_open: one trial call
+    passes; success closes the breaker, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, slow_call=BREAKER_SLOW_CALL,
+                 cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = max(1, failure_threshold)
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._lock = threading.Lock()
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.shed = 0
+        self.transitions = {}
+
+    def _move(self, state):
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        log_event(f"Upstream circuit breaker {self.state} -> {state}", 'warning')
+        self.state = state
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != self.OPEN:
+                return 1.0
+            return max(1.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    def is_open(self):
+        """Whether calls are currently being shed (trial calls aside)"""
+        with self._lock:
+            return self.state != self.CLOSED
+
+    def allow(self):
+        """Admit a call or raise UpstreamUnavailable"""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self._move(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.shed += 1
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+        raise UpstreamUnavailable("circuit open", max(1.0, remaining))
+
+    def cancel(self):
+        """Forget an admitted call that never reached upstream"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def record(self, ok, elapsed):
+        """Record the outcome of an admitted call"""
+        with self._lock:
+            slow = elapsed > self.slow_call
+            if slow:
+                self.slow_calls += 1
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+            if ok and not slow:
+                self.consecutive_failures = 0
+                if self.state == self.HALF_OPEN:
+                    self._move(self.CLOSED)
+                return
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                                self.consecutive_failures >= self.failure_threshold):
+                self._move(self.OPEN)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failures': self.failures,
+                'slow_calls': self.slow_calls,
+                'shed': self.shed,
+                'transitions': dict(self.transitions),
+            }
+
+
+def admit_upstream_call(limiter, breaker):
+    """Pass the breaker and take a rate-limit token; returns the seconds to wait before calling"""
+    if breaker is not None:
+        breaker.allow()
+    if limiter is None:
+        return 0.0
+    try:
+        return limiter.reserve()
+    except UpstreamUnavailable:
+        if breaker is not None:
+            breaker.cancel()
+        raise
+
+
+def is_upstream_failure(error):
+    """Whether an exception from an upstream call says the upstream is unhealthy"""
+    if isinstance(error, UpstreamError):
+        return error.status >= 500 or error.status == 429
+    return not isinstance(error, UpstreamUnavailable)
+
+
+UPSTREAM_LIMITER = TokenBucket()
+UPSTREAM_BREAKER = CircuitBreaker()
+
+
+class UpstreamClient:
+    """Keep-alive HTTP(S) client with a connection pool per host.
+
+    Connections are reused across requests and threads instead of paying DNS,
+    TCP and TLS setup on every call. Responses are gzip-decoded transparently.
+    """
+
+    _RETRYABLE = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                  ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, connect_timeout=UPSTREAM_CONNECT_TIMEOUT, read_timeout=UPSTREAM_READ_TIMEOUT,
+                 pool_size=UPSTREAM_POOL_SIZE, user_agent=UPSTREAM_USER_AGENT, limiter=None, breaker=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = max(0, pool_size)
+        self.user_agent = user_agent
+        self.limiter = limiter
+        self.breaker = breaker
+        self._idle = {}  # (scheme, host, port) -> [connection, ...]
+        self._lock = threading.Lock()
+        self._ssl_context = None
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.connections_discarded = 0
+        self.in_use = 0
+        self.requests = 0
+        self.errors = 0
+
+    def _new_connection(self, scheme, host, port):
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout,
+                                               context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        with self._lock:
+            self.connections_created += 1
+        return conn
+
+    def _acquire(self, pool_key):
+        with self._lock:
+            idle = self._idle.get(pool_key)
+            self.in_use += 1
+            if idle:
+                self.connections_reused += 1
+                return idle.pop(), True
+        try:
+            return self._new_connection(*pool_key), False
+        except BaseException:
+            with self._lock:
+                self.in_use -= 1
+            raise
+
+    def _release(self, pool_key, conn, reusable):
+        with self._lock:
+            self.in_use -= 1
+            idle = self._idle.setdefault(pool_key, [])
+            if reusable and len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+            self.connections_discarded += 1
+        conn.close()
+
+    def request(self, method, url, headers=None, body=None):
+        """Perform a request and return (status, headers, body bytes).
+
+        Raises UpstreamUnavailable without calling upstream when the
+        circuit breaker is open or the rate limit can't be met in time.
+        """
+        wait = admit_upstream_call(self.limiter, self.breaker)
+        if wait:
+            time.sleep(wait)
+        started = time.monotonic()
+        try:
+            result = self._request(method, url, headers, body)
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            if self.breaker is not None:
+                self.breaker.record(not is_upstream_failure(e), elapsed)
+            record_upstream_call('sync', e, elapsed)
+            raise
+        elapsed = time.monotonic() - started
+        if self.breaker is not None:
+            self.breaker.record(True, elapsed)
+        record_upstream_call('sync', None, elapsed)
+        return result
+
+    def _request(self, method, url, headers, body):
+        parsed = urllib.parse.urlsplit(url)
+        scheme = parsed.scheme or 'http'
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        pool_key = (scheme, parsed.hostname, port)
+        path = parsed.path or '/'
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+        request_headers = {
+            'User-Agent': self.user_agent,
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive',
+        }
+        request_headers.update(headers or {})
+
+        with self._lock:
+            self.requests += 1
+        # A pooled connection may have been closed by the server while idle;
+        # retry once on a fresh connection in that case.
+        for attempt in range(2):
+            conn, reused = self._acquire(pool_key)
+            try:
+                conn.request(method, path, body=body, headers=request_headers)
+                response = conn.getresponse()
+                payload = response.read()
+            except self._RETRYABLE:
+                self._release(pool_key, conn, False)
+                if reused and attempt == 0:
+                    continue
+                with self._lock:
+                    self.errors += 1
+                raise
+            except BaseException:
+                self._release(pool_key, conn, False)
+                with self._lock:
+                    self.errors += 1
+                raise
+            self._release(pool_key, conn, not response.will_close)
+            break
+
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            payload = gzip.decompress(payload)
+        if response.status >= 400:
+            with self._lock:
+                self.errors += 1
+            raise UpstreamError(response.status, url)
+        return response.status, response.headers, payload
+
+    def get_json(self, url, headers=None):
+        """GET a URL and decode its JSON body"""
+        _, _, payload = self.request('GET', url, headers)
+        return json.loads(payload.decode('utf-8'))
+
+    def close(self):
+        with self._lock:
+            pools = list(self._idle.values())
+            self._idle = {}
+        for idle in pools:
+            for conn in idle:
+                conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'connections_created': self.connections_created,
+                'connections_reused': self.connections_reused,
+                'connections_discarded': self.connections_discarded,
+                'in_use': self.in_use,
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'connect_timeout': self.connect_timeout,
+                'read_timeout': self.read_timeout,
+            }
+
+
+UPSTREAM = UpstreamClient(limiter=UPSTREAM_LIMITER, breaker=UPSTREAM_BREAKER)
+
+
+async def read_chunked_body(reader, max_size=None):
+    """Read a chunked transfer-encoded body from an asyncio stream"""
+    chunks = []
+    size = 0
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise asyncio.IncompleteReadError(b''.join(chunks), None)
+        chunk_size = int(line.split(b';', 1)[0].strip() or b'0', 16)
+        if chunk_size == 0:
+            # Skip trailers up to the terminating blank line
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        size += chunk_size
+        if max_size is not None and size > max_size:
+            raise ValueError("chunked body too large")
+        chunks.append(await reader.readexactly(chunk_size))
+        await reader.readexactly(2)
+
+
+async def read_http_head(reader, timeout=None):
+    """Read a start line and headers, returning (start line, HTTPMessage) or (None, None) at EOF"""
+    line = await asyncio.wait_for(reader.readline(), timeout)
+    while line in (b'\r\n', b'\n'):
+        line = await asyncio.wait_for(reader.readline(), timeout)
+    if not line:
+        return None, None
+    header_lines = []
+    while True:
+        header = await asyncio.wait_for(reader.readline(), timeout)
+        if header in (b'\r\n', b'\n', b''):
+            break
+        header_lines.append(header)
+        if len(header_lines) > 100:
+            raise ValueError("too many headers")
+    headers = http.client.parse_headers(io.BytesIO(b''.join(header_lines) + b'\r\n'))
+    return line.decode('latin-1').rstrip('\r\n'), headers
+
+
+class AsyncUpstreamClient:
+    """asyncio counterpart of UpstreamClient with its own keep-alive pool.
+
+    Used by the asyncio engine so slow upstream calls wait on the event loop
+    instead of holding a thread.
+    """
+
+    def __init__(self, connect_timeout=UPSTREAM_CONNECT_TIMEOUT, read_timeout=UPSTREAM_READ_TIMEOUT,
+                 pool_size=UPSTREAM_POOL_SIZE, user_agent=UPSTREAM_USER_AGENT, limiter=None, breaker=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = max(0, pool_size)
+        self.user_agent = user_agent
+        self.limiter = limiter
+        self.breaker = breaker
+        self._idle = {}  # (scheme, host, port) -> [(reader, writer), ...]
+        self._ssl_context = None
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.connections_discarded = 0
+        self.in_use = 0
+        self.requests = 0
+        self.errors = 0
+
+    async def _acquire(self, pool_key):
+        idle = self._idle.get(pool_key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                self.connections_reused += 1
+                self.in_use += 1
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = pool_key
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context), self.connect_timeout)
+        self.connections_created += 1
+        self.in_use += 1
+        return reader, writer, False
+
+    def _release(self, pool_key, reader, writer, reusable):
+        self.in_use -= 1
+        idle = self._idle.setdefault(pool_key, [])
+        if reusable and len(idle) < self.pool_size:
+            idle.append((reader, writer))
+            return
+        self.connections_discarded += 1
+        writer.close()
+
+    def close(self):
+        """Close the idle pooled connections, which only work on the loop that opened them"""
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+    async def _read_response(self, reader, method):
+        status_line, headers = await read_http_head(reader)
+        if status_line is None:
+            raise ConnectionResetError("upstream closed the connection")
+        version, status = status_line.split(None, 2)[:2]
+        status = int(status)
+        keep_alive = version == 'HTTP/1.1' and headers.get('Connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            body = await read_chunked_body(reader)
+        elif headers.get('Content-Length') is not None:
+            body = await reader.readexactly(int(headers['Content-Length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return status, headers, body, keep_alive
+
+    async def request(self, method, url, headers=None, body=None):
+        """Perform a request and return (status, headers, body bytes), guarded like UpstreamClient.request()"""
+        wait = admit_upstream_call(self.limiter, self.breaker)
+        started = time.monotonic()
+        try:
+            if wait:
+                await asyncio.sleep(wait)
+                started = time.monotonic()
+            result = await self._request(method, url, headers, body)
+        except asyncio.CancelledError:
+            # The caller lost interest (e.g. the other parallel search won); not an upstream failure
+            if self.breaker is not None:
+                self.breaker.cancel()
+            raise
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            if self.breaker is not None:
+                self.breaker.record(not is_upstream_failure(e), elapsed)
+            record_upstream_call('async', e, elapsed)
+            raise
+        elapsed = time.monotonic() - started
+        if self.breaker is not None:
+            self.breaker.record(True, elapsed)
+        record_upstream_call('async', None, elapsed)
+        return result
+
+    async def _request(self, method, url, headers, body):
+        parsed = urllib.parse.urlsplit(url)
+        scheme = parsed.scheme or 'http'
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        pool_key = (scheme, parsed.hostname, port)
+        path = parsed.path or '/'
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+        request_headers = {
+            'Host': parsed.netloc,
+            'User-Agent': self.user_agent,
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive',
+        }
+        request_headers.update(headers or {})
+        if body is not None:
+            request_headers['Content-Length'] = str(len(body))
+        head = f"{method} {path} HTTP/1.1\r\n" + ''.join(
+            f"{name}: {value}\r\n" for name, value in request_headers.items()) + "\r\n"
+
+        self.requests += 1
+        # A pooled connection may have been closed by the server while idle;
+        # retry once on a fresh connection in that case.
+        for attempt in range(2):
+            reader, writer, reused = await self._acquire(pool_key)
+            try:
+                writer.write(head.encode('latin-1') + (body or b''))
+                await writer.drain()
+                status, response_headers, payload, keep_alive = await asyncio.wait_for(
+                    self._read_response(reader, method), self.read_timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self._release(pool_key, reader, writer, False)
+                if reused and attempt == 0:
+                    continue
+                self.errors += 1
+                raise
+            except asyncio.CancelledError:
+                self._release(pool_key, reader, writer, False)
+                raise
+            except BaseException:
+                self._release(pool_key, reader, writer, False)
+                self.errors += 1
+                raise
+            self._release(pool_key, reader, writer, keep_alive)
+            break
+
+        if response_headers.get('Content-Encoding', '').lower() == 'gzip':
+            payload = gzip.decompress(payload)
+        if status >= 400:
+            self.errors += 1
+            raise UpstreamError(status, url)
+        return status, response_headers, payload
+
+    async def get_json(self, url, headers=None):
+        """GET a URL and decode its JSON body"""
+        _, _, payload = await self.request('GET', url, headers)
+        return json.loads(payload.decode('utf-8'))
+
+    def close(self):
+        pools = list(self._idle.values())
+        self._idle = {}
+        for idle in pools:
+            for _, writer in idle:
+                writer.close()
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'connections_created': self.connections_created,
+            'connections_reused': self.connections_reused,
+            'connections_discarded': self.connections_discarded,
+            'in_use': self.in_use,
+            'idle': sum(len(idle) for idle in self._idle.values()),
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+        }
+
+
+ASYNC_UPSTREAM = AsyncUpstreamClient(limiter=UPSTREAM_LIMITER, breaker=UPSTREAM_BREAKER)
+
+
+# Search result cache settings
+SEARCH_CACHE_SIZE = 512         # max cached queries (least recently used are evicted)
+SEARCH_CACHE_TTL = 600          # seconds a cached result is served as fresh
+SEARCH_CACHE_STALE_TTL = 3600   # extra seconds a stale result is served while refreshing
+SEARCH_CACHE_FILE = None        # optional JSON file to persist the cache across restarts
+SEARCH_CACHE_SAVE_INTERVAL = 60 # seconds between background saves of a dirty cache
+
+
+def normalize_query(query):
+    """Fold case and whitespace so equivalent searches share a cache key"""
+    return ' '.join(query.lower().split())
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with percentile estimates"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, pct):
+        """Upper bucket bound containing the pct-th percentile observation"""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return 0.0
+        rank = pct / 100.0 * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.total
+        return {
+            'count': count,
+            'mean_ms': round(total / count * 1000, 2) if count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'buckets': {f"le_{bound}": counts[index] for index, bound in enumerate(self.buckets)},
+        }
+
+
+def _metric_value(value):
+    if isinstance(value, float):
+        return repr(value) if math.isfinite(value) else ('+Inf' if value > 0 else '-Inf')
+    return str(value)
+
+
+def _metric_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class MetricsRegistry:
+    """Prometheus-style counters, gauges and histograms served on /metrics.
+
+    Each thread records into its own shard, so recording is a couple of dict
+    and list updates without a lock. Shards are summed when /metrics is
+    scraped; those of threads that have exited are folded into one retired
+    shard so short-lived threads don't pile up.
+    """
+
+    def __init__(self, buckets=LatencyHistogram.BUCKETS):
+        self.buckets = tuple(buckets)
+        self._families = {}  # name -> (kind, help, label names)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # (thread, shard)
+        self._retired = self._new_shard()
+
+    @staticmethod
+    def _new_shard():
+        return {'counter': {}, 'gauge': {}, 'histogram': {}}
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self._new_shard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def describe(self, name, kind, text, labels=()):
+        """Declare a metric family; label values are later passed as a tuple in this order"""
+        self._families[name] = (kind, text, tuple(labels))
+
+    def inc(self, name, labels=(), amount=1):
+        values = self._shard()['counter']
+        key = (name, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def add(self, name, labels=(), amount=1):
+        """Move a gauge up or down; each thread's changes are summed at scrape time"""
+        values = self._shard()['gauge']
+        key = (name, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, seconds, labels=()):
+        values = self._shard()['histogram']
+        key = (name, labels)
+        counts = values.get(key)
+        if counts is None:
+            # One slot per bucket, one for +Inf, then the running sum
+            counts = values[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    @staticmethod
+    def _merge(into, shard):
+        # copy() is atomic under the GIL, so a thread adding a new series can't break the merge
+        for kind in ('counter', 'gauge'):
+            target = into[kind]
+            for key, value in shard[kind].copy().items():
+                target[key] = target.get(key, 0) + value
+        target = into['histogram']
+        for key, counts in shard['histogram'].copy().items():
+            merged = target.get(key)
+            if merged is None:
+                target[key] = list(counts)
+            else:
+                for index, value in enumerate(list(counts)):
+                    merged[index] += value
+
+    def collect(self):
+        """Sum all shards into one {kind: {(name, labels): value}} snapshot"""
+        total = self._new_shard()
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+            self._merge(total, self._retired)
+            for _, shard in live:
+                self._merge(total, shard)
+        return total
+
+    def render(self, samples=()):
+        """Prometheus text exposition of the recorded series plus (name, labels, value) samples"""
+        snapshot = self.collect()
+        series = {}
+        for kind in ('counter', 'gauge'):
+            for (name, labels), value in snapshot[kind].items():
+                series.setdefault(name, []).append((labels, value))
+        for name, labels, value in samples:
+            series.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(set(series) | {name for name, _ in snapshot['histogram']}):
+            kind, text, label_names = self._families.get(name, ('untyped', name, ()))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series.get(name, ())):
+                lines.append(f"{name}{_metric_labels(label_names, labels)} {_metric_value(value)}")
+            for (hist_name, labels), counts in sorted(snapshot['histogram'].items()):
+                if hist_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    bucket_labels = _metric_labels(label_names + ('le',), labels + (_metric_value(float(bound)),))
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_metric_labels(label_names, labels)} {_metric_value(counts[-1])}")
+                lines.append(f"{name}_count{_metric_labels(label_names, labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+METRICS.describe('pokemon_http_requests_total', 'counter', 'HTTP requests answered, by route and status',
+                 ('route', 'method', 'status'))
+METRICS.describe('pokemon_http_request_duration_seconds', 'histogram',
+                 'Time from dispatch until the route handler returned', ('route', 'method'))
+METRICS.describe('pokemon_http_requests_in_flight', 'gauge', 'Requests currently inside a route handler',
+                 ('route',))
+METRICS.describe('pokemon_upstream_requests_total', 'counter', 'Bulbapedia calls by client and outcome',
+                 ('client', 'outcome'))
+METRICS.describe('pokemon_upstream_request_duration_seconds', 'histogram',
+                 'Bulbapedia call latency, including failed calls', ('client',))
+METRICS.describe('pokemon_upstream_shed_total', 'counter',
+                 'Bulbapedia calls refused by the rate limiter or circuit breaker', ('reason',))
+METRICS.describe('pokemon_upstream_breaker_state', 'gauge', '1 for the current circuit breaker state',
+                 ('state',))
+METRICS.describe('pokemon_upstream_connections', 'gauge', 'Upstream keep-alive connections',
+                 ('client', 'state'))
+METRICS.describe('pokemon_search_cache_lookups_total', 'counter', 'Search cache lookups by result',
+                 ('result',))
+METRICS.describe('pokemon_search_cache_evictions_total', 'counter', 'Search cache entries evicted')
+METRICS.describe('pokemon_search_cache_refresh_errors_total', 'counter', 'Failed background refreshes')
+METRICS.describe('pokemon_search_cache_entries', 'gauge', 'Entries in the search cache')
+METRICS.describe('pokemon_search_coalesced_total', 'counter',
+                 'Searches that waited on an identical in-flight search', ('engine',))
+METRICS.describe('pokemon_search_prefetch_total', 'counter', 'Next-page search prefetches by outcome',
+                 ('outcome',))
+METRICS.describe('pokemon_worker_threads', 'gauge', 'Threaded engine worker pool', ('state',))
+METRICS.describe('pokemon_open_connections', 'gauge', 'Connections open on the asyncio engine')
+METRICS.describe('pokemon_image_queue_depth', 'gauge', 'Image tasks queued or running in worker processes')
+
+
+def route_label(route):
+    """Metric label for a route; unmatched paths share one label to bound cardinality"""
+    return route.path if route is not None else 'unmatched'
+
+
+def record_request(route, method, status, elapsed):
+    METRICS.add('pokemon_http_requests_in_flight', (route,), -1)
+    METRICS.inc('pokemon_http_requests_total', (route, method, str(status or 500)))
+    METRICS.observe('pokemon_http_request_duration_seconds', elapsed, (route, method))
+
+
+def record_upstream_call(client, error, elapsed):
+    if error is None:
+        outcome = 'ok'
+    elif isinstance(error, UpstreamError):
+        outcome = f"http_{error.status // 100}xx"
+    elif isinstance(error, (TimeoutError, socket.timeout)):
+        outcome = 'timeout'
+    elif client == 'async' and isinstance(error, asyncio.TimeoutError):  # threaded calls never load asyncio
+        outcome = 'timeout'
+    else:
+        outcome = 'error'
+    METRICS.inc('pokemon_upstream_requests_total', (client, outcome))
+    METRICS.observe('pokemon_upstream_request_duration_seconds', elapsed, (client,))
+
+
+# Access log settings
+ACCESS_LOG_FILE = '-'           # JSON-lines access log; '-' writes to stderr
+ACCESS_LOG_MAX_BYTES = 10 * 1024 * 1024  # rotate the log file once it would grow past this (0 never rotates)
+ACCESS_LOG_BACKUPS = 5          # rotated files kept as <file>.1 ... <file>.N
+ACCESS_LOG_QUEUE_SIZE = 10000   # lines waiting for the writer before new lines are dropped
+ACCESS_LOG_BATCH = 256          # lines serialized and written per batch
+ACCESS_LOG_SAMPLE = {'/api/suggest': 0.1, '/metrics': 0.1, '/healthz': 0.0, '/readyz': 0.0}  # share of successful requests logged, per route
+ACCESS_LOG_PATH_LIMIT = 256     # request path characters kept in a log line
+
+METRICS.describe('pokemon_access_log_lines_total', 'counter', 'Access log lines by fate', ('result',))
+
+
+class AccessLog:
+    """JSON-lines access log written by a background thread.
+
+    Request threads only put a dict on a bounded queue; the writer thread
+    serializes lines in batches and rotates the file by size. When the queue
+    is full the line is dropped and counted instead of blocking the request.
+    """
+
+    def __init__(self, path=ACCESS_LOG_FILE, max_bytes=ACCESS_LOG_MAX_BYTES, backups=ACCESS_LOG_BACKUPS,
+                 queue_size=ACCESS_LOG_QUEUE_SIZE, batch_size=ACCESS_LOG_BATCH, sample_rates=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = max(0, backups)
+        self.batch_size = max(1, batch_size)
+        self.sample_rates = dict(ACCESS_LOG_SAMPLE if sample_rates is None else sample_rates)
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._stream = None
+        self._size = 0
+        # Plain counters: a lost increment under contention only skews the stats
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.rotations = 0
+        self.write_errors = 0
+        self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+        self._thread.start()
+
+    def sample_rate(self, route, status):
+        """The rate this request is logged at, or None when it is sampled out; errors are always logged"""
+        rate = self.sample_rates.get(route, 1.0)
+        if rate >= 1.0 or status >= 400 or random.random() < rate:
+            return rate
+        self.sampled_out += 1
+        return None
+
+    def log(self, record):
+        """Queue a record without blocking; 'ts' is a time.time() value"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            if records:
+                self._write(b''.join(json_dumps(self._format(record)) + b'\n' for record in records), len(records))
+            if len(records) < len(batch):
+                self._close_stream()
+                return
+
+    @staticmethod
+    def _format(record):
+        ts = record['ts']
+        record['ts'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts)) + f".{int(ts % 1 * 1000):03d}Z"
+        return record
+
+    def _open(self):
+        if self.path == '-':
+            self._stream = getattr(sys.stderr, 'buffer', None)
+            self._size = 0
+        else:
+            self._stream = open(self.path, 'ab')
+            self._size = self._stream.tell()
+
+    def _close_stream(self):
+        if self._stream is not None and self.path != '-':
+            self._stream.close()
+        self._stream = None
+
+    def _rotate(self):
+        self._close_stream()
+        if self.backups:
+            for index in range(self.backups - 1, 0, -1):
+                older = f"{self.path}.{index}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+        self._open()
+
+    def _write(self, data, lines):
+        try:
+            if self._stream is None:
+                self._open()
+            if self._stream is None:
+                # No stderr to write to (e.g. a windowed Windows process)
+                return
+            if self.path != '-' and self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._stream.write(data)
+            self._stream.flush()
+            self._size += len(data)
+            self.written += lines
+        except (OSError, ValueError):
+            self.write_errors += 1
+            self._close_stream()
+
+    def close(self, timeout=5.0):
+        """Write out queued lines and stop the writer thread"""
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'queue_depth': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'sampled_out': self.sampled_out,
+            'rotations': self.rotations,
+            'write_errors': self.write_errors,
+            'sample_rates': dict(self.sample_rates),
+        }
+
+
+ACCESS_LOG = None  # set by configure_access_log(); None keeps http.server's stderr lines
+
+
+def log_event(message, level='error'):
+    """Log from outside a request handler, through the access log writer when there is one"""
+    if ACCESS_LOG is None:
+        sys.stderr.write(f"{message}\n")
+        return
+    ACCESS_LOG.log({'ts': time.time(), 'level': level, 'message': message})
+
+
+# Search strategy settings
+SEARCH_STRATEGY = 'sequential'  # 'sequential' (TCG then fallback) or 'parallel' (both at once)
+SEARCH_PRIMARY_DEADLINE = 1.5   # seconds the parallel strategy waits for TCG results
+SEARCH_PARALLEL_THREADS = 16    # threads running parallel upstream searches
+SEARCH_STRATEGIES = ('sequential', 'parallel')
+
+# Search pagination settings
+SEARCH_PAGE_SIZE = 15           # TCG results per page (Bulbapedia srlimit)
+GENERAL_SEARCH_PAGE_SIZE = 10   # general fallback results per page
+SEARCH_MAX_OFFSET = 10000       # Bulbapedia won't page past this many results
+SEARCH_SOURCES = ('tcg', 'general')
+
+# Per strategy, plus 'page' for single-call fetches of later pages, which would flatter either strategy
+SEARCH_LATENCY = {strategy: LatencyHistogram() for strategy in SEARCH_STRATEGIES + ('page',)}
+_search_executor = None
+_search_executor_lock = threading.Lock()
+
+
+def get_search_executor():
+    """Lazily create the thread pool used by the parallel search strategy"""
+    global _search_executor
+    with _search_executor_lock:
+        if _search_executor is None:
+            _search_executor = ThreadPoolExecutor(max_workers=SEARCH_PARALLEL_THREADS,
+                                                  thread_name_prefix="bulbapedia-search")
+        return _search_executor
+
+
+def bulbapedia_search_url(term, limit, offset=0):
+    url = f"{BULBAPEDIA_API_URL}?action=query&list=search&srsearch={urllib.parse.quote(term)}&format=json&origin=*&srlimit={limit}"
+    return f"{url}&sroffset={offset}" if offset else url
+
+
+def is_tcg_result(title, snippet):
+    """Guess whether a search result is a TCG card page"""
+    return get_tcg_classifier().classify(title, snippet)['isTCG']
+
+
+def tcg_search_url(query, offset=0):
+    return bulbapedia_search_url(f"{query} TCG", SEARCH_PAGE_SIZE, offset)
+
+
+def general_search_url(query, offset=0):
+    return bulbapedia_search_url(query, GENERAL_SEARCH_PAGE_SIZE, offset)
+
+
+def encode_search_cursor(source, offset):
+    """Opaque /api/search cursor for the page of source's results starting at offset"""
+    return base64.urlsafe_b64encode(f"{source}:{offset}".encode('ascii')).rstrip(b'=').decode('ascii')
+
+
+def decode_search_cursor(cursor):
+    """(source, offset) from an encode_search_cursor() token; raises ValueError if it isn't one"""
+    try:
+        source, offset = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii').split(':')
+        offset = int(offset)
+    except ValueError:
+        raise ValueError("cursor is malformed")
+    if source not in SEARCH_SOURCES or not 0 < offset <= SEARCH_MAX_OFFSET:
+        raise ValueError("cursor is malformed")
+    return source, offset
+
+
+def search_cache_key(query, cursor=None):
+    """Cache key for one page of a search; the first page keeps the plain query key"""
+    key = normalize_query(query)
+    if cursor is not None:
+        key = f"{key}\n{cursor[0]}:{cursor[1]}"
+    return key
+
+
+def search_page(results, data, source):
+    """A cacheable page of results with the cursor for the next one, if Bulbapedia has more"""
+    # Judged on Bulbapedia's hits, as a page can be empty after TCG filtering with more to come
+    offset = data.get('continue', {}).get('sroffset')
+    more = offset is not None and offset <= SEARCH_MAX_OFFSET
+    return {'results': results, 'next': encode_search_cursor(source, offset) if more else None}
+
+
+def parse_tcg_results(data):
+    """Build TCG search results from a Bulbapedia api.php response"""
+    results = []
+    if data.get('query', {}).get('search'):
+        classifier = get_tcg_classifier()
+        for item in data['query']['search'][:SEARCH_PAGE_SIZE]:
+            results.append({
+                'title': item['title'],
+                'snippet': item['snippet'],
+                'url': f"{BULBAPEDIA_WIKI_URL}{urllib.parse.quote(item['title'].replace(' ', '_'))}",
+                'size': item['size'],
+                # Flag likely TCG cards and pull out their set, number and variants
+                **classifier.classify(item['title'], item['snippet'])
+            })
+    return results
+
+
+def parse_general_results(fallback_data):
+    """Build fallback search results from a Bulbapedia api.php response"""
+    results = []
+    if fallback_data.get('query', {}).get('search'):
+        for item in fallback_data['query']['search'][:GENERAL_SEARCH_PAGE_SIZE]:
+            results.append({
+                'title': item['title'],
+                'snippet': item['snippet'],
+                'url': f"{BULBAPEDIA_WIKI_URL}{urllib.parse.quote(item['title'].replace(' ', '_'))}",
+                'size': item['size'],
+                **TCGClassifier.unclassified()
+            })
+    return results
+
+
+def fetch_tcg_results(query, offset=0):
+    """Enhanced search with TCG-specific filtering; returns a search_page()"""
+    data = UPSTREAM.get_json(tcg_search_url(query, offset))
+    return search_page(parse_tcg_results(data), data, 'tcg')
+
+
+def fetch_general_results(query, offset=0):
+    """General Bulbapedia search used when the TCG search finds nothing"""
+    data = UPSTREAM.get_json(general_search_url(query, offset))
+    return search_page(parse_general_results(data), data, 'general')
+
+
+def search_sequential(query):
+    """Run the TCG search, and the general search only if it finds nothing"""
+    page = fetch_tcg_results(query)
+    if not page['results']:
+        page = fetch_general_results(query)
+    return page
+
+
+def search_parallel(query, deadline=None):
+    """Start the TCG and general searches together and merge by deadline.
+
+    TCG results win if they arrive within the deadline. After that, whichever
+    search completes first with results is used. The losing search is
+    cancelled if it has not started yet, otherwise its result is discarded.
+    """
+    deadline = SEARCH_PRIMARY_DEADLINE if deadline is None else deadline
+    executor = get_search_executor()
+    primary = executor.submit(fetch_tcg_results, query)
+    fallback = executor.submit(fetch_general_results, query)
+    try:
+        try:
+            page = primary.result(timeout=deadline)
+            if page['results']:
+                return page
+        except FuturesTimeoutError:
+            pass
+        except Exception:
+            # The general search can still answer if the TCG search failed
+            pass
+
+        pending = {primary, fallback}
+        errors = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    page = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if page['results'] or not pending:
+                    return page
+        if errors:
+            raise errors[0]
+        return {'results': [], 'next': None}
+    finally:
+        primary.cancel()
+        fallback.cancel()
+
+
+def search_bulbapedia(query, strategy=None, cursor=None):
+    """Search Bulbapedia for TCG cards, falling back to a general search.
+
+    Returns a search_page(). A (source, offset) cursor fetches a later page
+    of whichever search answered the first one, without any fallback.
+    """
+    strategy = strategy or SEARCH_STRATEGY
+    started = time.perf_counter()
+    try:
+        if cursor is not None:
+            source, offset = cursor
+            fetch = fetch_tcg_results if source == 'tcg' else fetch_general_results
+            return fetch(query, offset)
+        if strategy == 'parallel':
+            return search_parallel(query)
+        return search_sequential(query)
+    finally:
+        SEARCH_LATENCY[strategy if cursor is None else 'page'].observe(time.perf_counter() - started)
+
+
+async def fetch_tcg_results_async(query, offset=0):
+    data = await ASYNC_UPSTREAM.get_json(tcg_search_url(query, offset))
+    return search_page(parse_tcg_results(data), data, 'tcg')
+
+
+async def fetch_general_results_async(query, offset=0):
+    data = await ASYNC_UPSTREAM.get_json(general_search_url(query, offset))
+    return search_page(parse_general_results(data), data, 'general')
+
+
+async def search_parallel_async(query, deadline=None):
+    """asyncio version of search_parallel(); the losing search is really cancelled"""
+    deadline = SEARCH_PRIMARY_DEADLINE if deadline is None else deadline
+    primary = asyncio.ensure_future(fetch_tcg_results_async(query))
+    fallback = asyncio.ensure_future(fetch_general_results_async(query))
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=deadline)
+        if primary in done and primary.exception() is None and primary.result()['results']:
+            return primary.result()
+
+        pending = {primary, fallback}
+        errors = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                    continue
+                if task.result()['results'] or not pending:
+                    return task.result()
+        if errors:
+            raise errors[0]
+        return {'results': [], 'next': None}
+    finally:
+        primary.cancel()
+        fallback.cancel()
+
+
+async def search_bulbapedia_async(query, strategy=None, cursor=None):
+    """Non-blocking search_bulbapedia() for the asyncio engine"""
+    strategy = strategy or SEARCH_STRATEGY
+    started = time.perf_counter()
+    try:
+        if cursor is not None:
+            source, offset = cursor
+            fetch = fetch_tcg_results_async if source == 'tcg' else fetch_general_results_async
+            return await fetch(query, offset)
+        if strategy == 'parallel':
+            return await search_parallel_async(query)
+        page = await fetch_tcg_results_async(query)
+        if not page['results']:
+            page = await fetch_general_results_async(query)
+        return page
+    finally:
+        SEARCH_LATENCY[strategy if cursor is None else 'page'].observe(time.perf_counter() - started)
+
+
+class SearchResultCache:
+    """Size-bounded LRU cache with per-entry TTL and stale-while-revalidate.
+
+    Entries younger than ttl are served as hits. Entries older than ttl but
+    within stale_ttl are served immediately while a background thread
+    refreshes them. Timestamps are wall-clock so a persisted cache keeps its
+    expiry times across restarts.
+    """
+
+    FILE_VERSION = 2  # values are search pages, {'results': [...], 'next': cursor}
+
+    def __init__(self, max_entries=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL,
+                 stale_ttl=SEARCH_CACHE_STALE_TTL, path=SEARCH_CACHE_FILE):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.path = path
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._dirty = False
+        self.hits = 0
+        self.stale_hits = 0
+        self.expired_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refresh_errors = 0
+
+    def get(self, key, allow_expired=False):
+        """Return (value, state) where state is 'hit', 'stale', 'expired' or 'miss'.
+
+        Expired entries are only returned with allow_expired, e.g. while
+        upstream is unavailable and an old answer beats none.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry[0]
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1], 'hit'
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    return entry[1], 'stale'
+                if allow_expired:
+                    self.expired_hits += 1
+                    return entry[1], 'expired'
+                del self._entries[key]
+                self._dirty = True
+            self.misses += 1
+            return None, 'miss'
+
+    def set(self, key, value, stored_at=None):
+        with self._lock:
+            self._entries[key] = (time.time() if stored_at is None else stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+
+    def contains(self, key):
+        """Whether key has a fresh or stale entry, without counting a lookup"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.time() - entry[0] < self.ttl + self.stale_ttl
+
+    def get_or_fetch(self, key, fetch, allow_expired=False):
+        """Return (value, state), calling fetch() on a miss or refreshing a stale entry"""
+        value, state = self.get(key, allow_expired)
+        if state == 'miss':
+            value = fetch()
+            self.set(key, value)
+        elif state == 'stale':
+            self.refresh_in_background(key, fetch)
+        return value, state
+
+    def refresh_in_background(self, key, fetch):
+        """Refresh key from fetch() on a daemon thread, once per key at a time"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.set(key, fetch())
+            except UpstreamUnavailable:
+                with self._lock:
+                    self.refresh_errors += 1
+            except Exception as e:
+                with self._lock:
+                    self.refresh_errors += 1
+                log_event(f"Search cache refresh error: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        thread = threading.Thread(target=refresh, name="search-cache-refresh")
+        thread.daemon = True
+        thread.start()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.expired_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'expired_hits': self.expired_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'refresh_errors': self.refresh_errors,
+                'hit_ratio': (round((self.hits + self.stale_hits + self.expired_hits) / lookups, 4)
+                              if lookups else 0.0),
+            }
+
+    def load(self):
+        """Load persisted entries, skipping any that have fully expired"""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Search cache load error: {e}")
+            return 0
+        if not isinstance(saved, dict) or saved.get('version') != self.FILE_VERSION:
+            return 0
+        entries = saved.get('entries')
+        if not isinstance(entries, list):
+            print("Search cache load error: entries is not a list")
+            return 0
+        cutoff = time.time() - self.ttl - self.stale_ttl
+        loaded = skipped = 0
+        for entry in entries:
+            # A hand-edited or truncated file shouldn't stop the server from starting
+            if not (isinstance(entry, list) and len(entry) == 3 and isinstance(entry[0], str) and
+                    type(entry[1]) in (int, float) and isinstance(entry[2], dict)):
+                skipped += 1
+                continue
+            key, stored_at, value = entry
+            if stored_at > cutoff:
+                self.set(key, value, stored_at)
+                loaded += 1
+        if skipped:
+            print(f"Search cache load: skipped {skipped} malformed entries")
+        with self._lock:
+            self._dirty = False
+        return loaded
+
+    def save(self):
+        """Write the cache to disk atomically if it changed since the last save"""
+        if not self.path:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            entries = [[key, stored_at, value] for key, (stored_at, value) in self._entries.items()]
+            self._dirty = False
+        # Per process, as prefork workers save the same cache file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.FILE_VERSION, 'entries': entries}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            with self._lock:
+                self._dirty = True
+            log_event(f"Search cache save error: {e}")
+            return False
+        return True
+
+    def start_autosave(self, interval=SEARCH_CACHE_SAVE_INTERVAL):
+        """Periodically persist the cache from a daemon thread"""
+        if not self.path:
+            return None
+
+        def autosave():
+            while True:
+                time.sleep(interval)
+                self.save()
+
+        thread = threading.Thread(target=autosave, name="search-cache-autosave")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+SEARCH_CACHE = SearchResultCache()
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for it and receive the same result, or the same exception.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def do(self, key, fn):
+        """Return fn() for key, sharing the result with concurrent callers"""
+        with self._lock:
+            self.requests += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    self.errors += 1
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'upstream_calls': self.executions,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'in_flight': len(self._calls),
+            }
+
+
+SEARCH_FLIGHTS = SingleFlight()
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines running on one event loop"""
+
+    async def do(self, key, coro_fn):
+        """Await coro_fn() for key, sharing the result with concurrent awaiters"""
+        with self._lock:
+            self.requests += 1
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                future = asyncio.ensure_future(self._run(key, coro_fn))
+                self._calls[key] = future
+                self.executions += 1
+        # Shield so one cancelled awaiter doesn't cancel the fetch for the rest
+        return await asyncio.shield(future)
+
+    async def _run(self, key, coro_fn):
+        try:
+            return await coro_fn()
+        except BaseException:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+ASYNC_SEARCH_FLIGHTS = AsyncSingleFlight()
+
+
+def fetch_search_results(query, cursor=None):
+    """Search Bulbapedia, sharing one upstream fetch between identical concurrent queries"""
+    return SEARCH_FLIGHTS.do(search_cache_key(query, cursor), lambda: search_bulbapedia(query, cursor=cursor))
+
+
+# Search prefetch settings
+SEARCH_PREFETCH_CONCURRENCY = 2   # next-page fetches in flight at once; 0 disables prefetching
+SEARCH_PREFETCH_QUEUE = 32        # prefetches waiting for a worker before new ones are dropped
+SEARCH_PREFETCH_MIN_TOKENS = 2.0  # rate limiter tokens kept free for client requests
+
+
+class SearchPrefetcher:
+    """Fetch the next page of a search into SEARCH_CACHE while the client reads this one.
+
+    Prefetches run on a small pool of their own so they never take a slot
+    from a client request, and are dropped rather than queued without
+    bound. They also stand aside while the circuit breaker is open or the
+    upstream rate limiter is running low, so paging never adds upstream
+    load that real requests would have to wait behind.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queued = set()
+        self.scheduled = 0
+        self.fetched = 0
+        self.cached = 0
+        self.dropped = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def _get_executor(self):
+        # Created on first use so prefork workers don't inherit its threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=SEARCH_PREFETCH_CONCURRENCY,
+                                                thread_name_prefix="search-prefetch")
+        return self._executor
+
+    def _upstream_busy(self):
+        return UPSTREAM_BREAKER.is_open() or UPSTREAM_LIMITER.available() < SEARCH_PREFETCH_MIN_TOKENS
+
+    def prefetch(self, query, next_cursor):
+        """Schedule a fetch of the page next_cursor points at, if it is worth one"""
+        if not next_cursor or SEARCH_PREFETCH_CONCURRENCY <= 0:
+            return False
+        cursor = decode_search_cursor(next_cursor)
+        key = search_cache_key(query, cursor)
+        with self._lock:
+            if key in self._queued:
+                return False
+            if SEARCH_CACHE.contains(key):
+                self.cached += 1
+                return False
+            if len(self._queued) >= SEARCH_PREFETCH_CONCURRENCY + SEARCH_PREFETCH_QUEUE:
+                self.dropped += 1
+                return False
+            if self._upstream_busy():
+                self.throttled += 1
+                return False
+            self._queued.add(key)
+            self.scheduled += 1
+            executor = self._get_executor()
+        executor.submit(self._fetch, query, cursor, key)
+        return True
+
+    def _fetch(self, query, cursor, key):
+        try:
+            # Conditions may have changed while this waited for a worker
+            if SEARCH_CACHE.contains(key):
+                with self._lock:
+                    self.cached += 1
+                return
+            if self._upstream_busy():
+                with self._lock:
+                    self.throttled += 1
+                return
+            SEARCH_CACHE.set(key, fetch_search_results(query, cursor))
+            with self._lock:
+                self.fetched += 1
+        except UpstreamUnavailable:
+            with self._lock:
+                self.throttled += 1
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            log_event(f"Search prefetch error for {query!r}: {e}")
+        finally:
+            with self._lock:
+                self._queued.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'concurrency': SEARCH_PREFETCH_CONCURRENCY,
+                'queued': len(self._queued),
+                'scheduled': self.scheduled,
+                'fetched': self.fetched,
+                'cached': self.cached,
+                'dropped': self.dropped,
+                'throttled': self.throttled,
+                'errors': self.errors,
+            }
+
+
+SEARCH_PREFETCHER = SearchPrefetcher()
+
+
+# Bulk search settings
+BULK_SEARCH_MAX_QUERIES = 200   # queries accepted by one /api/search/bulk request
+BULK_SEARCH_CONCURRENCY = 8     # upstream searches in flight for bulk requests, across all clients
+
+_bulk_search_executor = None
+_bulk_search_executor_lock = threading.Lock()
+
+
+def get_bulk_search_executor():
+    """Lazily create the thread pool that bounds bulk search fan-out"""
+    global _bulk_search_executor
+    with _bulk_search_executor_lock:
+        if _bulk_search_executor is None:
+            _bulk_search_executor = ThreadPoolExecutor(max_workers=BULK_SEARCH_CONCURRENCY,
+                                                       thread_name_prefix="bulk-search")
+        return _bulk_search_executor
+
+
+def dedupe_queries(queries):
+    """Map each distinct normalized query to (first spelling, input positions)"""
+    unique = OrderedDict()
+    for position, query in enumerate(queries):
+        query = query.strip()
+        if query:
+            unique.setdefault(normalize_query(query), (query, []))[1].append(position)
+    return unique
+
+
+def bulk_search(queries):
+    """Yield one result per distinct query, as soon as each is known.
+
+    Local index and cached answers come first; misses are fetched on the
+    shared bulk pool and yielded in completion order. Closing the
+    generator early cancels fetches that have not started.
+    """
+    immediate, pending = [], {}
+    executor = get_bulk_search_executor()
+    upstream_down = UPSTREAM_BREAKER.is_open()
+    for key, (query, positions) in dedupe_queries(queries).items():
+        item = {'query': query, 'positions': positions}
+        local = LOCAL_INDEX.search(query) if LOCAL_INDEX is not None else []
+        if local:
+            immediate.append(dict(item, results=local, totalFound=len(local), source='local-index'))
+            continue
+        page, cache_status = SEARCH_CACHE.get(key, allow_expired=upstream_down)
+        if cache_status == 'miss':
+            pending[executor.submit(fetch_search_results, query)] = (key, item)
+            continue
+        if cache_status == 'stale':
+            SEARCH_CACHE.refresh_in_background(key, lambda query=query: fetch_search_results(query))
+        results = page['results']
+        immediate.append(dict(item, results=results, totalFound=len(results), source='bulbapedia',
+                              cache=cache_status))
+    try:
+        yield from immediate
+        for future in as_completed(pending):
+            key, item = pending[future]
+            try:
+                page = future.result()
+            except UpstreamUnavailable:
+                yield dict(item, error='Bulbapedia is temporarily unavailable')
+                continue
+            except Exception as e:
+                log_event(f"Bulk search error for {item['query']!r}: {e}")
+                yield dict(item, error='Failed to search Bulbapedia')
+                continue
+            SEARCH_CACHE.set(key, page)
+            results = page['results']
+            yield dict(item, results=results, totalFound=len(results), source='bulbapedia', cache='miss')
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+# Local card index settings
+CARD_INDEX_DIR = None           # directory of index segments; None disables the local index
+CARD_INDEX_RESULT_LIMIT = 15    # results returned per local search (matches the TCG search)
+CARD_INDEX_PREFIX_EXPANSION = 64  # max terms a prefix token expands to
+
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def tokenize(text):
+    """Lowercase alphanumeric tokens of text, ignoring HTML markup in snippets"""
+    return TOKEN_RE.findall(TAG_RE.sub(' ', text).lower())
+
+
+class CardIndexSegment:
+    """One immutable, memory-mapped segment of the local card index.
+
+    Layout (little-endian), after a fixed header of section offsets:
+      doc table    uint32[n_docs + 1]   offsets into the doc blob
+      doc blob     JSON [title, snippet, size, isTCG] per document
+      term table   uint32[n_terms + 1]  offsets into the term blob
+      term blob    sorted UTF-8 terms, "t:<token>" (title) and "b:<token>" (title or snippet)
+      post table   uint32[n_terms + 1]  offsets (in entries) into the postings blob
+      post blob    uint32 doc ids, ascending per term
+
+    Terms are sorted, so exact and prefix lookups are binary searches over
+    the term table and nothing is read into memory up front.
+    """
+
+    MAGIC = b'PCIDX001'
+    HEADER = struct.Struct('<8sII6Q')
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_docs, self.n_terms, self._doc_table, self._doc_blob, self._term_table,
+         self._term_blob, self._post_table, self._post_blob) = self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a card index segment")
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _u32(self, table, index):
+        return struct.unpack_from('<I', self._map, table + 4 * index)[0]
+
+    def _term(self, index):
+        return self._map[self._term_blob + self._u32(self._term_table, index):
+                         self._term_blob + self._u32(self._term_table, index + 1)]
+
+    def _lower_bound(self, key):
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _postings(self, index):
+        start = self._post_blob + 4 * self._u32(self._post_table, index)
+        end = self._post_blob + 4 * self._u32(self._post_table, index + 1)
+        postings = array('I')
+        postings.frombytes(self._map[start:end])
+        if sys.byteorder == 'big':
+            postings.byteswap()
+        return postings
+
+    def lookup(self, field, token, prefix=False):
+        """Doc ids whose field contains token (or a token starting with it)"""
+        key = f"{field}:{token}".encode('utf-8')
+        index = self._lower_bound(key)
+        if not prefix:
+            if index < self.n_terms and self._term(index) == key:
+                return set(self._postings(index))
+            return set()
+        docs = set()
+        for offset in range(CARD_INDEX_PREFIX_EXPANSION):
+            if index + offset >= self.n_terms or not self._term(index + offset).startswith(key):
+                break
+            docs.update(self._postings(index + offset))
+        return docs
+
+    def document(self, doc_id):
+        start = self._doc_blob + self._u32(self._doc_table, doc_id)
+        end = self._doc_blob + self._u32(self._doc_table, doc_id + 1)
+        return json.loads(self._map[start:end].decode('utf-8'))
+
+    def documents(self):
+        for doc_id in range(self.n_docs):
+            yield self.document(doc_id)
+
+    @classmethod
+    def write(cls, path, documents):
+        """Write documents ([title, snippet, size, isTCG] lists) as a new segment"""
+        postings = {}
+        doc_blob = bytearray()
+        doc_table = array('I', [0])
+        for doc_id, doc in enumerate(documents):
+            doc_blob += json.dumps(doc).encode('utf-8')
+            doc_table.append(len(doc_blob))
+            title_tokens = set(tokenize(doc[0]))
+            for token in title_tokens:
+                postings.setdefault(f"t:{token}".encode('utf-8'), []).append(doc_id)
+            for token in title_tokens | set(tokenize(doc[1])):
+                postings.setdefault(f"b:{token}".encode('utf-8'), []).append(doc_id)
+
+        term_blob = bytearray()
+        term_table = array('I', [0])
+        post_blob = array('I')
+        post_table = array('I', [0])
+        for term in sorted(postings):
+            term_blob += term
+            term_table.append(len(term_blob))
+            post_blob.extend(postings[term])
+            post_table.append(len(post_blob))
+        if sys.byteorder == 'big':
+            for table in (doc_table, term_table, post_blob, post_table):
+                table.byteswap()
+
+        sections = [doc_table.tobytes(), bytes(doc_blob), term_table.tobytes(), bytes(term_blob),
+                    post_table.tobytes(), post_blob.tobytes()]
+        offsets = []
+        position = cls.HEADER.size
+        for section in sections:
+            offsets.append(position)
+            position += len(section)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, len(doc_table) - 1, len(term_table) - 1, *offsets))
+            for section in sections:
+                f.write(section)
+        os.replace(tmp_path, path)
+
+
+class LocalCardIndex:
+    """Offline full-text index of card pages built from local dumps.
+
+    Each import writes a new segment, so the index grows incrementally;
+    documents in newer segments replace same-titled documents in older ones.
+    compact() merges all segments into one.
+    """
+
+    SEGMENT_GLOB = 'segment-*.pcx'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency = LatencyHistogram((0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+        self.reload()
+
+    def _segment_paths(self):
+        return sorted(glob.glob(os.path.join(self.directory, self.SEGMENT_GLOB)))
+
+    def reload(self):
+        """(Re)open every segment in the index directory"""
+        segments = [CardIndexSegment(path) for path in self._segment_paths()]
+        with self._lock:
+            old, self.segments = self.segments, segments
+        for segment in old:
+            segment.close()
+        return len(segments)
+
+    def close(self):
+        with self._lock:
+            segments, self.segments = self.segments, []
+        for segment in segments:
+            segment.close()
+
+    def document_count(self):
+        return sum(segment.n_docs for segment in self.segments)
+
+    @staticmethod
+    def _match(segment, field, tokens):
+        matched = None
+        for position, token in enumerate(tokens):
+            docs = segment.lookup(field, token, prefix=position == len(tokens) - 1)
+            matched = docs if matched is None else matched & docs
+            if not matched:
+                return set()
+        return matched
+
+    def search(self, query, limit=CARD_INDEX_RESULT_LIMIT):
+        """Return search results for query, title matches first"""
+        started = time.perf_counter()
+        tokens = tokenize(query)
+        results = []
+        seen_titles = set()
+        if tokens:
+            segments = list(reversed(self.segments))  # newest first
+            for field in ('t', 'b'):
+                for segment in segments:
+                    for doc_id in sorted(self._match(segment, field, tokens)):
+                        # Reclassified rather than using the stored flag, to add the card fields
+                        title, snippet, size, _ = segment.document(doc_id)
+                        if title in seen_titles:
+                            continue
+                        seen_titles.add(title)
+                        results.append({
+                            'title': title,
+                            'snippet': snippet,
+                            'url': f"{BULBAPEDIA_WIKI_URL}{urllib.parse.quote(title.replace(' ', '_'))}",
+                            'size': size,
+                            **get_tcg_classifier().classify(title, snippet)
+                        })
+                        if len(results) >= limit:
+                            break
+                    if len(results) >= limit:
+                        break
+                if len(results) >= limit:
+                    break
+        with self._lock:
+            if results:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self.latency.observe(time.perf_counter() - started)
+        return results
+
+    def add_documents(self, documents):
+        """Write documents as a new segment and open it"""
+        os.makedirs(self.directory, exist_ok=True)
+        paths = self._segment_paths()
+        number = int(os.path.basename(paths[-1])[8:-4]) + 1 if paths else 1
+        path = os.path.join(self.directory, f"segment-{number:06d}.pcx")
+        CardIndexSegment.write(path, documents)
+        self.reload()
+        return path
+
+    def add_dump(self, dump_path):
+        """Import a JSON-lines dump of {"title", "snippet", "size"} records"""
+        documents = {}
+        with open(dump_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                title = record['title']
+                snippet = record.get('snippet', '')
+                documents[title] = [title, snippet, record.get('size', 0), is_tcg_result(title, snippet)]
+        self.add_documents(list(documents.values()))
+        return len(documents)
+
+    def compact(self):
+        """Merge all segments into one, keeping the newest copy of each title"""
+        old_paths = self._segment_paths()
+        if len(old_paths) < 2:
+            return len(old_paths)
+        documents = {}
+        for segment in self.segments:  # oldest first, newer copies overwrite
+            for doc in segment.documents():
+                documents.pop(doc[0], None)
+                documents[doc[0]] = doc
+        self.add_documents(list(documents.values()))
+        self.close()
+        for path in old_paths:
+            os.remove(path)
+        self.reload()
+        return 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'segments': len(self.segments),
+                'documents': self.document_count(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'latency': self.latency.snapshot(),
+            }
+
+
+LOCAL_INDEX = None
+
+
+# Popular TCG sets (served by /api/sets)
+POPULAR_SETS = [
+    {'title': 'Base Set', 'description': 'The original Pokemon TCG set (1998)'},
+    {'title': 'Jungle', 'description': 'Second expansion with jungle Pokemon'},
+    {'title': 'Fossil', 'description': 'Third expansion with fossil Pokemon'},
+    {'title': 'Team Rocket', 'description': 'Dark Pokemon and Team Rocket cards'},
+    {'title': 'Gym Heroes', 'description': 'Gym Leader Pokemon cards'},
+    {'title': 'Gym Challenge', 'description': 'More Gym Leader Pokemon'},
+    {'title': 'Neo Genesis', 'description': 'First set with Generation II Pokemon'},
+    {'title': 'Neo Discovery', 'description': 'Second Neo series set'},
+    {'title': 'Neo Destiny', 'description': 'Third Neo series set'},
+    {'title': 'Expedition Base Set', 'description': 'E-Card series begins'},
+    {'title': 'Aquapolis', 'description': 'E-Card series water Pokemon'},
+    {'title': 'Skyridge', 'description': 'Final E-Card series set'},
+    {'title': 'Ruby & Sapphire', 'description': 'Generation III Pokemon debut'},
+    {'title': 'Sandstorm', 'description': 'Desert-themed Pokemon set'},
+    {'title': 'Dragon', 'description': 'Dragon-type Pokemon introduction'},
+    {'title': 'Team Magma vs Team Aqua', 'description': 'Hoenn villains clash'},
+    {'title': 'Hidden Legends', 'description': 'Legendary Pokemon focus'},
+    {'title': 'FireRed & LeafGreen', 'description': 'Kanto remakes tie-in'},
+    {'title': 'Deoxys', 'description': 'Mythical Pokemon Deoxys'},
+    {'title': 'Emerald', 'description': 'Emerald version tie-in'}
+]
+
+# Common card suggestions
+COMMON_CARDS = [
+    'Pikachu', 'Charizard', 'Blastoise', 'Venusaur', 'Mewtwo', 'Mew',
+    'Lugia', 'Ho-oh', 'Rayquaza', 'Arceus', 'Base Set', 'Jungle', 'Fossil'
+]
+
+# Card printings reported in search results, by the words that name them
+TCG_VARIANTS = {
+    'holo': 'holo',
+    'holofoil': 'holo',
+    'holographic': 'holo',
+    'reverse holo': 'reverse holo',
+    'shadowless': 'shadowless',
+    '1st edition': '1st edition',
+    'first edition': '1st edition',
+}
+
+_HTML_TAG_RE = re.compile(r'<[^>]*>')
+
+
+class TCGClassifier:
+    """Classifies search results and extracts card metadata in one regex pass.
+
+    Set names, TCG keywords, card numbers and variant words are compiled
+    into a single alternation, so each result costs one finditer() over its
+    title and snippet. Set names tolerate the searchmatch <span> tags and
+    &amp; escapes that Bulbapedia puts in snippets.
+
+    Every alternative starts with a literal character and ends in an empty
+    marker group. The literals let the regex engine jump straight to the
+    positions where something can match (a leading \\b would defeat that, so
+    word starts are checked by a lookbehind after the first character), and
+    match.lastindex names what matched without re-reading the text.
+    """
+
+    def __init__(self, set_names, variants=TCG_VARIANTS):
+        set_names = sorted(set_names, key=len, reverse=True)
+        self.set_names = {self._normalize(name): name for name in set_names}
+        sets = '|'.join(self._name_pattern(name) for name in set_names)
+        entries = [('tagged', None, rf"\((?P<tagged_set>{sets})"
+                                    rf"(?:[ _]+(?P<tagged_number>[A-Za-z]{{0,3}}\d{{1,3}}[a-z]?))?\)")]
+        entries += [('set', name, self._word(self._name_pattern(name))) for name in set_names]
+        entries += [('number', None, self._word(digit + r'\d{0,2}/\d{1,3}')) for digit in '0123456789']
+        entries.append(('tcg', None, self._word('TCG')))
+        entries += [('card', None, self._word(word + 's?')) for word in ('card', 'Card', 'CARD')]
+        for word in sorted(variants, key=len, reverse=True):
+            for spelling in sorted({word, word.capitalize(), word.title(), word.upper()}):
+                entries.append(('variant', variants[word], self._word(self._name_pattern(spelling))))
+        # Groups 1 and 2 are tagged_set and tagged_number; each alternative then closes its own marker
+        self.markers = {group: (kind, value) for group, (kind, value, _) in enumerate(entries, 3)}
+        self.pattern = re.compile('|'.join(f"{pattern}()" for _, _, pattern in entries))
+
+    @staticmethod
+    def _name_pattern(name):
+        """Regex for name, allowing tags or extra spaces between its words"""
+        words = [re.escape(word).replace('&', '&(?:amp;)?') for word in name.split()]
+        return r'(?:\s|<[^>]*>)+'.join(words)
+
+    @staticmethod
+    def _word(pattern):
+        """pattern as a whole word, keeping its first character a plain literal.
+
+        The lookbehind goes after the first literal, which is two characters
+        of pattern when re.escape() escaped it (set names like "(Promo)").
+        """
+        first = 2 if pattern.startswith('\\') else 1
+        return pattern[:first] + r'(?<!\w.)' + pattern[first:] + r'(?!\w)'
+
+    @staticmethod
+    def _normalize(text):
+        return ' '.join(html.unescape(_HTML_TAG_RE.sub(' ', text)).split()).lower()
+
+    @staticmethod
+    def unclassified():
+        """Card fields for a result that isn't a TCG card"""
+        return {'isTCG': False, 'set': None, 'cardNumber': None, 'variants': []}
+
+    def classify(self, title, snippet):
+        """Result fields: isTCG, and the card's set, cardNumber and variants when it is one.
+
+        A set in parentheses in the title, "Charizard (Base Set 4)", marks a
+        card page; so do "TCG" anywhere or "card" in the snippet. The first
+        set and number found win, so the title's take precedence.
+        """
+        boundary = len(title)
+        is_tcg = False
+        set_name = number = None
+        variants = []
+        for match in self.pattern.finditer(f"{title}\n{snippet}"):
+            kind, value = self.markers[match.lastindex]
+            if kind == 'tagged':
+                is_tcg = is_tcg or match.start() < boundary
+                if set_name is None:
+                    set_name = self.set_names.get(self._normalize(match.group('tagged_set')))
+                    number = number or match.group('tagged_number')
+            elif kind == 'set':
+                set_name = set_name or value
+            elif kind == 'number':
+                number = number or match.group().split('/')[0]
+            elif kind == 'tcg':
+                is_tcg = True
+            elif kind == 'card':
+                is_tcg = is_tcg or match.start() > boundary
+            elif value not in variants:
+                variants.append(value)
+        if not is_tcg:
+            return self.unclassified()
+        return {'isTCG': True, 'set': set_name, 'cardNumber': number, 'variants': variants}
+
+
+_tcg_classifier = None
+_tcg_classifier_lock = threading.Lock()
+
+
+def get_tcg_classifier():
+    """The classifier for the set catalog, compiled on first use or by warm_up()"""
+    global _tcg_classifier
+    with _tcg_classifier_lock:
+        if _tcg_classifier is None:
+            _tcg_classifier = TCGClassifier([set_info['title'] for set_info in catalog_sets()])
+        return _tcg_classifier
+
+# Card catalog settings
+CATALOG_FILE = None             # SQLite catalog of sets and cards; None serves /api/sets from POPULAR_SETS
+CATALOG_PAGE_SIZE = 50          # cards per /api/cards page by default
+CATALOG_MAX_PAGE_SIZE = 1000
+CATALOG_IMPORT_BATCH = 5000     # rows written per executemany() during an import
+
+
+class CatalogQueryError(ValueError):
+    """An /api/cards query has an unknown sort or a malformed cursor"""
+
+
+class CardCatalog:
+    """Local SQLite catalog of sets and cards, queried with keyset pagination.
+
+    Pages continue from the sort key of the last row returned (an opaque
+    cursor) instead of an OFFSET, so page 1000 costs the same index seek as
+    page 1. Every sort order has a matching index ending in the row id,
+    which makes the keys unique. Each thread gets its own connection, and a
+    forked worker opens fresh ones rather than reusing its parent's.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sets (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            description TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS cards (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL COLLATE NOCASE,
+            set_id INTEGER NOT NULL REFERENCES sets (id),
+            number TEXT NOT NULL COLLATE NOCASE,
+            number_sort INTEGER NOT NULL,
+            type TEXT COLLATE NOCASE,
+            rarity TEXT COLLATE NOCASE,
+            hp INTEGER,
+            UNIQUE (set_id, number)
+        );
+        CREATE INDEX IF NOT EXISTS cards_name ON cards (name, id);
+        CREATE INDEX IF NOT EXISTS cards_set ON cards (set_id, number_sort, number, id);
+        CREATE INDEX IF NOT EXISTS cards_number ON cards (number_sort, number, id);
+        CREATE INDEX IF NOT EXISTS cards_type ON cards (type, name, id);
+    """
+
+    COLUMNS = "c.id, c.name, s.title, c.number, c.type, c.rarity, c.hp, c.set_id, c.number_sort"
+    # Sort name -> (ORDER BY columns, their positions in COLUMNS), always ending in the unique id
+    SORTS = {
+        'name': (('c.name', 'c.id'), (1, 0)),
+        'number': (('c.number_sort', 'c.number', 'c.id'), (8, 3, 0)),
+        'set': (('c.set_id', 'c.number_sort', 'c.number', 'c.id'), (7, 8, 3, 0)),
+    }
+    TEXT_KEYS = {'c.name', 'c.number'}  # every other sort column is a NOT NULL integer
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.latency = LatencyHistogram((0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executescript(self.SCHEMA)
+                if connection.execute("SELECT count(*) FROM sets").fetchone()[0] == 0:
+                    connection.executemany("INSERT INTO sets (title, description) VALUES (?, ?)",
+                                           [(info['title'], info['description']) for info in POPULAR_SETS])
+        finally:
+            connection.close()
+        self.set_count, self.card_count = self._connection().execute(
+            "SELECT (SELECT count(*) FROM sets), (SELECT count(*) FROM cards)").fetchone()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")  # imports don't block readers
+        return connection
+
+    def _connection(self):
+        """This thread's read-only connection"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = self._connect()
+            local.connection.execute("PRAGMA query_only = ON")
+            local.pid = os.getpid()
+        return local.connection
+
+    def sets(self):
+        """Every set in catalog order, with its card count"""
+        rows = self._connection().execute("""
+            SELECT s.title, s.description, (SELECT count(*) FROM cards c WHERE c.set_id = s.id)
+            FROM sets s ORDER BY s.id""").fetchall()
+        return [{'title': title, 'description': description, 'cards': cards}
+                for title, description, cards in rows]
+
+    @staticmethod
+    def encode_cursor(sort, descending, key):
+        token = json.dumps([sort, descending, *key], separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(token).rstrip(b'=').decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor, sort, descending):
+        try:
+            token = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (ValueError, binascii.Error):
+            raise CatalogQueryError("cursor is malformed")
+        if not isinstance(token, list) or token[:2] != [sort, descending] or \
+                len(token) != 2 + len(CardCatalog.SORTS[sort][0]):
+            raise CatalogQueryError("cursor doesn't belong to this sort order")
+        for column, value in zip(CardCatalog.SORTS[sort][0], token[2:]):
+            # type() rather than isinstance() so JSON true/false aren't taken as ints
+            if type(value) is not (str if column in CardCatalog.TEXT_KEYS else int):
+                raise CatalogQueryError("cursor is malformed")
+        return token[2:]
+
+    def query(self, name=None, set_title=None, number=None, card_type=None, rarity=None,
+              sort='name', descending=False, limit=CATALOG_PAGE_SIZE, cursor=None):
+        """One page of matching cards and the cursor for the next page (None on the last)"""
+        if sort not in self.SORTS:
+            raise CatalogQueryError(f"sort must be one of {', '.join(self.SORTS)}")
+        order_columns, key_positions = self.SORTS[sort]
+        started = time.perf_counter()
+        where, params = [], []
+        if name:
+            # A range on the NOCASE name index is a prefix match that can seek. When
+            # paging by name, the cursor is the tighter bound on its side, and leaving
+            # the prefix bound out keeps SQLite seeking to the cursor, not scanning to it
+            if not (cursor and sort == 'name' and not descending):
+                where.append("c.name >= ?")
+                params.append(name)
+            if not (cursor and sort == 'name' and descending):
+                where.append("c.name < ?")
+                params.append(name + '\U0010ffff')
+        if set_title:
+            where.append("c.set_id = (SELECT id FROM sets WHERE title = ?)")
+            params.append(set_title)
+        if number:
+            where.append("c.number = ?")
+            params.append(number)
+        if card_type:
+            where.append("c.type = ?")
+            params.append(card_type)
+        if rarity:
+            where.append("c.rarity = ?")
+            params.append(rarity)
+        if cursor:
+            where.append(f"({', '.join(order_columns)}) {'<' if descending else '>'} "
+                         f"({', '.join('?' * len(order_columns))})")
+            params += self.decode_cursor(cursor, sort, descending)
+        direction = ' DESC' if descending else ''
+        sql = (f"SELECT {self.COLUMNS} FROM cards c JOIN sets s ON s.id = c.set_id"
+               f"{' WHERE ' + ' AND '.join(where) if where else ''}"
+               f" ORDER BY {', '.join(column + direction for column in order_columns)} LIMIT ?")
+        rows = self._connection().execute(sql, params + [limit + 1]).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(sort, descending, [rows[-1][position] for position in key_positions])
+        cards = [{
+            'name': card_name,
+            'set': title,
+            'number': card_number,
+            'type': kind,
+            'rarity': card_rarity,
+            'hp': hp,
+            'url': f"{BULBAPEDIA_WIKI_URL}{urllib.parse.quote(f'{card_name} ({title} {card_number})'.replace(' ', '_'))}",
+        } for _, card_name, title, card_number, kind, card_rarity, hp, _, _ in rows]
+        with self._lock:
+            self.queries += 1
+        self.latency.observe(time.perf_counter() - started)
+        return cards, next_cursor
+
+    @staticmethod
+    def _number_sort(number):
+        digits = re.search(r'\d+', number)
+        return int(digits.group()) if digits else 0
+
+    def import_dump(self, dump_path):
+        """Import a JSON-lines dump of set and card records in one transaction.
+
+        Records with a "name" are cards ({"name", "set", "number", and optional
+        "type", "rarity", "hp"}); records with only a "title" are sets
+        ({"title", "description"}). Existing sets and cards (by set and number)
+        are updated in place. Returns (sets, cards) records imported.
+        """
+        card_rows = []
+        connection = self._connect()
+        try:
+            with connection:
+                set_ids = {title.lower(): set_id for set_id, title in connection.execute("SELECT id, title FROM sets")}
+
+                def set_id(title, description=None):
+                    key = title.lower()
+                    if description is not None:
+                        connection.execute("""
+                            INSERT INTO sets (title, description) VALUES (?, ?)
+                            ON CONFLICT (title) DO UPDATE SET description = excluded.description""",
+                                           (title, description))
+                        set_ids[key] = connection.execute("SELECT id FROM sets WHERE title = ?", (title,)).fetchone()[0]
+                    elif key not in set_ids:
+                        set_ids[key] = connection.execute("INSERT INTO sets (title) VALUES (?)", (title,)).lastrowid
+                    return set_ids[key]
+
+                def flush():
+                    connection.executemany("""
+                        INSERT INTO cards (name, set_id, number, number_sort, type, rarity, hp)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (set_id, number) DO UPDATE SET name = excluded.name,
+                            number_sort = excluded.number_sort, type = excluded.type,
+                            rarity = excluded.rarity, hp = excluded.hp""", card_rows)
+                    card_rows.clear()
+
+                sets = cards = 0
+                with open(dump_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        record = json.loads(line)
+                        if 'name' not in record:
+                            set_id(record['title'], record.get('description', ''))
+                            sets += 1
+                            continue
+                        number = str(record['number'])
+                        card_rows.append((record['name'], set_id(record['set']), number, self._number_sort(number),
+                                          record.get('type'), record.get('rarity'), record.get('hp')))
+                        cards += 1
+                        if len(card_rows) >= CATALOG_IMPORT_BATCH:
+                            flush()
+                flush()
+                self.set_count, self.card_count = connection.execute(
+                    "SELECT (SELECT count(*) FROM sets), (SELECT count(*) FROM cards)").fetchone()
+        finally:
+            connection.close()
+        return sets, cards
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local = threading.local()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': self.path,
+                'sets': self.set_count,
+                'cards': self.card_count,
+                'queries': self.queries,
+                'latency': self.latency.snapshot(),
+            }
+
+
+CATALOG = None
+
+
+def catalog_sets():
+    """The sets served by /api/sets and known to the search classifier"""
+    if CATALOG is not None:
+        return CATALOG.sets()
+    return POPULAR_SETS
+
+
+# Typeahead settings
+SUGGEST_MAX_ENTRIES = 5000      # learned titles kept (seed entries are never evicted)
+SUGGEST_DEFAULT_LIMIT = 8
+SUGGEST_MAX_LIMIT = 25
+SUGGEST_MAX_SCAN = 1000         # max prefix matches ranked per lookup
+
+
+class SuggestionIndex:
+    """Prefix lookup over known titles, kept as a sorted key array for bisect.
+
+    Seed titles are pinned; titles learned from search results gain
+    popularity each time they are seen and the least popular learned titles
+    are evicted once the index is full.
+    """
+
+    def __init__(self, max_entries=SUGGEST_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._keys = []        # sorted normalized titles
+        self._entries = {}     # key -> [title, score, pinned]
+        self._lock = threading.Lock()
+        self._unpinned = 0
+        self.learned = 0
+        self.evictions = 0
+        self.lookups = 0
+
+    def seed(self, titles, score):
+        with self._lock:
+            for title in titles:
+                self._add(title, score, pinned=True)
+
+    def learn(self, titles):
+        """Record titles seen in search results, bumping their popularity"""
+        with self._lock:
+            for title in titles:
+                self._add(title, 1, pinned=False)
+            self._evict()
+
+    def _add(self, title, score, pinned):
+        key = normalize_query(title)
+        if not key:
+            return
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[1] += score
+            if pinned and not entry[2]:
+                entry[2] = True
+                self._unpinned -= 1
+            return
+        self._entries[key] = [title, score, pinned]
+        bisect.insort(self._keys, key)
+        if not pinned:
+            self._unpinned += 1
+            self.learned += 1
+
+    def _evict(self):
+        if self._unpinned <= self.max_entries:
+            return
+        # Evict a tenth of the capacity at once so inserts stay amortized cheap
+        excess = max(self._unpinned - self.max_entries, self.max_entries // 10)
+        learned = [key for key, entry in self._entries.items() if not entry[2]]
+        for key in heapq.nsmallest(excess, learned, key=lambda k: self._entries[k][1]):
+            del self._entries[key]
+            self._unpinned -= 1
+            self.evictions += 1
+        self._keys = sorted(self._entries)
+
+    def suggest(self, prefix, limit=SUGGEST_DEFAULT_LIMIT):
+        """Top titles starting with prefix, most popular first"""
+        key = normalize_query(prefix)
+        if not key:
+            return []
+        with self._lock:
+            self.lookups += 1
+            start = bisect.bisect_left(self._keys, key)
+            candidates = []
+            for candidate in itertools.islice(self._keys, start, start + SUGGEST_MAX_SCAN):
+                if not candidate.startswith(key):
+                    break
+                candidates.append(self._entries[candidate])
+        top = heapq.nsmallest(limit, candidates, key=lambda entry: (-entry[1], entry[0]))
+        return [{'title': entry[0], 'score': entry[1]} for entry in top]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'learned': self.learned,
+                'evictions': self.evictions,
+                'lookups': self.lookups,
+            }
+
+
+SUGGESTIONS = SuggestionIndex()
+SUGGESTIONS.seed([set_info['title'] for set_info in POPULAR_SETS], 5)
+SUGGESTIONS.seed(COMMON_CARDS, 10)
+
+
+# Search tips shared by the image endpoints
+SEARCH_TIPS = [
+    'Use Google Lens for the most accurate visual matching',
+    'Try searching with card name + "TCG" for specific results',
+    'Include set name (Base Set, Jungle, etc.) for precise matches',
+    'Search for card number if visible on the card',
+    'Try "holographic" or "shadowless" for special variants'
+]
+
+# Pokemon search terms
+POKEMON_SEARCH_TERMS = [
+    'pokemon card base set',
+    'pokemon tcg vintage',
+    'pokemon card holographic',
+    'pokemon trading card game',
+    'pokemon card collection',
+    'pokemon tcg expansion'
+]
+
+# External card sites for /api/web-search ({query} is the URL-quoted search)
+WEB_SEARCH_SITES = [
+    ('TCGPlayer', 'https://www.tcgplayer.com/search/pokemon?q={query}',
+     'Buy and sell Pokemon cards with price tracking'),
+    ('Pokemon TCG Database', 'https://pokemontcg.io/',
+     'Complete Pokemon TCG card database with API'),
+    ('Serebii TCG', 'https://www.serebii.net/card/',
+     'Comprehensive Pokemon card information and sets'),
+    ('Pokemon Official', 'https://www.pokemon.com/us/pokemon-tcg/',
+     'Official Pokemon Trading Card Game website'),
+    ('Pokellector', 'https://www.pokellector.com/search?q={query}',
+     'Pokemon card collection tracker and database'),
+]
+
+MAIN_PAGE_HTML = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
@@ -82,9 +2738,12 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
                             <input 
                                 type="text" 
                                 id="searchInput" 
+                                list="searchSuggestions"
+                                autocomplete="off"
                                 placeholder="Enter card name (e.g., Pikachu, Charizard)" 
                                 class="flex-1 px-4 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent"
                             >
+                            <datalist id="searchSuggestions"></datalist>
                             <button 
                                 onclick="searchByText()" 
                                 class="px-6 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition-colors"
@@ -170,8 +2829,12 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
 
     <script>
         // Frontend JavaScript
-        async function searchByText() {
-            const query = document.getElementById('searchInput').value.trim();
+        let currentQuery = '';
+        let currentNext = null;
+        let currentPageStart = 0;
+
+        async function searchByText(nextPage) {
+            const query = nextPage ? currentQuery : document.getElementById('searchInput').value.trim();
             if (!query) {
                 alert('Please enter a search term');
                 return;
@@ -181,9 +2844,18 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
             hideResults();
 
             try {
-                const response = await fetch('/api/search?q=' + encodeURIComponent(query));
+                let url = '/api/search?q=' + encodeURIComponent(query);
+                if (nextPage) {
+                    url += '&cursor=' + encodeURIComponent(currentNext);
+                    currentPageStart += document.querySelectorAll('#resultsContainer .search-result').length;
+                } else {
+                    currentPageStart = 0;
+                }
+                const response = await fetch(url);
                 const data = await response.json();
-                displayResults(data.results, `Search results for "${query}"`);
+                currentQuery = query;
+                currentNext = data.next || null;
+                displayResults(data.results, `Search results for "${query}"`, currentNext);
             } catch (error) {
                 console.error('Search error:', error);
                 showError('Failed to search. Please try again.');
@@ -209,18 +2881,34 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
             showLoading();
             hideResults();
 
-            // Simulate image analysis
-            setTimeout(() => {
-                displayImageAnalysis({
-                    detected_text: 'Image uploaded successfully!',
-                    confidence: 0.8,
-                    suggestions: ['Pikachu', 'Charizard', 'Base Set']
-                });
+            const reader = new FileReader();
+            reader.onload = async () => {
+                try {
+                    const response = await fetch('/api/analyze-image', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ image_data: reader.result })
+                    });
+                    const data = await response.json();
+                    if (!response.ok) {
+                        throw new Error(data.error || 'Image analysis failed');
+                    }
+                    displayImageAnalysis(data);
+                } catch (error) {
+                    console.error('Image analysis error:', error);
+                    showError('Failed to analyze image');
+                } finally {
+                    hideLoading();
+                }
+            };
+            reader.onerror = () => {
                 hideLoading();
-            }, 2000);
+                showError('Failed to read image file');
+            };
+            reader.readAsDataURL(file);
         }
 
-        function displayResults(results, title) {
+        function displayResults(results, title, next) {
             const resultsDiv = document.getElementById('results');
             const containerDiv = document.getElementById('resultsContainer');
             
@@ -244,14 +2932,16 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
             
             results.forEach((result, index) => {
                 const tcgBadge = result.isTCG ? '<span class="inline-block px-2 py-1 bg-red-100 text-red-800 text-xs font-semibold rounded-full mr-2">TCG</span>' : '';
+                const setBadge = result.set ? `<span class="inline-block px-2 py-1 bg-blue-100 text-blue-800 text-xs font-semibold rounded-full mr-2">${result.set}${result.cardNumber ? ' #' + result.cardNumber : ''}</span>` : '';
+                const variantBadges = (result.variants || []).map(variant => `<span class="inline-block px-2 py-1 bg-yellow-100 text-yellow-800 text-xs font-semibold rounded-full mr-2">${variant}</span>`).join('');
                 
                 html += `
                     <div class="bg-white rounded-lg shadow-md p-6 hover:shadow-lg transition-shadow search-result">
                         <div class="flex justify-between items-start mb-3">
                             <div class="flex-1">
                                 <div class="mb-2">
-                                    ${tcgBadge}
-                                    <span class="text-xs text-gray-500">#${index + 1}</span>
+                                    ${tcgBadge}${setBadge}${variantBadges}
+                                    <span class="text-xs text-gray-500">#${currentPageStart + index + 1}</span>
                                 </div>
                                 <h4 class="text-lg font-semibold text-blue-600 hover:text-blue-800">
                                     <a href="${result.url}" target="_blank" rel="noopener noreferrer">
@@ -284,6 +2974,16 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
                 `;
             });
 
+            if (next) {
+                html += `
+                    <div class="text-center">
+                        <button onclick="searchByText(true)" class="bg-blue-600 text-white px-6 py-2 rounded-lg hover:bg-blue-700 transition-colors">
+                            Next page <i class="fas fa-arrow-right ml-1"></i>
+                        </button>
+                    </div>
+                `;
+            }
+
             containerDiv.innerHTML = html;
             resultsDiv.classList.remove('hidden');
         }
@@ -591,6 +3291,29 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
             resultsDiv.classList.remove('hidden');
         }
 
+        // Typeahead suggestions
+        let suggestTimer = null;
+        async function loadSuggestions() {
+            const prefix = document.getElementById('searchInput').value.trim();
+            const list = document.getElementById('searchSuggestions');
+            if (!prefix) {
+                list.innerHTML = '';
+                return;
+            }
+            try {
+                const response = await fetch('/api/suggest?prefix=' + encodeURIComponent(prefix));
+                const data = await response.json();
+                list.innerHTML = '';
+                (data.suggestions || []).forEach(function(suggestion) {
+                    const option = document.createElement('option');
+                    option.value = suggestion.title;
+                    list.appendChild(option);
+                });
+            } catch (error) {
+                console.error('Suggestion error:', error);
+            }
+        }
+
         // Add Enter key support
         document.addEventListener('DOMContentLoaded', function() {
             const searchInput = document.getElementById('searchInput');
@@ -600,110 +3323,1466 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
                         searchByText();
                     }
                 });
+                searchInput.addEventListener('input', function() {
+                    clearTimeout(suggestTimer);
+                    suggestTimer = setTimeout(loadSuggestions, 150);
+                });
             }
         });
     </script>
 </body>
 </html>
         """
-        
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
+
+
+class PrecomputedResponse:
+    """An immutable response body encoded once, with compressed variants and ETags"""
+
+    def __init__(self, body, content_type, cache_control):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, 9)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body)
+        # Drop compressed variants that don't actually save bytes
+        for encoding in [name for name in self.variants if name != 'identity']:
+            if len(self.variants[encoding]) >= len(body):
+                del self.variants[encoding]
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+
+    def etag(self, encoding):
+        """Strong ETag, distinct per content encoding"""
+        if encoding == 'identity':
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def select(self, accept_encoding):
+        """Pick the best (encoding, body) the client accepts"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding, self.variants[encoding]
+        return 'identity', self.variants['identity']
+
+    @staticmethod
+    def matches(if_none_match, etag):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        # If-None-Match uses weak comparison, so W/ prefixes are ignored
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+
+def parse_accept_encoding(header):
+    """Map content codings in an Accept-Encoding header to their q-values"""
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+_static_responses = {}
+_static_responses_lock = threading.Lock()
+
+
+def build_static_responses():
+    """Encode and compress the immutable responses (main page, sets list)"""
+    sets = [{
+        'title': set_info['title'],
+        'description': set_info['description'],
+        'url': f"{BULBAPEDIA_WIKI_URL}{urllib.parse.quote(set_info['title'] + ' (TCG)')}",
+        **({'cards': set_info['cards']} if 'cards' in set_info else {})
+    } for set_info in catalog_sets()]
+    responses = {
+        'main_page': PrecomputedResponse(MAIN_PAGE_HTML.encode('utf-8'), 'text/html; charset=utf-8', 'no-cache'),
+        'sets': PrecomputedResponse(json.dumps({'sets': sets}).encode('utf-8'), 'application/json',
+                                    'public, max-age=3600'),
+    }
+    with _static_responses_lock:
+        _static_responses.update(responses)
+    return responses
+
+
+def get_static_response(name):
+    response = _static_responses.get(name)
+    if response is None:
+        response = build_static_responses()[name]
+    return response
+
+
+# Static file settings
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'static')  # served under /static/, as by the Node.js server; None disables
+
+_static_files = {}  # real path -> ((mtime_ns, size), PrecomputedResponse)
+_static_files_lock = threading.Lock()
+
+
+def get_static_file(name):
+    """PrecomputedResponse for the file name under STATIC_DIR, or None if there isn't one.
+
+    Encoded once and reused until the file's mtime or size changes. Paths
+    that resolve outside STATIC_DIR are treated as missing.
+    """
+    if STATIC_DIR is None or not name:
+        return None
+    root = os.path.realpath(STATIC_DIR)
+    try:
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+            return None
+        info = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    version = (info.st_mtime_ns, info.st_size)
+    cached = _static_files.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    try:
+        with open(path, 'rb') as f:
+            body = f.read()
+    except OSError:
+        return None
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type == 'application/javascript':
+        content_type += '; charset=utf-8'
+    response = PrecomputedResponse(body, content_type, 'public, max-age=3600')
+    with _static_files_lock:
+        _static_files[path] = (version, response)
+    return response
+
+
+# Request body settings
+MAX_REQUEST_BODY = 16 * 1024 * 1024  # bytes; larger uploads are rejected with 413
+MAX_JSON_FIELD_SIZE = 1024 * 1024    # bytes for any JSON value that isn't streamed
+BODY_CHUNK_SIZE = 64 * 1024          # bytes read from the socket at a time
+
+
+class RequestBodyError(ValueError):
+    """The request body is malformed or truncated"""
+
+
+class RequestBodyTooLarge(RequestBodyError):
+    """The request body exceeds the configured size limit"""
+
+
+class RequestBody:
+    """Reads a request body in bounded chunks, decoding chunked framing.
+
+    The size limit is enforced while reading, so an oversized chunked
+    upload is rejected without buffering it first.
+    """
+
+    def __init__(self, rfile, content_length=None, chunked=False, max_size=None):
+        self.rfile = rfile
+        self.content_length = content_length
+        self.chunked = chunked
+        self.max_size = MAX_REQUEST_BODY if max_size is None else max_size
+        self.bytes_read = 0
+        self.finished = False
+        self._chunks = None
+
+    def _count(self, size):
+        self.bytes_read += size
+        if self.bytes_read > self.max_size:
+            raise RequestBodyTooLarge(f"request body exceeds {self.max_size} bytes")
+
+    def _read_exactly(self, size):
+        parts = []
+        while size > 0:
+            data = self.rfile.read(size)
+            if not data:
+                raise RequestBodyError("request body ended early")
+            parts.append(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def iter_chunks(self, chunk_size=BODY_CHUNK_SIZE):
+        """Iterator over the body in pieces of at most chunk_size bytes.
+
+        Repeated calls continue the same iterator, so a partly parsed body
+        can still be drained.
+        """
+        if self._chunks is None:
+            self._chunks = self._generate_chunks(chunk_size)
+        return self._chunks
+
+    def _generate_chunks(self, chunk_size):
+        if self.chunked:
+            while True:
+                line = self.rfile.readline(1024)
+                try:
+                    size = int(line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise RequestBodyError("invalid chunk size")
+                if size == 0:
+                    # Skip trailers up to the terminating blank line
+                    while self.rfile.readline(1024) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                self._count(size)
+                while size > 0:
+                    piece = self._read_exactly(min(size, chunk_size))
+                    size -= len(piece)
+                    yield piece
+                self._read_exactly(2)
+        else:
+            remaining = self.content_length or 0
+            while remaining > 0:
+                piece = self._read_exactly(min(remaining, chunk_size))
+                remaining -= len(piece)
+                self._count(len(piece))
+                yield piece
+        self.finished = True
+
+    def read(self):
+        """The whole body (still subject to the size limit)"""
+        return b''.join(self.iter_chunks())
+
+    def drain(self):
+        for _ in self.iter_chunks():
+            pass
+
+
+class StreamedUpload:
+    """A base64 (or data: URL) JSON string decoded to bytes while it streamed in"""
+
+    def __init__(self, mime_type, data):
+        self.mime_type = mime_type
+        self.data = data
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class _Base64Sink:
+    """Incremental base64 decoder that strips an optional data: URL prefix"""
+
+    def __init__(self):
+        self.mime_type = None
+        self.decoded = bytearray()
+        self._header = ''
+        self._in_header = True
+        self._pending = ''
+
+    def feed(self, text):
+        if self._in_header:
+            self._header += text
+            if ',' in self._header:
+                prefix, text = self._header.split(',', 1)
+                if not prefix.startswith('data:'):
+                    raise RequestBodyError("invalid base64 field")
+                self.mime_type = prefix[5:].split(';', 1)[0] or None
+            elif len(self._header) >= 5 and not self._header.startswith('data:'):
+                text = self._header
+            elif len(self._header) > 256:
+                raise RequestBodyError("invalid data: URL")
+            else:
+                return
+            self._in_header = False
+        self._pending += text
+        usable = len(self._pending) - len(self._pending) % 4
+        if usable:
+            self._decode(self._pending[:usable])
+            self._pending = self._pending[usable:]
+
+    def _decode(self, text):
+        try:
+            self.decoded += binascii.a2b_base64(text)
+        except binascii.Error as e:
+            raise RequestBodyError(f"invalid base64 field: {e}")
+
+    def finish(self):
+        if self._in_header:
+            self._in_header = False
+            self._pending += self._header
+        if self._pending.strip():
+            self._decode(self._pending + '=' * (-len(self._pending) % 4))
+        return StreamedUpload(self.mime_type, self.decoded)
+
+
+class StreamingJSONObjectParser:
+    """Incremental parser for a top-level JSON object read from a RequestBody.
+
+    Values of the keys in stream_fields (a string, or an array of strings)
+    are decoded from base64 as they arrive, so a large image costs its
+    decoded size rather than several copies of the encoded body. Other values are limited to
+    MAX_JSON_FIELD_SIZE and parsed with the standard decoder.
+    """
+
+    _decoder = json.JSONDecoder()
+    _whitespace = ' \t\r\n'
+    _special = re.compile(r'["\\]')
+
+    def __init__(self, chunks, stream_fields=()):
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self.stream_fields = set(stream_fields)
+
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            self._buf = self._buf[self._pos:] + self._text.decode(b'', final=True)
+        else:
+            self._buf = self._buf[self._pos:] + self._text.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Next non-whitespace character, or '' at the end of the body"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._whitespace:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise RequestBodyError(f"expected {char!r} in JSON body")
+        self._pos += 1
+
+    def _value(self):
+        if self._peek() == '':
+            raise RequestBodyError("unexpected end of JSON body")
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                value, end = None, None
+            # A value touching the end of the buffer may be cut short (e.g. a number)
+            if end is not None and (end < len(self._buf) or self._eof):
+                self._pos = end
+                return value
+            if len(self._buf) - self._pos > MAX_JSON_FIELD_SIZE:
+                raise RequestBodyTooLarge("JSON value too large")
+            if not self._fill():
+                raise RequestBodyError("invalid JSON body")
+
+    def _streamed_string(self):
+        """Decode a base64 string value chunk by chunk"""
+        self._pos += 1  # opening quote
+        upload = _Base64Sink()
+        while True:
+            if self._pos >= len(self._buf) and not self._fill():
+                raise RequestBodyError("unterminated string in JSON body")
+            match = self._special.search(self._buf, self._pos)
+            if match is None:
+                upload.feed(self._buf[self._pos:])
+                self._pos = len(self._buf)
+                continue
+            index = match.start()
+            upload.feed(self._buf[self._pos:index])
+            if self._buf[index] == '"':
+                self._pos = index + 1
+                return upload.finish()
+            # Only "\/" can appear in base64 or a data: URL
+            if index + 1 >= len(self._buf):
+                self._pos = index
+                if not self._fill():
+                    raise RequestBodyError("unterminated string in JSON body")
+                continue
+            if self._buf[index + 1] != '/':
+                raise RequestBodyError("unsupported escape in base64 field")
+            upload.feed('/')
+            self._pos = index + 2
+
+    def _streamed_array(self):
+        """Decode an array of base64 strings, one element at a time"""
+        self._pos += 1  # opening bracket
+        items = []
+        if self._peek() == ']':
+            self._pos += 1
+            return items
+        while True:
+            if self._peek() != '"':
+                raise RequestBodyError("expected a base64 string in JSON array")
+            items.append(self._streamed_string())
+            separator = self._peek()
+            self._pos += 1
+            if separator == ']':
+                return items
+            if separator != ',':
+                raise RequestBodyError("expected ',' or ']' in JSON array")
+
+    def parse(self):
+        """Parse the object, then consume whatever is left of the body"""
+        result = {}
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+        else:
+            while True:
+                if self._peek() != '"':
+                    raise RequestBodyError("expected a string key in JSON body")
+                key = self._value()
+                self._expect(':')
+                if key in self.stream_fields and self._peek() == '"':
+                    result[key] = self._streamed_string()
+                elif key in self.stream_fields and self._peek() == '[':
+                    result[key] = self._streamed_array()
+                else:
+                    result[key] = self._value()
+                separator = self._peek()
+                self._pos += 1
+                if separator == '}':
+                    break
+                if separator != ',':
+                    raise RequestBodyError("expected ',' or '}' in JSON body")
+        if self._peek() != '':
+            raise RequestBodyError("unexpected data after JSON body")
+        return result
+
+
+def parse_json_body(body, stream_fields=()):
+    """Parse a JSON object request body incrementally, consuming all of it"""
+    try:
+        data = StreamingJSONObjectParser(body.iter_chunks(), stream_fields).parse()
+    except RequestBodyTooLarge:
+        raise
+    except RequestBodyError:
+        # Leave the connection usable for the next request
+        body.drain()
+        raise
+    body.drain()
+    return data
+
+
+def json_dumps(data):
+    """Encode a response body as UTF-8 JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+
+class ChunkedWriter:
+    """Writes HTTP/1.1 chunked transfer encoding to a response file"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        if data:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def close(self):
+        """Send the terminating zero-length chunk"""
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class CountingWriter:
+    """Wraps a connection's response file, counting the bytes written for the access log"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return self.raw.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+# Card image matching settings
+CARD_HASH_INDEX = None          # hash index file built with --card-hashes-build; None disables matching
+CARD_MATCH_MAX_DISTANCE = 30    # max combined dHash+pHash Hamming distance (of 128 bits) for a match
+CARD_MATCH_LIMIT = 3            # matches returned per image
+CARD_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp')
+MAX_BATCH_IMAGES = 64           # images accepted by one /api/analyze-images request
+IMAGE_DECODE_THREADS = 4        # threads decoding a batch (Pillow releases the GIL while decoding)
+IMAGE_WORKERS = 2               # processes decoding and hashing images; 0 runs image work in-process
+IMAGE_QUEUE_SIZE = 64           # image tasks allowed queued or running before new ones get a 503 (at least MAX_BATCH_IMAGES)
+IMAGE_TASK_TIMEOUT = 10.0       # seconds an image task may take before the request gives up
+IMAGE_WORKER_MAX_TASKS = 200    # tasks a worker process runs before it is replaced
+
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+# cos((2x + 1) * u * pi / 2N) for the low frequencies kept by pHash
+_DCT_COS = [[math.cos((2 * x + 1) * u * math.pi / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+            for u in range(_DCT_KEEP)]
+
+
+class ImageMatchingUnavailable(RuntimeError):
+    """Raised when Pillow isn't installed, so images can't be decoded"""
+
+
+def load_grayscale(image_bytes, size=64):
+    """Decode an image to an 8-bit grayscale Pillow image, cheaply downscaled"""
+    if Image is None:
+        raise ImageMatchingUnavailable("install Pillow (pip install pillow) to enable image matching")
+    image = Image.open(io.BytesIO(image_bytes))
+    # Lets JPEG decode at a reduced scale instead of full resolution
+    image.draft('L', (size, size))
+    return image.convert('L')
+
+
+def dhash_from_gray(gray):
+    """64-bit difference hash: is each pixel brighter than its right neighbour"""
+    pixels = gray.resize((9, 8), Image.BILINEAR).tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def phash_from_gray(gray):
+    """64-bit perceptual hash: 8x8 low-frequency DCT coefficients above their median"""
+    pixels = gray.resize((_DCT_SIZE, _DCT_SIZE), Image.BILINEAR).tobytes()
+    rows = [pixels[index:index + _DCT_SIZE] for index in range(0, _DCT_SIZE * _DCT_SIZE, _DCT_SIZE)]
+    # Separable DCT-II, computing only the coefficients that are kept
+    row_coeffs = [[sum(c * p for c, p in zip(cos_u, row)) for cos_u in _DCT_COS] for row in rows]
+    coeffs = []
+    for v in range(_DCT_KEEP):
+        cos_v = _DCT_COS[v]
+        for u in range(_DCT_KEEP):
+            coeffs.append(sum(cos_v[y] * row_coeffs[y][u] for y in range(_DCT_SIZE)))
+    # The DC term only reflects overall brightness, so leave it out of the median
+    median = statistics.median(coeffs[1:])
+    value = 0
+    for coeff in coeffs:
+        value = (value << 1) | (coeff > median)
+    return value
+
+
+def image_fingerprint(image_bytes):
+    """(dHash, pHash) of an encoded image"""
+    gray = load_grayscale(image_bytes)
+    return dhash_from_gray(gray), phash_from_gray(gray)
+
+
+def normalize_image(image_bytes):
+    """Raw 9x8 and 32x32 grayscale pixels of an encoded image, ready for fingerprint_batch()"""
+    gray = load_grayscale(image_bytes)
+    return (gray.resize((9, 8), Image.BILINEAR).tobytes(),
+            gray.resize((_DCT_SIZE, _DCT_SIZE), Image.BILINEAR).tobytes())
+
+
+def _pack_hashes(bits):
+    """Pack rows of 64 booleans (most significant first) into uint64 hashes"""
+    return numpy.packbits(bits, axis=1).view('>u8').ravel().astype(numpy.uint64)
+
+
+def fingerprint_batch(normalized):
+    """dHash and pHash uint64 arrays for a list of normalize_image() results.
+
+    Computes the same hashes as image_fingerprint(), but for the whole
+    batch at once: the DCT is two matrix products over a stack of images.
+    """
+    count = len(normalized)
+    small = numpy.frombuffer(b''.join(item[0] for item in normalized), dtype=numpy.uint8)
+    small = small.reshape(count, 8, 9)
+    dhash_bits = (small[:, :, :-1] > small[:, :, 1:]).reshape(count, 64)
+
+    large = numpy.frombuffer(b''.join(item[1] for item in normalized), dtype=numpy.uint8)
+    large = large.reshape(count, _DCT_SIZE, _DCT_SIZE).astype(numpy.float64)
+    cos = numpy.array(_DCT_COS)
+    coeffs = (cos @ large @ cos.T).reshape(count, 64)
+    median = numpy.median(coeffs[:, 1:], axis=1)
+    phash_bits = coeffs > median[:, None]
+    return _pack_hashes(dhash_bits), _pack_hashes(phash_bits)
+
+
+def popcount(values):
+    """Number of set bits in each element of a uint64 array"""
+    if hasattr(numpy, 'bitwise_count'):  # NumPy 2.0+
+        return numpy.bitwise_count(values).astype(numpy.int32)
+    octets = values.view(numpy.uint8).reshape(values.shape + (8,))
+    return numpy.unpackbits(octets, axis=-1).sum(axis=-1, dtype=numpy.int32)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+_image_executor = None
+_image_executor_lock = threading.Lock()
+
+
+def get_image_executor():
+    """Lazily create the thread pool that decodes batches of images"""
+    global _image_executor
+    with _image_executor_lock:
+        if _image_executor is None:
+            _image_executor = ThreadPoolExecutor(max_workers=IMAGE_DECODE_THREADS,
+                                                 thread_name_prefix="image-decode")
+        return _image_executor
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer ids for nearest-neighbour search in a metric space"""
+
+    def __init__(self, distance):
+        self.distance = distance
+        self.root = None  # [item, {distance: child node}]
+
+    def add(self, item):
+        if self.root is None:
+            self.root = [item, {}]
+            return
+        node = self.root
+        while True:
+            d = self.distance(item, node[0])
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [item, {}]
+                return
+            node = child
+
+    def nearest(self, query, limit, max_distance):
+        """Up to limit (distance, item) pairs within max_distance, closest first"""
+        if self.root is None:
+            return []
+        best = []  # max-heap of (-distance, item)
+        radius = max_distance
+        stack = [self.root]
+        while stack:
+            item, children = stack.pop()
+            d = self.distance(query, item)
+            if d <= radius:
+                heapq.heappush(best, (-d, item))
+                if len(best) > limit:
+                    heapq.heappop(best)
+                if len(best) == limit:
+                    radius = -best[0][0]
+            for child_distance, child in children.items():
+                if d - radius <= child_distance <= d + radius:
+                    stack.append(child)
+        return sorted((-negative, item) for negative, item in best)
+
+
+class CardImageIndex:
+    """Perceptual hashes of reference card images, stored as compact arrays.
+
+    The file holds a header, uint64 dHash and pHash arrays and the JSON list
+    of card names. Lookups use a BK-tree over the combined Hamming distance.
+    """
+
+    MAGIC = b'PCHASH01'
+    HEADER = struct.Struct('<8sI')
+
+    def __init__(self, names, dhashes, phashes):
+        self.names = names
+        self.dhashes = dhashes
+        self.phashes = phashes
+        self.tree = BKTree(self._distance)
+        for index in range(len(names)):
+            self.tree.add(index)
+        self.lookups = 0
+        self.matches = 0
+        self.batches = 0
+        self.latency = LatencyHistogram((0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+        self._arrays = None
+
+    def _distance(self, a, b):
+        if isinstance(a, tuple):
+            return hamming(a[0], self.dhashes[b]) + hamming(a[1], self.phashes[b])
+        return hamming(self.dhashes[a], self.dhashes[b]) + hamming(self.phashes[a], self.phashes[b])
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def build(cls, image_dir):
+        """Hash every image in image_dir; file names (minus extension) are the card names"""
+        names, dhashes, phashes = [], array('Q'), array('Q')
+        for path in sorted(glob.glob(os.path.join(image_dir, '*'))):
+            if not path.lower().endswith(CARD_IMAGE_EXTENSIONS):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    dhash, phash = image_fingerprint(f.read())
+            except (OSError, ValueError) as e:
+                print(f"Skipping {path}: {e}")
+                continue
+            names.append(os.path.splitext(os.path.basename(path))[0])
+            dhashes.append(dhash)
+            phashes.append(phash)
+        return cls(names, dhashes, phashes)
+
+    def save(self, path):
+        dhashes, phashes = array('Q', self.dhashes), array('Q', self.phashes)
+        if sys.byteorder == 'big':
+            dhashes.byteswap()
+            phashes.byteswap()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, len(self.names)))
+            f.write(dhashes.tobytes())
+            f.write(phashes.tobytes())
+            f.write(json.dumps(self.names).encode('utf-8'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, count = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a card hash index")
+        offset = cls.HEADER.size
+        dhashes, phashes = array('Q'), array('Q')
+        dhashes.frombytes(data[offset:offset + 8 * count])
+        phashes.frombytes(data[offset + 8 * count:offset + 16 * count])
+        if sys.byteorder == 'big':
+            dhashes.byteswap()
+            phashes.byteswap()
+        names = json.loads(data[offset + 16 * count:].decode('utf-8'))
+        return cls(names, dhashes, phashes)
+
+    def match_fingerprint(self, fingerprint, limit=CARD_MATCH_LIMIT, max_distance=CARD_MATCH_MAX_DISTANCE):
+        """Closest reference cards to a (dHash, pHash) fingerprint"""
+        started = time.perf_counter()
+        found = self.tree.nearest(tuple(fingerprint), limit, max_distance)
+        self.lookups += 1
+        if found:
+            self.matches += 1
+        self.latency.observe(time.perf_counter() - started)
+        return [{
+            'title': self.names[index],
+            'distance': distance,
+            'confidence': match_confidence(distance),
+        } for distance, index in found]
+
+    def match(self, image_bytes, limit=CARD_MATCH_LIMIT):
+        if IMAGE_POOL is not None:
+            fingerprint = IMAGE_POOL.run(image_fingerprint, image_bytes)
+        else:
+            fingerprint = image_fingerprint(image_bytes)
+        return self.match_fingerprint(fingerprint, limit)
+
+    def _reference_arrays(self):
+        if self._arrays is None:
+            self._arrays = (numpy.frombuffer(self.dhashes, dtype=numpy.uint64),
+                            numpy.frombuffer(self.phashes, dtype=numpy.uint64))
+        return self._arrays
+
+    def match_hashes(self, dhashes, phashes, limit=CARD_MATCH_LIMIT, max_distance=CARD_MATCH_MAX_DISTANCE):
+        """Closest reference cards for arrays of fingerprints, compared all at once"""
+        started = time.perf_counter()
+        ref_dhashes, ref_phashes = self._reference_arrays()
+        distances = (popcount(dhashes[:, None] ^ ref_dhashes[None, :]) +
+                     popcount(phashes[:, None] ^ ref_phashes[None, :]))
+        if distances.shape[1] > limit:
+            nearest = numpy.argpartition(distances, limit - 1, axis=1)[:, :limit]
+        else:
+            nearest = numpy.broadcast_to(numpy.arange(distances.shape[1]), distances.shape)
+        results = []
+        for row, candidates in enumerate(nearest.tolist()):
+            found = sorted((int(distances[row, index]), index) for index in candidates)
+            matches = [{
+                'title': self.names[index],
+                'distance': distance,
+                'confidence': match_confidence(distance),
+            } for distance, index in found if distance <= max_distance]
+            self.lookups += 1
+            if matches:
+                self.matches += 1
+            results.append(matches)
+        if results:
+            self.latency.observe((time.perf_counter() - started) / len(results))
+        return results
+
+    def match_many(self, images, limit=CARD_MATCH_LIMIT):
+        """Match a list of encoded images, in input order.
+
+        Each result is a list of matches, or the exception raised while
+        decoding that image. Images are decoded on a thread pool; with
+        NumPy the fingerprints and comparisons then run as one batch.
+        Images go to IMAGE_POOL when there is one, else to a thread pool.
+        """
+        if Image is None:
+            raise ImageMatchingUnavailable("install Pillow (pip install pillow) to enable image matching")
+        self.batches += 1
+        prepare = normalize_image if numpy is not None else image_fingerprint
+        if IMAGE_POOL is not None:
+            results = IMAGE_POOL.map(prepare, images)
+        else:
+            futures = [get_image_executor().submit(prepare, bytes(image)) for image in images]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except (OSError, ValueError, Image.DecompressionBombError) as e:
+                    results.append(e)
+        decoded = [index for index, result in enumerate(results) if not isinstance(result, Exception)]
+        if numpy is None:
+            for index in decoded:
+                results[index] = self.match_fingerprint(results[index], limit)
+        elif decoded:
+            dhashes, phashes = fingerprint_batch([results[index] for index in decoded])
+            for index, matches in zip(decoded, self.match_hashes(dhashes, phashes, limit)):
+                results[index] = matches
+        return results
+
+    def stats(self):
+        return {
+            'cards': len(self.names),
+            'lookups': self.lookups,
+            'matches': self.matches,
+            'batches': self.batches,
+            'vectorized': numpy is not None,
+            'latency': self.latency.snapshot(),
+        }
+
+
+def match_confidence(distance):
+    """Map a combined Hamming distance to 0..1; unrelated images sit around 64"""
+    return round(max(0.0, 1.0 - distance / 64.0), 3)
+
+
+CARD_IMAGES = None
+
+
+class ImagePoolBusy(RuntimeError):
+    """The image worker queue is full"""
+
+
+class ImageTaskTimeout(RuntimeError):
+    """An image task did not finish within IMAGE_TASK_TIMEOUT"""
+
+
+def _init_image_worker():
+    # Ctrl+C reaches the whole process group; let the server shut the workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_image_task(func, shm_name, size):
+    """Worker side of ImageWorkerPool: read the image from shared memory and run func on it"""
+    # Workers share the parent's resource tracker, and the parent unlinks the block
+    block = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = bytes(block.buf[:size])
+    finally:
+        block.close()
+    started = time.perf_counter()
+    return func(data), time.perf_counter() - started
+
+
+class ImageWorkerPool:
+    """Process pool for CPU-heavy image work, so decoding doesn't hold the GIL.
+
+    At most queue_size tasks are queued or running; beyond that submit()
+    raises ImagePoolBusy rather than letting requests pile up. Image bytes
+    travel to workers in shared memory blocks instead of being pickled
+    through the pool's pipe. Workers are replaced after max_tasks tasks
+    to contain memory growth in Pillow, and a task that overruns its
+    timeout retires the whole pool, since its worker can't be
+    interrupted.
+    """
+
+    def __init__(self, workers=IMAGE_WORKERS, queue_size=IMAGE_QUEUE_SIZE,
+                 timeout=IMAGE_TASK_TIMEOUT, max_tasks=IMAGE_WORKER_MAX_TASKS):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self._lock = threading.Lock()
+        self._pool = self._new_pool()
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.latency = LatencyHistogram()
+        self.queue_wait = LatencyHistogram()
+
+    def _new_pool(self):
+        # Start the tracker first so workers share it rather than each starting their own
+        resource_tracker.ensure_running()
+        return multiprocessing.Pool(self.workers, initializer=_init_image_worker,
+                                    maxtasksperchild=self.max_tasks)
+
+    def _reserve(self, count):
+        with self._lock:
+            if self.pending + count > self.queue_size:
+                self.rejected += count
+                raise ImagePoolBusy(f"image queue is full ({self.pending} tasks pending)")
+            self.pending += count
+            self.max_pending = max(self.max_pending, self.pending)
+            return self._pool
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    def _retire(self, pool):
+        """Swap in a fresh pool and kill the old one once its other tasks have had time to finish"""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = self._new_pool()
+            self.restarts += 1
+        pool.close()
+        timer = threading.Timer(self.timeout, pool.terminate)
+        timer.daemon = True
+        timer.start()
+
+    def map(self, func, images):
+        """Run func on each image in the workers, in input order.
+
+        Each result is func's return value, or the exception raised for
+        that image (ImageTaskTimeout when it ran too long).
+        """
+        pool = self._reserve(len(images))
+        blocks, tasks, results = [], [], []
+        try:
+            for image in images:
+                block = shared_memory.SharedMemory(create=True, size=max(1, len(image)))
+                blocks.append(block)
+                block.buf[:len(image)] = image
+                tasks.append((time.perf_counter(),
+                              pool.apply_async(_run_image_task, (func, block.name, len(image)))))
+            deadline = time.monotonic() + self.timeout
+            for submitted, task in tasks:
+                try:
+                    result, elapsed = task.get(max(0.0, deadline - time.monotonic()))
+                except multiprocessing.TimeoutError:
+                    with self._lock:
+                        self.timeouts += 1
+                    self._retire(pool)
+                    results.append(ImageTaskTimeout(f"image task took longer than {self.timeout}s"))
+                except Exception as e:
+                    with self._lock:
+                        self.failed += 1
+                    results.append(e)
+                else:
+                    with self._lock:
+                        self.completed += 1
+                    total = time.perf_counter() - submitted
+                    self.latency.observe(total)
+                    self.queue_wait.observe(max(0.0, total - elapsed))
+                    results.append(result)
+                self._release()
+            return results
+        finally:
+            # Reservations for tasks that never produced a result
+            for _ in range(len(images) - len(results)):
+                self._release()
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def run(self, func, image):
+        """Run func on one image in a worker, raising whatever it raised"""
+        result = self.map(func, [image])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def stats(self):
+        with self._lock:
+            counts = {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'queue_depth': self.pending,
+                'max_queue_depth': self.max_pending,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'pool_restarts': self.restarts,
+            }
+        return dict(counts, latency=self.latency.snapshot(), queue_wait=self.queue_wait.snapshot())
+
+
+IMAGE_POOL = None
+
+
+def state_metric_samples(server):
+    """(name, labels, value) samples read from the components' own stats at scrape time"""
+    cache = SEARCH_CACHE.stats()
+    for result, field in (('hit', 'hits'), ('stale', 'stale_hits'), ('expired', 'expired_hits'), ('miss', 'misses')):
+        yield 'pokemon_search_cache_lookups_total', (result,), cache[field]
+    yield 'pokemon_search_cache_evictions_total', (), cache['evictions']
+    yield 'pokemon_search_cache_refresh_errors_total', (), cache['refresh_errors']
+    yield 'pokemon_search_cache_entries', (), cache['entries']
+    yield 'pokemon_search_coalesced_total', ('threaded',), SEARCH_FLIGHTS.stats()['coalesced']
+    yield 'pokemon_search_coalesced_total', ('asyncio',), ASYNC_SEARCH_FLIGHTS.stats()['coalesced']
+    prefetch = SEARCH_PREFETCHER.stats()
+    for outcome in ('fetched', 'cached', 'dropped', 'throttled', 'errors'):
+        yield 'pokemon_search_prefetch_total', (outcome,), prefetch[outcome]
+
+    yield 'pokemon_upstream_shed_total', ('rate limit',), UPSTREAM_LIMITER.stats()['shed']
+    breaker = UPSTREAM_BREAKER.stats()
+    yield 'pokemon_upstream_shed_total', ('circuit open',), breaker['shed']
+    for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN):
+        yield 'pokemon_upstream_breaker_state', (state,), int(breaker['state'] == state)
+    for client, stats in (('sync', UPSTREAM.stats()), ('async', ASYNC_UPSTREAM.stats())):
+        yield 'pokemon_upstream_connections', (client, 'in_use'), stats['in_use']
+        yield 'pokemon_upstream_connections', (client, 'idle'), stats['idle']
+
+    if hasattr(server, 'pool_stats'):
+        pool = server.pool_stats()
+        yield 'pokemon_worker_threads', ('active',), pool['active']
+        yield 'pokemon_worker_threads', ('queued',), pool['queued']
+        yield 'pokemon_worker_threads', ('total',), pool['workers']
+    if hasattr(server, 'engine_stats'):
+        yield 'pokemon_open_connections', (), server.engine_stats()['open_connections']
+    if IMAGE_POOL is not None:
+        yield 'pokemon_image_queue_depth', (), IMAGE_POOL.stats()['queue_depth']
+    if ACCESS_LOG is not None:
+        access_log = ACCESS_LOG.stats()
+        for result in ('written', 'dropped', 'sampled_out'):
+            yield 'pokemon_access_log_lines_total', (result,), access_log[result]
+
+
+Route = namedtuple('Route', 'method path prefix handler blocking')
+
+# Route table shared by both server engines. 'prefix' routes match any path
+# starting with 'path'; 'blocking' routes may wait on upstream I/O or CPU work,
+# so the asyncio engine runs them off the event loop unless the handler has
+# an '<name>_async' coroutine variant.
+ROUTES = [
+    Route('GET', '/', False, 'serve_main_page', False),
+    Route('GET', '/api/search', True, 'handle_search_api', True),
+    Route('POST', '/api/search/bulk', False, 'handle_bulk_search_api', True),
+    Route('GET', '/api/sets', True, 'handle_sets_api', False),
+    Route('GET', '/api/cards', True, 'handle_cards_api', True),
+    Route('GET', '/api/web-search', True, 'handle_web_search_api', False),
+    Route('GET', '/api/suggest', True, 'handle_suggest_api', False),
+    Route('GET', '/api/stats', True, 'handle_stats_api', False),
+    Route('GET', '/metrics', False, 'handle_metrics', False),
+    Route('GET', '/healthz', False, 'handle_healthz', False),
+    Route('GET', '/readyz', False, 'handle_readyz', False),
+    Route('GET', '/static/', True, 'serve_static_file', False),
+    Route('POST', '/api/analyze-image', False, 'handle_image_analysis', True),
+    Route('POST', '/api/analyze-images', False, 'handle_batch_image_analysis', True),
+    Route('POST', '/api/google-image-search', False, 'handle_google_image_search', True),
+]
+
+
+def find_route(method, path):
+    """Return the first Route matching method and path, or None"""
+    for route in ROUTES:
+        if route.method != method:
+            continue
+        if path == route.path or (route.prefix and path.startswith(route.path)):
+            return route
+    return None
+
+
+class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
+    # Persistent connections: every response is framed with Content-Length
+    # or chunked encoding, so the connection can carry the next request
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; with Nagle on, the body of a response
+    # on a reused connection waits for the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    request_body = None
+    requests_handled = 0
+    in_route = False
+    response_status = None
+    log_fields = None
+    bytes_before = 0
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+    
+    def handle(self):
+        """Serve requests until the client closes, goes idle or reaches KEEPALIVE_MAX_REQUESTS"""
+        self.close_connection = True
+        while self.wait_for_request():
+            self.handle_one_request()
+            self.requests_handled += 1
+            if self.close_connection:
+                break
+    
+    def wait_for_request(self):
+        """Wait up to KEEPALIVE_IDLE_TIMEOUT for the next request to start arriving.
+
+        An idle keep-alive connection gives its worker up as soon as other
+        connections are queued for one, rather than holding it until the
+        timeout while they wait.
+        """
+        waiting = getattr(self.server, 'waiting_connections', None)
+        deadline = time.monotonic() + KEEPALIVE_IDLE_TIMEOUT
+        try:
+            self.connection.setblocking(False)
+            try:
+                # Pipelined requests may already be buffered
+                if self.rfile.peek(1):
+                    return True
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    if self.requests_handled and waiting is not None and waiting() > 0:
+                        return False
+                    readable, _, _ = select.select([self.connection], [], [],
+                                                   min(remaining, KEEPALIVE_POLL_INTERVAL))
+                    if readable:
+                        # Empty at end of stream, when the client has closed
+                        return bool(self.rfile.peek(1))
+            finally:
+                self.connection.settimeout(self.timeout)
+        except (OSError, ValueError):
+            return False
+    
+    def do_GET(self):
+        self.dispatch()
+    
+    def do_POST(self):
+        self.dispatch()
+    
+    def dispatch(self):
+        """Call the handler method for this request from the route table"""
+        self.request_body = None
+        self.response_status = None
+        self.log_fields = {}
+        self.bytes_before = self.wfile.written
+        self.in_route = True
+        route = find_route(self.command, self.path)
+        label = route_label(route)
+        METRICS.add('pokemon_http_requests_in_flight', (label,))
+        started = time.perf_counter()
+        try:
+            if route is None:
+                self.send_error(404, "File not found" if self.command == 'GET' else "Endpoint not found")
+                return
+            getattr(self, route.handler)()
+        finally:
+            self.in_route = False
+            self.finish_request(label, started)
+    
+    def body_pending(self):
+        """Whether part of the request body is still unread on the connection"""
+        has_body = ('chunked' in self.headers.get('Transfer-Encoding', '').lower() or
+                    int(self.headers.get('Content-Length') or 0) > 0)
+        return has_body and not (self.request_body is not None and self.request_body.finished)
+    
+    def keep_alive_exhausted(self):
+        """Whether the connection should close after the response being sent"""
+        if self.requests_handled + 1 >= KEEPALIVE_MAX_REQUESTS or self.body_pending():
+            return True
+        waiting = getattr(self.server, 'waiting_connections', None)
+        if waiting is None:
+            # A single-threaded server can't serve anyone else while a connection idles
+            return True
+        # Free the worker thread for connections queued behind this one
+        return waiting() > 0
+    
+    def end_headers(self):
+        """Tell HTTP/1.1 clients when this response is the last on the connection"""
+        if self.request_version == 'HTTP/1.1' and (self.close_connection or self.keep_alive_exhausted()):
+            if not any(line.lower().startswith(b'connection:') for line in getattr(self, '_headers_buffer', [])):
+                self.send_header('Connection', 'close')
+            self.close_connection = True
+        super().end_headers()
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def bytes_sent(self):
+        """Response bytes (headers included) written for the current request"""
+        return self.wfile.written - self.bytes_before
+    
+    def finish_request(self, label, started):
+        """Record metrics and queue the access log line for the request just dispatched"""
+        elapsed = time.perf_counter() - started
+        status = self.response_status or 500
+        record_request(label, self.command, status, elapsed)
+        if ACCESS_LOG is None:
+            return
+        rate = ACCESS_LOG.sample_rate(label, status)
+        if rate is None:
+            return
+        record = {
+            'ts': time.time(),
+            'client': self.client_address[0],
+            'method': self.command,
+            'path': self.path[:ACCESS_LOG_PATH_LIMIT],
+            'route': label,
+            'status': status,
+            'duration_ms': round(elapsed * 1000, 2),
+            'bytes': self.bytes_sent(),
+        }
+        record.update(self.log_fields)
+        if rate < 1.0:
+            record['sample_rate'] = rate
+        ACCESS_LOG.log(record)
+    
+    def log_request(self, code='-', size='-'):
+        if ACCESS_LOG is None:
+            super().log_request(code, size)
+        elif not self.in_route:
+            # Rejected before routing (malformed or oversized); routed requests are logged by finish_request()
+            ACCESS_LOG.log({'ts': time.time(), 'client': self.client_address[0],
+                            'request': getattr(self, 'requestline', '')[:ACCESS_LOG_PATH_LIMIT],
+                            'status': int(code) if isinstance(code, int) else code})
+    
+    def log_message(self, format, *args):
+        """http.server's error messages (and log_error() calls) go to the access log as well"""
+        if ACCESS_LOG is None:
+            super().log_message(format, *args)
+            return
+        record = {'ts': time.time(), 'level': 'error', 'client': self.client_address[0], 'message': format % args}
+        if self.in_route:
+            record['route'] = route_label(find_route(self.command, self.path))
+        ACCESS_LOG.log(record)
+    
+    def send_error(self, code, message=None, explain=None):
+        """http.server's error page, sized with Content-Length so keep-alive survives a 404"""
+        if not self.in_route:
+            # Malformed or oversized requests: the connection state is unknown, so close it
+            super().send_error(code, message, explain)
+            return
+        short_message, long_message = self.responses.get(code, ('???', '???'))
+        message = short_message if message is None else message
+        explain = long_message if explain is None else explain
+        self.log_error("code %d, message %s", code, message)
+        body = (self.error_message_format % {
+            'code': code,
+            'message': html.escape(message, quote=False),
+            'explain': html.escape(explain, quote=False),
+        }).encode('UTF-8', 'replace')
+        self.send_response(code, message)
+        self.send_header('Content-Type', self.error_content_type)
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(html_content.encode())
+        self.wfile.write(body)
+    
+    def serve_main_page(self):
+        """Serve the main HTML page"""
+        self.send_precomputed(get_static_response('main_page'))
+    
+    def search_query(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        return params.get('q', [''])[0]
+    
+    def search_cursor(self):
+        """The (source, offset) page asked for, or None for the first page; raises ValueError"""
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        cursor = params.get('cursor', [''])[0]
+        return decode_search_cursor(cursor) if cursor else None
+    
+    def send_local_results(self, query):
+        """Answer from the local card index when it has matches"""
+        if LOCAL_INDEX is None:
+            return False
+        results = LOCAL_INDEX.search(query)
+        if not results:
+            return False
+        SUGGESTIONS.learn(result['title'] for result in results)
+        self.log_fields['cache'] = 'local-index'
+        self.send_json_response({'query': query, 'results': results, 'totalFound': len(results),
+                                 'next': None}, headers={'X-Source': 'local-index'})
+        return True
+    
+    def send_upstream_unavailable(self, error):
+        """Fail fast with a 503 while Bulbapedia calls are being shed"""
+        self.send_json_response({'error': 'Bulbapedia is temporarily unavailable, please retry shortly',
+                                 'reason': error.reason}, 503,
+                                headers={'Retry-After': str(math.ceil(error.retry_after))})
+    
+    def send_search_results(self, query, page, cache_status):
+        results = page['results']
+        SUGGESTIONS.learn(result['title'] for result in results)
+        self.log_fields['cache'] = cache_status
+        self.send_json_response({'query': query, 'results': results, 'totalFound': len(results),
+                                 'next': page['next']},
+                                headers={'X-Cache': cache_status.upper(), 'X-Source': 'bulbapedia'})
+        SEARCH_PREFETCHER.prefetch(query, page['next'])
     
     def handle_search_api(self):
         """Handle search API requests"""
         try:
-            # Parse query parameter
-            parsed_url = urllib.parse.urlparse(self.path)
-            params = urllib.parse.parse_qs(parsed_url.query)
-            query = params.get('q', [''])[0]
+            query = self.search_query()
             
             if not query:
                 self.send_json_response({'error': 'Search query is required'}, 400)
                 return
+            try:
+                cursor = self.search_cursor()
+            except ValueError as e:
+                self.send_json_response({'error': str(e)}, 400)
+                return
             
-            # Enhanced search with TCG-specific filtering
-            tcg_query = f"{query} TCG"
-            search_url = f"https://bulbapedia.bulbagarden.net/w/api.php?action=query&list=search&srsearch={urllib.parse.quote(tcg_query)}&format=json&origin=*&srlimit=20"
-            
-            # Make request to Bulbapedia
-            with urllib.request.urlopen(search_url) as response:
-                data = json.loads(response.read().decode())
-            
-            results = []
-            if data.get('query', {}).get('search'):
-                for item in data['query']['search'][:15]:
-                    # Filter for likely TCG cards
-                    is_tcg = any(keyword in item['title'] for keyword in ['TCG', '(Base Set)', '(Jungle)', '(Fossil)', '(Team Rocket)']) or \
-                             any(keyword in item['snippet'] for keyword in ['card', 'TCG'])
-                    
-                    results.append({
-                        'title': item['title'],
-                        'snippet': item['snippet'],
-                        'url': f"https://bulbapedia.bulbagarden.net/wiki/{urllib.parse.quote(item['title'].replace(' ', '_'))}",
-                        'size': item['size'],
-                        'isTCG': is_tcg
-                    })
-            
-            # If no TCG results, try general search
-            if not results:
-                fallback_url = f"https://bulbapedia.bulbagarden.net/w/api.php?action=query&list=search&srsearch={urllib.parse.quote(query)}&format=json&origin=*&srlimit=15"
-                
-                with urllib.request.urlopen(fallback_url) as response:
-                    fallback_data = json.loads(response.read().decode())
-                
-                if fallback_data.get('query', {}).get('search'):
-                    for item in fallback_data['query']['search'][:10]:
-                        results.append({
-                            'title': item['title'],
-                            'snippet': item['snippet'],
-                            'url': f"https://bulbapedia.bulbagarden.net/wiki/{urllib.parse.quote(item['title'].replace(' ', '_'))}",
-                            'size': item['size'],
-                            'isTCG': False
-                        })
+            if cursor is None and self.send_local_results(query):
+                return
             
-            self.send_json_response({'query': query, 'results': results, 'totalFound': len(results)})
+            started = time.perf_counter()
+            page, cache_status = SEARCH_CACHE.get_or_fetch(
+                search_cache_key(query, cursor), lambda: fetch_search_results(query, cursor),
+                allow_expired=UPSTREAM_BREAKER.is_open())
+            if cache_status == 'miss':
+                self.log_fields['upstream_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            self.send_search_results(query, page, cache_status)
             
+        except UpstreamUnavailable as e:
+            self.send_upstream_unavailable(e)
+        except (UpstreamError, OSError) as e:
+            self.log_error("Search API upstream error: %s", e)
+            self.send_json_response({'error': 'Bulbapedia did not answer the search'}, 502)
         except Exception as e:
-            print(f"Search API error: {e}")
+            self.log_error("Search API error: %s", e)
             self.send_json_response({'error': 'Failed to search Bulbapedia'}, 500)
     
-    def handle_sets_api(self):
-        """Handle TCG sets API requests"""
-        popular_sets = [
-            {'title': 'Base Set', 'description': 'The original Pokemon TCG set (1998)'},
-            {'title': 'Jungle', 'description': 'Second expansion with jungle Pokemon'},
-            {'title': 'Fossil', 'description': 'Third expansion with fossil Pokemon'},
-            {'title': 'Team Rocket', 'description': 'Dark Pokemon and Team Rocket cards'},
-            {'title': 'Gym Heroes', 'description': 'Gym Leader Pokemon cards'},
-            {'title': 'Gym Challenge', 'description': 'More Gym Leader Pokemon'},
-            {'title': 'Neo Genesis', 'description': 'First set with Generation II Pokemon'},
-            {'title': 'Neo Discovery', 'description': 'Second Neo series set'},
-            {'title': 'Neo Destiny', 'description': 'Third Neo series set'},
-            {'title': 'Expedition Base Set', 'description': 'E-Card series begins'},
-            {'title': 'Aquapolis', 'description': 'E-Card series water Pokemon'},
-            {'title': 'Skyridge', 'description': 'Final E-Card series set'},
-            {'title': 'Ruby & Sapphire', 'description': 'Generation III Pokemon debut'},
-            {'title': 'Sandstorm', 'description': 'Desert-themed Pokemon set'},
-            {'title': 'Dragon', 'description': 'Dragon-type Pokemon introduction'},
-            {'title': 'Team Magma vs Team Aqua', 'description': 'Hoenn villains clash'},
-            {'title': 'Hidden Legends', 'description': 'Legendary Pokemon focus'},
-            {'title': 'FireRed & LeafGreen', 'description': 'Kanto remakes tie-in'},
-            {'title': 'Deoxys', 'description': 'Mythical Pokemon Deoxys'},
-            {'title': 'Emerald', 'description': 'Emerald version tie-in'}
-        ]
+    def handle_bulk_search_api(self):
+        """Handle bulk search requests, streaming one NDJSON line per distinct query"""
+        body = self.open_request_body()
+        if body is None:
+            return
+        try:
+            data = parse_json_body(body)
+        except RequestBodyTooLarge:
+            self.send_body_too_large()
+            return
+        except RequestBodyError:
+            self.send_json_response({'error': 'Invalid JSON body'}, 400)
+            return
         
-        sets = []
-        for set_info in popular_sets:
-            sets.append({
-                'title': set_info['title'],
-                'description': set_info['description'],
-                'url': f"https://bulbapedia.bulbagarden.net/wiki/{urllib.parse.quote(set_info['title'] + ' (TCG)')}"
-            })
+        queries = data.get('queries')
+        if not isinstance(queries, list) or not queries or not all(isinstance(query, str) for query in queries):
+            self.send_json_response({'error': 'queries must be a non-empty list of strings'}, 400)
+            return
+        if len(queries) > BULK_SEARCH_MAX_QUERIES:
+            self.send_json_response({'error': f'At most {BULK_SEARCH_MAX_QUERIES} queries per request'}, 400)
+            return
+        
+        def lines():
+            counts = {'queries': len(queries), 'unique': 0, 'errors': 0}
+            results = bulk_search(queries)
+            try:
+                for item in results:
+                    counts['unique'] += 1
+                    if 'error' in item:
+                        counts['errors'] += 1
+                    else:
+                        SUGGESTIONS.learn(result['title'] for result in item['results'])
+                    yield item
+            finally:
+                results.close()
+            yield dict(counts, done=True)
         
-        self.send_json_response({'sets': sets})
+        self.send_json_response(lines())
+    
+    def handle_suggest_api(self):
+        """Handle typeahead suggestion API requests"""
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        prefix = params.get('prefix', [''])[0]
+        try:
+            limit = min(max(int(params.get('limit', [SUGGEST_DEFAULT_LIMIT])[0]), 1), SUGGEST_MAX_LIMIT)
+        except ValueError:
+            self.send_json_response({'error': 'limit must be a number'}, 400)
+            return
+        self.send_json_response({'prefix': prefix, 'suggestions': SUGGESTIONS.suggest(prefix, limit)})
+    
+    def handle_stats_api(self):
+        """Handle server statistics API requests"""
+        stats = {
+            'search_cache': SEARCH_CACHE.stats(),
+            'single_flight': SEARCH_FLIGHTS.stats(),
+            'async_single_flight': ASYNC_SEARCH_FLIGHTS.stats(),
+            'search_prefetch': SEARCH_PREFETCHER.stats(),
+            'upstream': UPSTREAM.stats(),
+            'async_upstream': ASYNC_UPSTREAM.stats(),
+            'upstream_rate_limit': UPSTREAM_LIMITER.stats(),
+            'upstream_breaker': UPSTREAM_BREAKER.stats(),
+            'suggestions': SUGGESTIONS.stats(),
+            'local_index': LOCAL_INDEX.stats() if LOCAL_INDEX is not None else None,
+            'catalog': CATALOG.stats() if CATALOG is not None else None,
+            'card_images': CARD_IMAGES.stats() if CARD_IMAGES is not None else None,
+            'image_workers': IMAGE_POOL.stats() if IMAGE_POOL is not None else None,
+            'access_log': ACCESS_LOG.stats() if ACCESS_LOG is not None else None,
+            'process': {'pid': os.getpid(), 'worker': WORKER_INDEX, 'ready': READY.is_set()},
+            'search_strategy': SEARCH_STRATEGY,
+            'search_latency': {strategy: histogram.snapshot() for strategy, histogram in SEARCH_LATENCY.items()},
+        }
+        if hasattr(self.server, 'pool_stats'):
+            stats['worker_pool'] = self.server.pool_stats()
+        if hasattr(self.server, 'engine_stats'):
+            stats['asyncio_engine'] = self.server.engine_stats()
+        self.send_json_response(stats)
+    
+    def handle_metrics(self):
+        """Serve counters and latency histograms in the Prometheus text format"""
+        body = METRICS.render(state_metric_samples(self.server)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def handle_healthz(self):
+        """Liveness probe: the process is up and answering requests"""
+        self.send_json_response({'status': 'ok', 'uptime': round(time.time() - STARTED_AT, 3)},
+                                headers={'Cache-Control': 'no-cache'})
+    
+    def handle_readyz(self):
+        """Readiness probe: 503 until warm_up() has prebuilt what requests need"""
+        if READY.is_set():
+            self.send_json_response({'status': 'ready'}, headers={'Cache-Control': 'no-cache'})
+        else:
+            self.send_json_response({'status': 'starting'}, 503, headers={'Cache-Control': 'no-cache'})
+    
+    def handle_sets_api(self):
+        """Handle TCG sets API requests"""
+        self.send_precomputed(get_static_response('sets'))
+    
+    def handle_cards_api(self):
+        """Handle card catalog queries: filters, a sort order and keyset pagination"""
+        if CATALOG is None:
+            self.send_json_response({'error': 'No card catalog is configured'}, 503)
+            return
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+
+        def param(name):
+            return params.get(name, [''])[0].strip() or None
+
+        try:
+            limit = min(max(int(param('limit') or CATALOG_PAGE_SIZE), 1), CATALOG_MAX_PAGE_SIZE)
+        except ValueError:
+            self.send_json_response({'error': 'limit must be a number'}, 400)
+            return
+        order = param('order') or 'asc'
+        if order not in ('asc', 'desc'):
+            self.send_json_response({'error': 'order must be asc or desc'}, 400)
+            return
+        try:
+            cards, next_cursor = CATALOG.query(
+                name=param('q'), set_title=param('set'), number=param('number'), card_type=param('type'),
+                rarity=param('rarity'), sort=param('sort') or 'name', descending=order == 'desc',
+                limit=limit, cursor=param('cursor'))
+        except CatalogQueryError as e:
+            self.send_json_response({'error': str(e)}, 400)
+            return
+        self.send_json_response({'cards': cards, 'count': len(cards), 'next': next_cursor})
     
     def handle_web_search_api(self):
         """Handle web search suggestions API"""
@@ -711,32 +4790,10 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
         params = urllib.parse.parse_qs(parsed_url.query)
         query = params.get('q', ['Pokemon cards'])[0]
         
+        quoted_query = urllib.parse.quote(query)
         search_suggestions = [
-            {
-                'site': 'TCGPlayer',
-                'url': f'https://www.tcgplayer.com/search/pokemon?q={urllib.parse.quote(query)}',
-                'description': 'Buy and sell Pokemon cards with price tracking'
-            },
-            {
-                'site': 'Pokemon TCG Database',
-                'url': 'https://pokemontcg.io/',
-                'description': 'Complete Pokemon TCG card database with API'
-            },
-            {
-                'site': 'Serebii TCG',
-                'url': 'https://www.serebii.net/card/',
-                'description': 'Comprehensive Pokemon card information and sets'
-            },
-            {
-                'site': 'Pokemon Official',
-                'url': 'https://www.pokemon.com/us/pokemon-tcg/',
-                'description': 'Official Pokemon Trading Card Game website'
-            },
-            {
-                'site': 'Pokellector',
-                'url': f'https://www.pokellector.com/search?q={urllib.parse.quote(query)}',
-                'description': 'Pokemon card collection tracker and database'
-            }
+            {'site': site, 'url': url.format(query=quoted_query), 'description': description}
+            for site, url, description in WEB_SEARCH_SITES
         ]
 
         self.send_json_response({
@@ -748,16 +4805,19 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
     def handle_google_image_search(self):
         """Handle Google Image Search API"""
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+            body = self.open_request_body()
+            if body is None:
+                return
             
             # Parse request data
             try:
-                import json
-                data = json.loads(post_data.decode('utf-8'))
+                data = parse_json_body(body)
                 image_url = data.get('image_url', '')
                 search_query = data.get('search_query', 'pokemon card tcg')
-            except:
+            except RequestBodyTooLarge:
+                self.send_body_too_large()
+                return
+            except RequestBodyError:
                 image_url = ''
                 search_query = 'pokemon card tcg'
             
@@ -770,54 +4830,42 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
                 'tcg_search': f'https://www.google.com/search?q=pokemon+tcg+{urllib.parse.quote(search_query)}&tbm=isch'
             }
             
-            # Search tips
-            search_tips = [
-                'Use Google Lens for the most accurate visual matching',
-                'Try searching with card name + "TCG" for specific results',
-                'Include set name (Base Set, Jungle, etc.) for precise matches',
-                'Search for card number if visible on the card',
-                'Try "holographic" or "shadowless" for special variants'
-            ]
-            
-            # Pokemon search terms
-            pokemon_search_terms = [
-                'pokemon card base set',
-                'pokemon tcg vintage',
-                'pokemon card holographic',
-                'pokemon trading card game',
-                'pokemon card collection',
-                'pokemon tcg expansion'
-            ]
-            
             response_data = {
                 'search_urls': search_urls,
-                'search_tips': search_tips,
-                'pokemon_search_terms': pokemon_search_terms,
+                'search_tips': SEARCH_TIPS,
+                'pokemon_search_terms': POKEMON_SEARCH_TERMS,
                 'message': 'Google Image Search options for Pokemon card identification'
             }
             
             self.send_json_response(response_data)
             
         except Exception as e:
-            print(f"Google Image Search error: {e}")
+            self.log_error("Google Image Search error: %s", e)
             self.send_json_response({'error': 'Failed to generate Google Image Search URLs'}, 500)
     
     def handle_image_analysis(self):
         """Handle image analysis API with Google Image Search integration"""
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+            body = self.open_request_body()
+            if body is None:
+                return
             
-            # Parse JSON data
+            # Parse JSON data, decoding image_data as it streams in
             try:
-                import json
-                data = json.loads(post_data.decode('utf-8'))
+                data = parse_json_body(body, stream_fields=('image_data',))
                 image_data = data.get('image_data', '')
                 image_url = data.get('image_url', '')
-            except:
+            except RequestBodyTooLarge:
+                self.send_body_too_large()
+                return
+            except RequestBodyError:
                 image_data = ''
                 image_url = ''
             
+            if image_data and not isinstance(image_data, StreamedUpload):
+                self.send_json_response({'error': 'image_data must be a base64 image'}, 400)
+                return
+            
             # Generate Google Image Search URLs
             google_lens_url = 'https://lens.google.com/'
             search_by_image_url = 'https://images.google.com/'
@@ -834,99 +4882,1214 @@ class PokemonCardHandler(http.server.SimpleHTTPRequestHandler):
                 'vintage_cards': 'https://www.google.com/search?q=pokemon+vintage+cards+holographic&tbm=isch'
             }
             
-            # Common card suggestions
-            common_cards = [
-                'Pikachu', 'Charizard', 'Blastoise', 'Venusaur', 'Mewtwo', 'Mew',
-                'Lugia', 'Ho-oh', 'Rayquaza', 'Arceus', 'Base Set', 'Jungle', 'Fossil'
-            ]
+            # Match the upload against the reference card images
+            matches = []
+            detected_text = 'Image uploaded! Use Google Image Search for the best card identification.'
+            if image_data and CARD_IMAGES is not None:
+                try:
+                    matches = CARD_IMAGES.match(image_data.data)
+                except ImagePoolBusy:
+                    self.send_json_response({'error': 'Too many images being analyzed, try again shortly'}, 503,
+                                            headers={'Retry-After': '1'})
+                    return
+                except ImageTaskTimeout:
+                    self.send_json_response({'error': 'Image analysis timed out'}, 504)
+                    return
+                except (ImageMatchingUnavailable, OSError, ValueError) as e:
+                    self.log_error("Image matching error: %s", e)
+                if matches:
+                    detected_text = f"Best match: {matches[0]['title']}"
+                else:
+                    detected_text = 'No matching card found. Try Google Image Search for identification.'
             
-            import random
-            random_suggestions = random.sample(common_cards, 3)
+            if matches:
+                suggestions = [match['title'] for match in matches]
+                confidence = matches[0]['confidence']
+            else:
+                suggestions = random.sample(COMMON_CARDS, 3)
+                confidence = 0.0
             
             response_data = {
-                'detected_text': 'Image uploaded! Use Google Image Search for the best card identification.',
-                'confidence': 0.8,
-                'suggestions': random_suggestions,
+                'detected_text': detected_text,
+                'confidence': confidence,
+                'suggestions': suggestions,
+                'matches': matches,
                 'google_search_urls': {
                     'google_lens': google_lens_url,
                     'search_by_image': search_by_image_url,
                     'manual_upload': 'https://images.google.com/'
                 },
                 'pokemon_searches': pokemon_searches,
-                'search_tips': [
-                    'Use Google Lens for the most accurate visual matching',
-                    'Try searching with card name + "TCG" for specific results',
-                    'Include set name (Base Set, Jungle, etc.) for precise matches',
-                    'Search for card number if visible on the card',
-                    'Try "holographic" or "shadowless" for special variants'
-                ],
+                'search_tips': SEARCH_TIPS,
                 'message': 'Use Google Image Search links for the best Pokemon card identification results.'
             }
             
             self.send_json_response(response_data)
             
         except Exception as e:
-            print(f"Image analysis error: {e}")
+            self.log_error("Image analysis error: %s", e)
             self.send_json_response({'error': 'Failed to analyze image'}, 500)
     
+    def handle_batch_image_analysis(self):
+        """Match a batch of card images, returning one result per image in input order"""
+        try:
+            body = self.open_request_body()
+            if body is None:
+                return
+            try:
+                data = parse_json_body(body, stream_fields=('images',))
+            except RequestBodyTooLarge:
+                self.send_body_too_large()
+                return
+            except RequestBodyError:
+                self.send_json_response({'error': 'Invalid JSON body'}, 400)
+                return
+            
+            images = data.get('images')
+            if not isinstance(images, list) or not images:
+                self.send_json_response({'error': 'images must be a non-empty list of base64 images'}, 400)
+                return
+            if len(images) > MAX_BATCH_IMAGES:
+                self.send_json_response({'error': f'At most {MAX_BATCH_IMAGES} images per request'}, 400)
+                return
+            if CARD_IMAGES is None or Image is None:
+                self.send_json_response({'error': 'Card image matching is not configured'}, 503)
+                return
+            
+            try:
+                batch = CARD_IMAGES.match_many([image.data for image in images])
+            except ImagePoolBusy:
+                self.send_json_response({'error': 'Too many images being analyzed, try again shortly'}, 503,
+                                        headers={'Retry-After': '1'})
+                return
+            
+            results = []
+            for index, matches in enumerate(batch):
+                if isinstance(matches, ImageTaskTimeout):
+                    results.append({'index': index, 'error': 'Image analysis timed out'})
+                    continue
+                if isinstance(matches, Exception):
+                    results.append({'index': index, 'error': 'Could not decode image'})
+                    continue
+                results.append({
+                    'index': index,
+                    'detected_text': f"Best match: {matches[0]['title']}" if matches else 'No matching card found',
+                    'confidence': matches[0]['confidence'] if matches else 0.0,
+                    'suggestions': [match['title'] for match in matches],
+                    'matches': matches,
+                })
+            
+            self.send_json_response({'results': results, 'count': len(results)})
+            
+        except Exception as e:
+            self.log_error("Batch image analysis error: %s", e)
+            self.send_json_response({'error': 'Failed to analyze images'}, 500)
+    
     def serve_static_file(self):
-        """Serve static files"""
-        # For simplicity, we'll return a 404 for static files since everything is embedded
-        self.send_error(404, "Static files not implemented in Python version")
+        """Serve a file from STATIC_DIR, compressed and with an ETag like the main page"""
+        path = urllib.parse.urlparse(self.path).path
+        response = get_static_file(urllib.parse.unquote(path[len('/static/'):]))
+        if response is None:
+            self.send_error(404, "File not found")
+            return
+        self.send_precomputed(response)
+    
+    def open_request_body(self):
+        """Check the body framing and size before reading anything.
+
+        Returns a RequestBody, or None after answering 400/411/413.
+        """
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            self.request_body = RequestBody(self.rfile, chunked=True)
+            return self.request_body
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.close_connection = True
+            self.send_json_response({'error': 'Content-Length or chunked transfer encoding is required'}, 411)
+            return None
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            self.close_connection = True
+            self.send_json_response({'error': 'Invalid Content-Length'}, 400)
+            return None
+        if length > MAX_REQUEST_BODY:
+            self.send_body_too_large()
+            return None
+        self.request_body = RequestBody(self.rfile, content_length=length)
+        return self.request_body
+    
+    def send_body_too_large(self):
+        # The rest of the body is never read, so the connection can't be reused
+        self.close_connection = True
+        self.send_json_response({'error': f'Request body is larger than {MAX_REQUEST_BODY} bytes'}, 413,
+                                headers={'Connection': 'close'})
+    
+    def send_precomputed(self, response):
+        """Send a prebuilt response, honouring Accept-Encoding and If-None-Match"""
+        encoding, body = response.select(self.headers.get('Accept-Encoding', ''))
+        etag = response.etag(encoding)
+        not_modified = response.matches(self.headers.get('If-None-Match', ''), etag)
+        self.send_response(304 if not_modified else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', response.cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        if response.content_type.startswith('application/json'):
+            self.send_header('Access-Control-Allow-Origin', '*')
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header('Content-type', response.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def can_chunk(self):
+        """Whether this response may use chunked transfer encoding"""
+        return self.protocol_version == 'HTTP/1.1' and self.request_version == 'HTTP/1.1'
     
-    def send_json_response(self, data, status=200):
-        """Send JSON response"""
+    def send_ndjson(self, items, status=200, headers=None):
+        """Stream items as newline-delimited JSON, sending each line as it is produced.
+
+        HTTP/1.1 clients get chunked framing, so the connection stays
+        usable; HTTP/1.0 clients see the body end when the connection closes.
+        """
+        chunked = self.can_chunk()
+        self.send_response(status)
+        self.send_header('Content-type', 'application/x-ndjson')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'no-cache')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        out = ChunkedWriter(self.wfile) if chunked else self.wfile
+        try:
+            for item in items:
+                out.write(json_dumps(item) + b'\n')
+                self.wfile.flush()
+            if chunked:
+                out.close()
+        except OSError:
+            self.close_connection = True
+        except Exception as e:
+            # The status line is already sent; all that's left is to cut the stream short
+            self.log_error("NDJSON stream error: %s", e)
+            self.close_connection = True
+        finally:
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+    
+    def send_json_response(self, data, status=200, headers=None):
+        """Send a JSON response; an iterator of objects is streamed as NDJSON instead"""
+        if not isinstance(data, (dict, list)):
+            self.send_ndjson(data, status, headers)
+            return
+        body = json_dumps(data)
         self.send_response(status)
         self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        self.wfile.write(body)
+
+class BoundedThreadPoolServer(socketserver.TCPServer):
+    """TCP server that hands connections to a fixed pool of worker threads.
+
+    Accepted connections wait in a bounded queue; once the queue is full new
+    connections are answered immediately with a 503 instead of piling up.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, workers=WORKER_THREADS,
+                 queue_size=REQUEST_QUEUE_SIZE, backlog=ACCEPT_BACKLOG, bind_and_activate=True):
+        self.request_queue_size = backlog
+        self.worker_count = max(1, workers)
+        self._pending = queue.Queue(maxsize=max(1, queue_size))
+        self._workers = []
+        self._stats_lock = threading.Lock()
+        self.active_requests = 0
+        self.served_requests = 0
+        self.rejected_requests = 0
+        super().__init__(server_address, handler_class, bind_and_activate)
+        for index in range(self.worker_count):
+            worker = threading.Thread(target=self._worker_loop, name=f"pokemon-worker-{index}")
+            worker.daemon = self.daemon_threads
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        """Queue the connection for a worker, or shed it when saturated"""
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected_requests += 1
+            self.reject_request(request)
+
+    def reject_request(self, request):
+        """Answer a connection with a fast 503 and close it"""
+        body = json.dumps({'error': 'Server is busy, please retry shortly'}).encode()
+        head = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Retry-After: 1\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode()
+        try:
+            # One non-blocking send: a slow client must not hold up the accept loop
+            request.setblocking(False)
+            request.send(head + body)
+        except OSError:  # includes BlockingIOError when the send buffer is full
+            pass
+        self.shutdown_request(request)
+
+    def _worker_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            request, client_address = item
+            with self._stats_lock:
+                self.active_requests += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._stats_lock:
+                    self.active_requests -= 1
+                    self.served_requests += 1
+
+    def waiting_connections(self):
+        return self._pending.qsize()
+
+    def pool_stats(self):
+        """Snapshot of worker pool usage"""
+        with self._stats_lock:
+            return {
+                'workers': self.worker_count,
+                'active': self.active_requests,
+                'queued': self._pending.qsize(),
+                'queue_size': self._pending.maxsize,
+                'served': self.served_requests,
+                'rejected': self.rejected_requests,
+            }
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._workers:
+            self._pending.put(None)
+        for worker in self._workers:
+            worker.join(timeout=1.0)
+        self._workers = []
+
+
+class LoopBridgeReader:
+    """Blocking file-like view of an asyncio StreamReader for a worker thread"""
+
+    def __init__(self, reader, loop, timeout=None):
+        self._reader = reader
+        self._loop = loop
+        self._timeout = timeout
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(self._timeout)
+
+    def read(self, size=-1):
+        return self._run(self._reader.read(size))
+
+    def readline(self, limit=-1):
+        return self._run(self._reader.readline())
+
+
+class LoopBridgeWriter(io.BytesIO):
+    """Response buffer for a worker thread that can stream to an asyncio StreamWriter.
+
+    Writes collect in the buffer as usual; flush() hands them to the event
+    loop and waits for the socket to drain, so a handler that flushes
+    (e.g. an NDJSON stream) reaches the client line by line.
+    """
 
-def open_browser():
+    HEAD_SIZE = 4096
+
+    def __init__(self, writer, loop, timeout=None):
+        super().__init__()
+        self._writer = writer
+        self._loop = loop
+        self._timeout = timeout
+        self.head = b''  # start of the flushed response, for the framing check
+        self.flushed = 0
+
+    def flush(self):
+        data = self.getvalue()
+        if not data:
+            return
+        self.seek(0)
+        self.truncate()
+        if len(self.head) < self.HEAD_SIZE:
+            self.head += data[:self.HEAD_SIZE - len(self.head)]
+        self.flushed += len(data)
+        asyncio.run_coroutine_threadsafe(self._send(data), self._loop).result(self._timeout)
+
+    async def _send(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+
+class AsyncRequestMixin:
+    """Runs PokemonCardHandler routes for one request parsed by the asyncio engine.
+
+    The handler methods write to self.wfile exactly as they do under
+    http.server; here wfile is a buffer the engine sends once the route
+    returns (blocking routes may flush parts of it earlier), so both
+    engines share the same route code.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    request_body = None
+
+    def __init__(self, server, client_address, method, path, version, headers, rfile, wfile=None):
+        self.server = server
+        self.client_address = client_address
+        self.command = method
+        self.path = path
+        self.request_version = version
+        self.requestline = f"{method} {path} {version}"
+        self.headers = headers
+        self.rfile = rfile
+        self.wfile = io.BytesIO() if wfile is None else wfile
+        self.close_connection = (version != 'HTTP/1.1' or
+                                 headers.get('Connection', '').lower() == 'close')
+
+    async def dispatch_async(self, executor):
+        self.log_fields = {}
+        self.in_route = True
+        route = find_route(self.command, self.path)
+        label = route_label(route)
+        METRICS.add('pokemon_http_requests_in_flight', (label,))
+        started = time.perf_counter()
+        try:
+            if route is None:
+                self.send_error(404, "File not found" if self.command == 'GET' else "Endpoint not found")
+                return
+            async_handler = getattr(self, f"{route.handler}_async", None)
+            if async_handler is not None:
+                await async_handler()
+            elif route.blocking:
+                await asyncio.get_running_loop().run_in_executor(executor, getattr(self, route.handler))
+            else:
+                getattr(self, route.handler)()
+        finally:
+            self.in_route = False
+            self.finish_request(label, started)
+
+    async def handle_search_api_async(self):
+        """handle_search_api() with non-blocking upstream I/O"""
+        try:
+            query = self.search_query()
+            
+            if not query:
+                self.send_json_response({'error': 'Search query is required'}, 400)
+                return
+            try:
+                cursor = self.search_cursor()
+            except ValueError as e:
+                self.send_json_response({'error': str(e)}, 400)
+                return
+            
+            if cursor is None and self.send_local_results(query):
+                return
+            
+            key = search_cache_key(query, cursor)
+            page, cache_status = SEARCH_CACHE.get(key, allow_expired=UPSTREAM_BREAKER.is_open())
+            if cache_status == 'miss':
+                started = time.perf_counter()
+                page = await ASYNC_SEARCH_FLIGHTS.do(key, lambda: search_bulbapedia_async(query, cursor=cursor))
+                self.log_fields['upstream_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                SEARCH_CACHE.set(key, page)
+            elif cache_status == 'stale':
+                SEARCH_CACHE.refresh_in_background(key, lambda: fetch_search_results(query, cursor))
+            self.send_search_results(query, page, cache_status)
+            
+        except UpstreamUnavailable as e:
+            self.send_upstream_unavailable(e)
+        except (UpstreamError, OSError) as e:
+            self.log_error("Search API upstream error: %s", e)
+            self.send_json_response({'error': 'Bulbapedia did not answer the search'}, 502)
+        except Exception as e:
+            self.log_error("Search API error: %s", e)
+            self.send_json_response({'error': 'Failed to search Bulbapedia'}, 500)
+
+    def bytes_sent(self):
+        return getattr(self.wfile, 'flushed', 0) + len(self.wfile.getvalue())
+
+    def body_pending(self):
+        # Bodies of non-blocking routes are read by the engine before dispatch
+        return not isinstance(self.rfile, io.BytesIO) and super().body_pending()
+
+    def keep_alive_exhausted(self):
+        # The engine manages connection lifetimes itself
+        return self.body_pending()
+
+    def response_started(self):
+        return bool(self.wfile.getvalue() or getattr(self.wfile, 'flushed', 0))
+
+    def response_bytes(self):
+        """The still-buffered response, and whether its framing allows keep-alive"""
+        data = self.wfile.getvalue()
+        head, _, _ = (getattr(self.wfile, 'head', b'') + data).partition(b'\r\n\r\n')
+        head = head.lower()
+        framed = (b'\r\ncontent-length:' in head or b'\r\ntransfer-encoding: chunked' in head or
+                  head.split(b' ', 2)[1:2] in ([b'204'], [b'304']))
+        return data, framed
+
+
+class AsyncioServer:
+    """Single-threaded asyncio HTTP/1.1 server using the shared route table.
+
+    Idle keep-alive connections and requests waiting on Bulbapedia cost a
+    coroutine rather than a thread. Routes without an async variant that may
+    block run on a small thread pool.
+    """
+
+    def __init__(self, server_address, handler_class, workers=WORKER_THREADS,
+                 backlog=ACCEPT_BACKLOG, idle_timeout=ASYNC_IDLE_TIMEOUT, sock=None):
+        self.request_class = type(f"Async{handler_class.__name__}", (AsyncRequestMixin, handler_class), {})
+        self.idle_timeout = idle_timeout
+        self.socket = sock if sock is not None else socket.create_server(server_address, backlog=backlog)
+        self.server_address = self.socket.getsockname()[:2]
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="pokemon-async-worker")
+        self._loop = None
+        self._stop = None
+        self._stopped = threading.Event()
+        self.open_connections = 0
+        self.requests = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
+    def serve_forever(self):
+        self._stopped.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stopped.set()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket)
+        async with server:
+            await self._stop.wait()
+        ASYNC_UPSTREAM.close()
+
+    def shutdown(self):
+        """Stop serve_forever() from another thread and wait for it to exit"""
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._stopped.wait()
+
+    def server_close(self):
+        self.socket.close()
+        self._executor.shutdown(wait=False)
+
+    def engine_stats(self):
+        return {'open_connections': self.open_connections, 'requests': self.requests}
+
+    async def _handle_connection(self, reader, writer):
+        self.open_connections += 1
+        client_address = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    request_line, headers = await read_http_head(reader, self.idle_timeout)
+                except (asyncio.TimeoutError, ConnectionError, ValueError):
+                    break
+                if request_line is None:
+                    break
+                parts = request_line.split()
+                if len(parts) != 3:
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                method, path, version = parts
+                route = find_route(method, path)
+                wfile = None
+                if route is not None and route.blocking:
+                    # The handler streams the body itself from a worker thread
+                    rfile = LoopBridgeReader(reader, asyncio.get_running_loop(), self.idle_timeout)
+                    wfile = LoopBridgeWriter(writer, asyncio.get_running_loop(), self.idle_timeout)
+                elif 'chunked' in headers.get('Transfer-Encoding', '').lower():
+                    rfile = io.BytesIO(await read_chunked_body(reader, MAX_REQUEST_BODY))
+                else:
+                    try:
+                        length = int(headers.get('Content-Length') or 0)
+                        if length < 0:
+                            raise ValueError(length)
+                    except ValueError:
+                        # Answered like open_request_body() does on the threaded engine
+                        request = self.request_class(self, client_address, method, path, version, headers,
+                                                     io.BytesIO())
+                        request.log_error("Invalid Content-Length: %r", headers.get('Content-Length'))
+                        request.send_json_response({'error': 'Invalid Content-Length'}, 400,
+                                                   headers={'Connection': 'close'})
+                        writer.write(request.response_bytes()[0])
+                        await writer.drain()
+                        break
+                    if length > MAX_REQUEST_BODY:
+                        writer.write(b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                        break
+                    rfile = io.BytesIO(await reader.readexactly(length))
+
+                request = self.request_class(self, client_address, method, path, version, headers, rfile, wfile)
+                self.requests += 1
+                try:
+                    await request.dispatch_async(self._executor)
+                except Exception:
+                    traceback.print_exc()
+                    if not request.response_started():
+                        request.send_error(500, "Internal server error")
+                data, framed = request.response_bytes()
+                writer.write(data)
+                await writer.drain()
+                if request.close_connection or not framed or request.body_pending():
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutdown; the connection is closed below
+            pass
+        finally:
+            self.open_connections -= 1
+            writer.close()
+
+
+# Prefork settings
+PROCESS_WORKERS = 1             # server processes sharing the port; 1 serves from the main process
+PREFORK_REUSE_PORT = False      # give each worker its own SO_REUSEPORT socket instead of one inherited socket
+PREFORK_SHUTDOWN_TIMEOUT = 10.0 # seconds workers get to finish after SIGTERM before they are killed
+PREFORK_MIN_UPTIME = 2.0        # workers that die sooner than this are restarted with a growing delay
+PREFORK_MAX_RESTART_DELAY = 30.0
+
+WORKER_INDEX = None             # index of this prefork worker process, None when not preforked
+
+# Startup settings
+HEADLESS = False                # never open a browser (containers, services, CI)
+
+STARTED_AT = time.time()        # process start, for /healthz uptime
+READY = threading.Event()       # set by warm_up(); /readyz answers 503 until then
+
+
+def create_listen_socket(port=PORT, host="", backlog=ACCEPT_BACKLOG, reuse_port=False):
+    """Bind a listening socket that create_server() can adopt.
+
+    Non-blocking, so a worker whose accept() loses the race for a connection
+    to another process returns to its loop instead of hanging in accept().
+    """
+    sock = socket.create_server((host, port), backlog=backlog, reuse_port=reuse_port)
+    sock.setblocking(False)
+    return sock
+
+
+def create_server(port=PORT, workers=WORKER_THREADS, queue_size=REQUEST_QUEUE_SIZE,
+                  backlog=ACCEPT_BACKLOG, host="", engine=SERVER_ENGINE, sock=None):
+    """Create the HTTP server for the requested serving mode, on sock when one is given"""
+    if engine == 'asyncio':
+        return AsyncioServer((host, port), PokemonCardHandler, workers=workers, backlog=backlog, sock=sock)
+    if workers <= 0:
+        server = socketserver.TCPServer((host, port), PokemonCardHandler, bind_and_activate=sock is None)
+    else:
+        server = BoundedThreadPoolServer((host, port), PokemonCardHandler, workers=workers,
+                                         queue_size=queue_size, backlog=backlog, bind_and_activate=sock is None)
+    if sock is not None:
+        server.socket.close()
+        server.socket = sock
+        server.server_address = sock.getsockname()[:2]
+    return server
+
+
+class PreforkSupervisor:
+    """Forks server worker processes and keeps them running.
+
+    A worker that exits while the supervisor isn't stopping is replaced;
+    one that dies within min_uptime of starting is restarted after a
+    growing delay, so a broken setup doesn't fork in a tight loop.
+    SIGTERM and SIGINT stop the workers gracefully (killing stragglers
+    after shutdown_timeout); SIGHUP makes every worker restart.
+    """
+
+    STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+    RESTART_SIGNALS = (signal.SIGHUP,) if hasattr(signal, 'SIGHUP') else ()
+
+    def __init__(self, workers, target, shutdown_timeout=PREFORK_SHUTDOWN_TIMEOUT,
+                 min_uptime=PREFORK_MIN_UPTIME, max_restart_delay=PREFORK_MAX_RESTART_DELAY):
+        self.workers = max(1, workers)
+        self.target = target  # called as target(index) in the forked worker
+        self.shutdown_timeout = shutdown_timeout
+        self.min_uptime = min_uptime
+        self.max_restart_delay = max_restart_delay
+        self.children = {}  # pid -> (index, started)
+        self.stopping = False
+        self.restarts = 0
+        self._pending = {}  # index -> monotonic time to respawn at
+        self._delays = {}   # index -> last restart delay
+        self._deadline = None
+        self.pid = os.getpid()
+
+    def spawn(self, index):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                for signum in self.STOP_SIGNALS + self.RESTART_SIGNALS:
+                    signal.signal(signum, _stop_worker)
+                code = self.target(index) or 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = (index, time.monotonic())
+        return pid
+
+    def _signal(self, signum, frame):
+        if os.getpid() != self.pid:
+            # Arrived in a just-forked worker before it installed its own handlers
+            _stop_worker(signum, frame)
+        if signum in self.STOP_SIGNALS and not self.stopping:
+            self.stopping = True
+            self._deadline = time.monotonic() + self.shutdown_timeout
+            self._pending.clear()
+        forwarded = signal.SIGTERM if signum in self.STOP_SIGNALS else signum
+        for pid in list(self.children):
+            try:
+                os.kill(pid, forwarded)
+            except ProcessLookupError:
+                pass
+
+    def _reap(self, pid, status):
+        index, started = self.children.pop(pid)
+        if self.stopping:
+            return
+        code = os.waitstatus_to_exitcode(status)
+        how = f"was killed by signal {-code}" if code < 0 else f"exited with status {code}"
+        if time.monotonic() - started < self.min_uptime:
+            delay = min(self.max_restart_delay, max(1.0, self._delays.get(index, 0.0) * 2))
+        else:
+            delay = 0.0
+        self._delays[index] = delay
+        self._pending[index] = time.monotonic() + delay
+        self.restarts += 1
+        print(f"⚠️  Worker {index} (pid {pid}) {how}; restarting" + (f" in {delay:.0f}s" if delay else ""))
+
+    def run(self, on_started=None):
+        """Fork the workers and supervise them until stopped; returns once all have exited"""
+        handled = self.STOP_SIGNALS + self.RESTART_SIGNALS
+        previous = {signum: signal.signal(signum, self._signal) for signum in handled}
+        try:
+            for index in range(self.workers):
+                self.spawn(index)
+            if on_started is not None:
+                on_started()
+            while self.children or self._pending:
+                now = time.monotonic()
+                for index, due in list(self._pending.items()):
+                    if due <= now and not self.stopping:
+                        del self._pending[index]
+                        self.spawn(index)
+                pid, status = os.waitpid(-1, os.WNOHANG) if self.children else (0, 0)
+                if pid:
+                    self._reap(pid, status)
+                    continue
+                if self.stopping and time.monotonic() > self._deadline:
+                    for pid in list(self.children):
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                time.sleep(0.1)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        return 0
+
+
+def _stop_worker(signum, frame):
+    """Signal handler in prefork workers: stop serving once, running the usual cleanup"""
+    # A Python-level no-op rather than SIG_IGN: a signal already pending (Ctrl+C
+    # reaches the workers directly as well as through the supervisor) would
+    # otherwise be reported as ignored due to a race
+    for stop_signum in PreforkSupervisor.STOP_SIGNALS + PreforkSupervisor.RESTART_SIGNALS:
+        signal.signal(stop_signum, _ignore_signal)
+    raise KeyboardInterrupt
+
+
+def _ignore_signal(signum, frame):
+    pass
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Pokemon Card Search - Python Server")
+    parser.add_argument('--port', type=int, default=PORT, help=f"port to listen on (default {PORT})")
+    parser.add_argument('--engine', choices=SERVER_ENGINES, default=SERVER_ENGINE,
+                        help=f"server engine (default {SERVER_ENGINE})")
+    parser.add_argument('--threads', type=int, default=WORKER_THREADS,
+                        help=f"request worker threads per process, 0 for single-threaded (default {WORKER_THREADS})")
+    parser.add_argument('--workers', type=int, default=PROCESS_WORKERS,
+                        help=f"server processes sharing the port, to use more than one core "
+                             f"(default {PROCESS_WORKERS}; needs fork, so not on Windows)")
+    parser.add_argument('--reuse-port', action='store_true', default=PREFORK_REUSE_PORT,
+                        help="give each worker process its own SO_REUSEPORT socket so the kernel "
+                             "balances connections (Linux)")
+    parser.add_argument('--headless', action='store_true', default=HEADLESS,
+                        help="don't open a browser on startup (containers, services, CI)")
+    parser.add_argument('--queue-size', type=int, default=REQUEST_QUEUE_SIZE,
+                        help=f"connections allowed to wait for a worker before 503s (default {REQUEST_QUEUE_SIZE})")
+    parser.add_argument('--backlog', type=int, default=ACCEPT_BACKLOG,
+                        help=f"listen socket accept backlog (default {ACCEPT_BACKLOG})")
+    parser.add_argument('--keepalive-timeout', type=float, default=KEEPALIVE_IDLE_TIMEOUT,
+                        help=f"seconds an idle connection is kept open by the threaded engine "
+                             f"(default {KEEPALIVE_IDLE_TIMEOUT})")
+    parser.add_argument('--keepalive-max-requests', type=int, default=KEEPALIVE_MAX_REQUESTS,
+                        help=f"requests served per connection before closing it (default {KEEPALIVE_MAX_REQUESTS})")
+    parser.add_argument('--upstream-connect-timeout', type=float, default=UPSTREAM_CONNECT_TIMEOUT,
+                        help=f"seconds to connect to Bulbapedia (default {UPSTREAM_CONNECT_TIMEOUT})")
+    parser.add_argument('--upstream-read-timeout', type=float, default=UPSTREAM_READ_TIMEOUT,
+                        help=f"seconds to wait for Bulbapedia responses (default {UPSTREAM_READ_TIMEOUT})")
+    parser.add_argument('--upstream-pool-size', type=int, default=UPSTREAM_POOL_SIZE,
+                        help=f"idle keep-alive connections kept per upstream host (default {UPSTREAM_POOL_SIZE})")
+    parser.add_argument('--upstream-rate', type=float, default=UPSTREAM_RATE,
+                        help=f"max Bulbapedia requests per second, 0 for no limit (default {UPSTREAM_RATE})")
+    parser.add_argument('--upstream-burst', type=int, default=UPSTREAM_BURST,
+                        help=f"Bulbapedia requests allowed back to back (default {UPSTREAM_BURST})")
+    parser.add_argument('--breaker-failures', type=int, default=BREAKER_FAILURES,
+                        help=f"consecutive failed or slow Bulbapedia calls that stop further calls "
+                             f"(default {BREAKER_FAILURES})")
+    parser.add_argument('--breaker-slow-call', type=float, default=BREAKER_SLOW_CALL,
+                        help=f"seconds after which a Bulbapedia call counts as failed (default {BREAKER_SLOW_CALL})")
+    parser.add_argument('--breaker-cooldown', type=float, default=BREAKER_COOLDOWN,
+                        help=f"seconds to stop calling Bulbapedia after it fails (default {BREAKER_COOLDOWN})")
+    parser.add_argument('--search-strategy', choices=SEARCH_STRATEGIES, default=SEARCH_STRATEGY,
+                        help=f"run the TCG and fallback searches one after another or in parallel (default {SEARCH_STRATEGY})")
+    parser.add_argument('--search-deadline', type=float, default=SEARCH_PRIMARY_DEADLINE,
+                        help=f"seconds the parallel strategy waits for TCG results (default {SEARCH_PRIMARY_DEADLINE})")
+    parser.add_argument('--bulk-search-concurrency', type=int, default=BULK_SEARCH_CONCURRENCY,
+                        help=f"upstream searches in flight for /api/search/bulk (default {BULK_SEARCH_CONCURRENCY})")
+    parser.add_argument('--search-prefetch-concurrency', type=int, default=SEARCH_PREFETCH_CONCURRENCY,
+                        help=f"next-page prefetches in flight, 0 disables them (default {SEARCH_PREFETCH_CONCURRENCY})")
+    parser.add_argument('--search-prefetch-queue', type=int, default=SEARCH_PREFETCH_QUEUE,
+                        help=f"prefetches waiting for a worker before more are dropped (default {SEARCH_PREFETCH_QUEUE})")
+    parser.add_argument('--max-body-size', type=int, default=MAX_REQUEST_BODY,
+                        help=f"largest accepted request body in bytes (default {MAX_REQUEST_BODY})")
+    parser.add_argument('--cache-size', type=int, default=SEARCH_CACHE_SIZE,
+                        help=f"max cached search queries (default {SEARCH_CACHE_SIZE})")
+    parser.add_argument('--cache-ttl', type=float, default=SEARCH_CACHE_TTL,
+                        help=f"seconds search results stay fresh (default {SEARCH_CACHE_TTL})")
+    parser.add_argument('--cache-stale-ttl', type=float, default=SEARCH_CACHE_STALE_TTL,
+                        help=f"extra seconds stale results are served while refreshing (default {SEARCH_CACHE_STALE_TTL})")
+    parser.add_argument('--cache-file', default=SEARCH_CACHE_FILE,
+                        help="persist the search cache to this JSON file")
+    parser.add_argument('--index-dir', default=CARD_INDEX_DIR,
+                        help="serve searches from the local card index in this directory first")
+    parser.add_argument('--index-add', metavar='DUMP',
+                        help="import a JSON-lines dump of card pages into --index-dir and exit")
+    parser.add_argument('--index-compact', action='store_true',
+                        help="merge the segments in --index-dir into one and exit")
+    parser.add_argument('--catalog', default=CATALOG_FILE,
+                        help="serve /api/cards and /api/sets from this SQLite card catalog (created if missing)")
+    parser.add_argument('--catalog-import', metavar='DUMP',
+                        help="import a JSON-lines dump of sets and cards into --catalog and exit")
+    parser.add_argument('--card-hashes', default=CARD_HASH_INDEX,
+                        help="match uploaded images against this card hash index")
+    parser.add_argument('--card-hashes-build', metavar='IMAGE_DIR',
+                        help="hash the card images in IMAGE_DIR into --card-hashes and exit")
+    parser.add_argument('--image-workers', type=int, default=IMAGE_WORKERS,
+                        help=f"processes for image decoding and hashing, 0 to do it in request threads "
+                             f"(default {IMAGE_WORKERS})")
+    parser.add_argument('--image-queue-size', type=int, default=IMAGE_QUEUE_SIZE,
+                        help=f"image tasks allowed queued or running before 503s (default {IMAGE_QUEUE_SIZE})")
+    parser.add_argument('--image-task-timeout', type=float, default=IMAGE_TASK_TIMEOUT,
+                        help=f"seconds before an image task is abandoned (default {IMAGE_TASK_TIMEOUT})")
+    parser.add_argument('--image-worker-max-tasks', type=int, default=IMAGE_WORKER_MAX_TASKS,
+                        help=f"tasks per image worker process before it is replaced "
+                             f"(default {IMAGE_WORKER_MAX_TASKS})")
+    parser.add_argument('--access-log', default=ACCESS_LOG_FILE, metavar='FILE',
+                        help="write JSON access log lines to FILE, '-' for stderr (default '-')")
+    parser.add_argument('--access-log-max-bytes', type=int, default=ACCESS_LOG_MAX_BYTES,
+                        help=f"rotate the access log file past this size, 0 to never rotate "
+                             f"(default {ACCESS_LOG_MAX_BYTES})")
+    parser.add_argument('--access-log-backups', type=int, default=ACCESS_LOG_BACKUPS,
+                        help=f"rotated access log files kept (default {ACCESS_LOG_BACKUPS})")
+    parser.add_argument('--access-log-queue-size', type=int, default=ACCESS_LOG_QUEUE_SIZE,
+                        help=f"access log lines buffered before new ones are dropped (default {ACCESS_LOG_QUEUE_SIZE})")
+    parser.add_argument('--access-log-sample', action='append', default=[], metavar='ROUTE=RATE',
+                        help="log only this share of successful requests to ROUTE, e.g. /api/suggest=0.1 "
+                             "(repeatable; errors are always logged)")
+    return parser.parse_args(argv)
+
+
+def configure_access_log(args):
+    """Start the background access log writer"""
+    global ACCESS_LOG
+    sample_rates = dict(ACCESS_LOG_SAMPLE)
+    for item in args.access_log_sample:
+        route, _, rate = item.rpartition('=')
+        try:
+            rate = float(rate)
+        except ValueError:
+            route = ''
+        if not route:
+            print(f"⚠️  Ignoring --access-log-sample {item!r}: expected ROUTE=RATE")
+            continue
+        sample_rates[route] = min(max(rate, 0.0), 1.0)
+    path = args.access_log
+    if WORKER_INDEX is not None and path != '-' and (os.path.isfile(path) or not os.path.exists(path)):
+        # Each prefork worker rotates its own file; rotating a shared one would race
+        root, ext = os.path.splitext(path)
+        path = f"{root}-worker{WORKER_INDEX}{ext}"
+    ACCESS_LOG = AccessLog(path, args.access_log_max_bytes, args.access_log_backups,
+                           args.access_log_queue_size, sample_rates=sample_rates)
+    return ACCESS_LOG
+
+
+def configure_request_limits(args):
+    """Apply the request body size and keep-alive limits"""
+    global MAX_REQUEST_BODY, KEEPALIVE_IDLE_TIMEOUT, KEEPALIVE_MAX_REQUESTS
+    MAX_REQUEST_BODY = args.max_body_size
+    KEEPALIVE_IDLE_TIMEOUT = args.keepalive_timeout
+    KEEPALIVE_MAX_REQUESTS = max(1, args.keepalive_max_requests)
+
+
+def configure_upstream(args):
+    """Replace the shared upstream clients with ones built from command line options"""
+    global UPSTREAM, ASYNC_UPSTREAM, UPSTREAM_LIMITER, UPSTREAM_BREAKER
+    UPSTREAM_LIMITER = TokenBucket(args.upstream_rate, args.upstream_burst)
+    UPSTREAM_BREAKER = CircuitBreaker(args.breaker_failures, args.breaker_slow_call, args.breaker_cooldown)
+    UPSTREAM.close()
+    UPSTREAM = UpstreamClient(args.upstream_connect_timeout, args.upstream_read_timeout,
+                              args.upstream_pool_size, limiter=UPSTREAM_LIMITER, breaker=UPSTREAM_BREAKER)
+    ASYNC_UPSTREAM = AsyncUpstreamClient(args.upstream_connect_timeout, args.upstream_read_timeout,
+                                         args.upstream_pool_size, limiter=UPSTREAM_LIMITER, breaker=UPSTREAM_BREAKER)
+    return UPSTREAM
+
+
+def configure_search_strategy(args):
+    """Apply the search strategy command line options"""
+    global SEARCH_STRATEGY, SEARCH_PRIMARY_DEADLINE, BULK_SEARCH_CONCURRENCY
+    global SEARCH_PREFETCH_CONCURRENCY, SEARCH_PREFETCH_QUEUE
+    SEARCH_STRATEGY = args.search_strategy
+    SEARCH_PRIMARY_DEADLINE = args.search_deadline
+    BULK_SEARCH_CONCURRENCY = max(1, args.bulk_search_concurrency)
+    SEARCH_PREFETCH_CONCURRENCY = max(0, args.search_prefetch_concurrency)
+    SEARCH_PREFETCH_QUEUE = max(0, args.search_prefetch_queue)
+
+
+def configure_local_index(args):
+    """Open the local card index, if one was configured"""
+    global LOCAL_INDEX
+    if args.index_dir:
+        LOCAL_INDEX = LocalCardIndex(args.index_dir)
+        print(f"✅ Local card index: {LOCAL_INDEX.document_count()} cards in {len(LOCAL_INDEX.segments)} segments")
+    return LOCAL_INDEX
+
+
+def run_index_tool(args):
+    """Handle the --index-add / --index-compact maintenance commands"""
+    if not args.index_dir:
+        print("❌ --index-dir is required to build the local card index")
+        return 1
+    index = LocalCardIndex(args.index_dir)
+    try:
+        if args.index_add:
+            count = index.add_dump(args.index_add)
+            print(f"✅ Indexed {count} cards from {args.index_add}")
+        if args.index_compact:
+            index.compact()
+            print(f"✅ Compacted index to {len(index.segments)} segment(s)")
+        print(f"✅ {index.document_count()} cards in {len(index.segments)} segment(s)")
+    finally:
+        index.close()
+    return 0
+
+
+def configure_catalog(args):
+    """Open the card catalog, if one was configured"""
+    global CATALOG
+    if args.catalog:
+        CATALOG = CardCatalog(args.catalog)
+        SUGGESTIONS.seed([set_info['title'] for set_info in CATALOG.sets()], 5)
+        print(f"✅ Card catalog: {CATALOG.card_count} cards in {CATALOG.set_count} sets")
+    return CATALOG
+
+
+def run_catalog_tool(args):
+    """Handle the --catalog-import maintenance command"""
+    if not args.catalog:
+        print("❌ --catalog is required to import a card catalog dump")
+        return 1
+    catalog = CardCatalog(args.catalog)
+    try:
+        started = time.perf_counter()
+        sets, cards = catalog.import_dump(args.catalog_import)
+        print(f"✅ Imported {sets} sets and {cards} cards from {args.catalog_import} "
+              f"in {time.perf_counter() - started:.1f}s")
+        print(f"✅ {catalog.card_count} cards in {catalog.set_count} sets")
+    finally:
+        catalog.close()
+    return 0
+
+
+def configure_card_images(args):
+    """Load the card image hash index, if one was configured"""
+    global CARD_IMAGES
+    if args.card_hashes:
+        CARD_IMAGES = CardImageIndex.load(args.card_hashes)
+        print(f"✅ Card image matching: {len(CARD_IMAGES)} reference cards")
+        if Image is None:
+            print("⚠️  Pillow is not installed, so uploaded images can't be decoded (pip install pillow)")
+    return CARD_IMAGES
+
+
+def configure_image_workers(args):
+    """Start the image worker processes, before any request threads exist"""
+    global IMAGE_POOL
+    if CARD_IMAGES is None or Image is None or args.image_workers <= 0:
+        return None
+    queue_size = args.image_queue_size
+    if queue_size < MAX_BATCH_IMAGES:
+        # A batch reserves a slot per image up front, so a smaller queue could never admit a full one
+        print(f"⚠️  --image-queue-size {queue_size} can't hold a {MAX_BATCH_IMAGES}-image batch; using {MAX_BATCH_IMAGES}")
+        queue_size = MAX_BATCH_IMAGES
+    IMAGE_POOL = ImageWorkerPool(args.image_workers, queue_size,
+                                 args.image_task_timeout, args.image_worker_max_tasks)
+    print(f"✅ Image work offloaded to {args.image_workers} worker processes")
+    return IMAGE_POOL
+
+
+def run_card_hash_tool(args):
+    """Handle the --card-hashes-build maintenance command"""
+    if not args.card_hashes:
+        print("❌ --card-hashes is required to build the card hash index")
+        return 1
+    if Image is None:
+        print("❌ Pillow is required to hash card images (pip install pillow)")
+        return 1
+    index = CardImageIndex.build(args.card_hashes_build)
+    index.save(args.card_hashes)
+    print(f"✅ Hashed {len(index)} card images into {args.card_hashes}")
+    return 0
+
+
+def configure_search_cache(args):
+    """Replace the module search cache with one built from command line options"""
+    global SEARCH_CACHE
+    SEARCH_CACHE = SearchResultCache(args.cache_size, args.cache_ttl, args.cache_stale_ttl, args.cache_file)
+    if SEARCH_CACHE.path:
+        loaded = SEARCH_CACHE.load()
+        print(f"✅ Loaded {loaded} cached searches from {SEARCH_CACHE.path}")
+    return SEARCH_CACHE
+
+def warm_up():
+    """Prebuild what the first requests would otherwise wait on, then report ready.
+
+    Runs in a background thread once the socket is bound, so /healthz answers
+    meanwhile, or in the prefork parent before any worker is forked, so every
+    worker starts out ready. Starts no threads of its own.
+    """
+    started = time.perf_counter()
+    build_static_responses()
+    get_tcg_classifier()
+    if CARD_IMAGES is not None and Image is not None:
+        # Deferred at import time; loaded here rather than inside an upload
+        loaded(Image)
+        loaded(statistics)
+        if numpy is not None:
+            CARD_IMAGES._reference_arrays()
+    READY.set()
+    return time.perf_counter() - started
+
+
+def start_warm_up_thread():
+    def run():
+        elapsed = warm_up()
+        print(f"✅ Ready in {elapsed * 1000:.0f} ms")
+    threading.Thread(target=run, name='warm-up', daemon=True).start()
+
+
+def open_browser(port=PORT):
     """Open browser after a delay"""
     time.sleep(2)
-    webbrowser.open(f'http://localhost:{PORT}')
+    webbrowser.open(f'http://localhost:{port}')
 
-def main():
-    """Main function to start the server"""
+def print_banner(args):
+    print("=" * 50)
+    print("🐍 Pokemon Card Search - Python Server")
+    print("=" * 50)
+    print(f"✅ Server running at: http://localhost:{args.port}")
+    if args.workers > 1:
+        print(f"✅ {args.workers} worker processes sharing the port"
+              + (" (SO_REUSEPORT)" if args.reuse_port else ""))
+    if args.engine == 'asyncio':
+        print(f"✅ Serving with the asyncio engine ({args.threads} threads for blocking work)")
+    elif args.threads > 0:
+        print(f"✅ Serving with {args.threads} worker threads (queue {args.queue_size}, backlog {args.backlog})")
+    print(f"✅ No Node.js required!")
+    print(f"✅ More stable than the Node.js version")
+    print("")
+    print("🔍 Features available:")
+    print("  • Search Pokemon cards by name")
+    print("  • Upload card images for analysis")
+    print("  • Browse TCG sets and expansions")
+    print("  • Access external card databases")
+    print("")
+    print("Press Ctrl+C to stop the server")
+    print("=" * 50)
+
+
+def print_server_error(port, error):
+    if "Address already in use" in str(error):
+        print(f"❌ Port {port} is already in use!")
+        print("Try closing other applications or restart your computer.")
+        print("Or edit this file to change the PORT variable to a different number.")
+    else:
+        print(f"❌ Server error: {error}")
+
+
+def start_browser_thread(port):
+    browser_thread = threading.Thread(target=open_browser, args=(port,))
+    browser_thread.daemon = True
+    browser_thread.start()
+
+
+def serve(args, sock=None):
+    """Start the per-process background work and serve until stopped.
+
+    Runs in the main process, or in each prefork worker (WORKER_INDEX set)
+    after the fork, so no worker inherits another process's threads.
+    """
+    worker = WORKER_INDEX is not None
+    configure_image_workers(args)
+    configure_access_log(args)
+    SEARCH_CACHE.start_autosave()
     try:
-        # Check if port is available
-        with socketserver.TCPServer(("", PORT), PokemonCardHandler) as httpd:
-            print("=" * 50)
-            print("🐍 Pokemon Card Search - Python Server")
-            print("=" * 50)
-            print(f"✅ Server running at: http://localhost:{PORT}")
-            print(f"✅ No Node.js required!")
-            print(f"✅ More stable than the Node.js version")
-            print("")
-            print("🔍 Features available:")
-            print("  • Search Pokemon cards by name")
-            print("  • Upload card images for analysis")
-            print("  • Browse TCG sets and expansions")
-            print("  • Access external card databases")
-            print("")
-            print("Press Ctrl+C to stop the server")
-            print("=" * 50)
-            
-            # Open browser in a separate thread
-            browser_thread = threading.Thread(target=open_browser)
-            browser_thread.daemon = True
-            browser_thread.start()
+        with create_server(args.port, args.threads, args.queue_size, args.backlog,
+                           engine=args.engine, sock=sock) as httpd:
+            if not worker:
+                print_banner(args)
+                if not args.headless:
+                    start_browser_thread(args.port)
+            if not READY.is_set():
+                start_warm_up_thread()
             
             # Start the server
             httpd.serve_forever()
             
     except OSError as e:
-        if "Address already in use" in str(e):
-            print(f"❌ Port {PORT} is already in use!")
-            print("Try closing other applications or restart your computer.")
-            print("Or edit this file to change the PORT variable to a different number.")
-        else:
-            print(f"❌ Server error: {e}")
+        print_server_error(args.port, e)
+        return 1
     except KeyboardInterrupt:
-        print("\n🛑 Server stopped by user")
+        if not worker:
+            print("\n🛑 Server stopped by user")
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
+        return 1
+    finally:
+        SEARCH_CACHE.save()
+        if IMAGE_POOL is not None:
+            IMAGE_POOL.close()
+        if ACCESS_LOG is not None:
+            ACCESS_LOG.close()
+    return 0
+
+
+def run_worker(args, sock, index):
+    """Body of a prefork worker process"""
+    global WORKER_INDEX, STARTED_AT
+    WORKER_INDEX = index
+    STARTED_AT = time.time()
+    if sock is None:
+        sock = create_listen_socket(args.port, backlog=args.backlog, reuse_port=True)
+    return serve(args, sock)
+
+
+def run_prefork(args):
+    """Serve from args.workers forked processes under a PreforkSupervisor"""
+    reuse_port = args.reuse_port and hasattr(socket, 'SO_REUSEPORT')
+    if args.reuse_port and not reuse_port:
+        print("⚠️  SO_REUSEPORT isn't available here; workers will share one socket")
+    args.reuse_port = reuse_port
+    sock = None
+    try:
+        if not reuse_port:
+            # Bound before forking, so every worker inherits the same listening socket
+            sock = create_listen_socket(args.port, backlog=args.backlog)
+        else:
+            # Fail fast on a busy port instead of letting every worker fail to bind
+            create_listen_socket(args.port, backlog=args.backlog, reuse_port=True).close()
+    except OSError as e:
+        print_server_error(args.port, e)
+        return 1
+    supervisor = PreforkSupervisor(args.workers, lambda index: run_worker(args, sock, index))
+    print_banner(args)
+    elapsed = warm_up()
+    print(f"✅ Ready in {elapsed * 1000:.0f} ms")
+    # The browser thread starts after the first fork so workers don't inherit it
+    on_started = None if args.headless else lambda: start_browser_thread(args.port)
+    try:
+        return supervisor.run(on_started=on_started)
+    finally:
+        if sock is not None:
+            sock.close()
+        print("\n🛑 Server stopped")
+
+
+def main(argv=None):
+    """Main function to start the server"""
+    args = parse_args(argv)
+    if args.index_add or args.index_compact:
+        return run_index_tool(args)
+    if args.card_hashes_build:
+        return run_card_hash_tool(args)
+    if args.catalog_import:
+        return run_catalog_tool(args)
+    configure_request_limits(args)
+    configure_upstream(args)
+    configure_search_strategy(args)
+    # Read-only data is loaded once here; prefork workers share it copy-on-write
+    configure_search_cache(args)
+    configure_local_index(args)
+    configure_catalog(args)
+    configure_card_images(args)
+    if args.workers > 1:
+        if hasattr(os, 'fork'):
+            return run_prefork(args)
+        print("⚠️  --workers needs os.fork(), which this platform lacks; serving from one process")
+        args.workers = 1
+    return serve(args)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file